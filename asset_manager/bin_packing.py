@@ -1,8 +1,26 @@
 # media_bundler/bundle.py
 
-"""A simple 2D bin packing algorithm for making sprites."""
+"""2D bin packing algorithms for making sprites.
 
+Three strategies are available through pack_boxes:
+
+- 'shelf' fills horizontal strips with boxes sorted by height.  It's the
+  fastest, but leaves gaps above the shorter boxes in each strip.
+- 'maxrects' keeps a list of the maximal free rectangles and puts each box in
+  the one it fits best (best short side fit).  It packs tightest.
+- 'skyline' tracks the top edge of the packed boxes and puts each box as low,
+  then as far left, as it can (bottom-left), reusing the gaps it leaves.
+  It's nearly as tight as maxrects, and faster.
+
+asset_manager/tests/benchmark_packing.py compares them.  search_width
+tries many widths with one of them and keeps the smallest sprite.
+"""
+
+import bisect
+import heapq
 import math
+import multiprocessing
+import time
 
 
 class Box(object):
@@ -29,20 +47,31 @@ class Box(object):
         return "Box(%r, %r)" % (self.width, self.height)
 
 
-def pack_boxes(boxes, max_width=None):
+def pack_boxes(boxes, max_width=None, strategy='shelf'):
     """Approximately packs boxes in a rectangle with minimal area.
 
-    Basic algorithm:
+    Returns (width, height, packing), where packing is a list of
+    (left, top, box) tuples.  `strategy` is one of STRATEGIES.
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError("Unknown packing strategy: %r" % strategy)
+    if max_width is None:
+        total_area = sum(box.width * box.height for box in boxes)
+        max_width = max(max(box.width for box in boxes),
+                        int(math.sqrt(total_area)))
+    elif any(box.width > max_width for box in boxes):
+        raise ValueError("A box is wider than %r" % max_width)
+    return STRATEGIES[strategy](boxes, max_width)
+
+
+def _pack_shelf(boxes, max_width):
+    """Basic algorithm:
     - Pick a width so that our rectangle comes out squarish.
     - Sort the boxes by their width.
     - While there are more boxes, attempt to fill a horizontal strip:
       - For each box that we haven't already placed, if it fits in the strip,
         place it, otherwise continue checking the rest of the boxes.
     """
-    if max_width is None:
-        total_area = sum(box.width * box.height for box in boxes)
-        max_width = max(max(box.width for box in boxes),
-                        int(math.sqrt(total_area)))
     unplaced = sorted(boxes, key=lambda box: (-box.height, -box.width))
     packing = []
     y_off = 0
@@ -62,29 +91,299 @@ def pack_boxes(boxes, max_width=None):
     return (max_width, y_off, packing)
 
 
+def _contains(outer, inner):
+    (x1, y1, w1, h1) = outer
+    (x2, y2, w2, h2) = inner
+    return x1 <= x2 and y1 <= y2 and x2 + w2 <= x1 + w1 and y2 + h2 <= y1 + h1
+
+
+def _split_free_rect(free, used):
+    """The maximal rectangles left of `free` once `used` is taken out of it,
+    or None if they don't intersect."""
+    (fx, fy, fw, fh) = free
+    (ux, uy, uw, uh) = used
+    if ux >= fx + fw or ux + uw <= fx or uy >= fy + fh or uy + uh <= fy:
+        return None
+    rects = []
+    if uy > fy:
+        rects.append((fx, fy, fw, uy - fy))
+    if uy + uh < fy + fh:
+        rects.append((fx, uy + uh, fw, fy + fh - uy - uh))
+    if ux > fx:
+        rects.append((fx, fy, ux - fx, fh))
+    if ux + uw < fx + fw:
+        rects.append((ux + uw, fy, fx + fw - ux - uw, fh))
+    return rects
+
+
+def _pack_maxrects(boxes, max_width):
+    """MaxRects, best short side fit.
+
+    The free space starts as a single column max_width wide and as tall as
+    all the boxes stacked.  Each box, tallest first, goes in the top left
+    corner of the free rectangle that leaves the least room along its
+    shorter side, measuring free rectangles only down to the bottom of the
+    sprite so far; boxes that don't fit above the bottom go where they add
+    the least height.  The free rectangles the box overlaps are split into
+    the maximal rectangles around it, and any that end up inside another
+    are dropped.  Only the new rectangles need checking against the rest,
+    so each placement is linear in the number of free rectangles.
+    """
+    unplaced = sorted(boxes, key=lambda box: (-box.height, -box.width))
+    free = [(0, 0, max_width, sum(box.height for box in boxes))]
+    packing = []
+    height = 0
+    for box in unplaced:
+        best = None
+        for (x, y, w, h) in free:
+            if box.width > w or box.height > h:
+                continue
+            bottom = min(y + h, max(height, y + box.height))
+            leftover_w = w - box.width
+            leftover_h = bottom - y - box.height
+            score = (max(0, y + box.height - height),
+                     min(leftover_w, leftover_h),
+                     max(leftover_w, leftover_h), y, x)
+            if best is None or score < best:
+                best = score
+        (_, _, _, top, left) = best
+        used = (left, top, box.width, box.height)
+        packing.append((left, top, box))
+        height = max(height, top + box.height)
+        kept = []
+        new = []
+        for rect in free:
+            split = _split_free_rect(rect, used)
+            if split is None:
+                kept.append(rect)
+            else:
+                new.extend(split)
+        new = [rect for (i, rect) in enumerate(new)
+               if not any(_contains(other, rect) and (other != rect or j < i)
+                          for (j, other) in enumerate(new) if j != i)]
+        # A kept rectangle can't be inside a new one: each new rectangle is
+        # inside one that was already free, and that was checked before.
+        new = [rect for rect in new
+               if not any(_contains(other, rect) for other in kept)]
+        free = kept + new
+    return (max_width, height, packing)
+
+
+def _place_in_waste(box, waste):
+    """Put `box` in the best fitting of the `waste` rectangles, splitting
+    what's left of it in two.  Returns the box's (left, top), or None."""
+    best = None
+    for (i, (x, y, w, h)) in enumerate(waste):
+        if box.width <= w and box.height <= h:
+            score = (min(w - box.width, h - box.height), y, x)
+            if best is None or score < best:
+                best = score
+                best_index = i
+    if best is None:
+        return None
+    (x, y, w, h) = waste.pop(best_index)
+    if w - box.width > h - box.height:
+        rects = [(x + box.width, y, w - box.width, h),
+                 (x, y + box.height, box.width, h - box.height)]
+    else:
+        rects = [(x, y + box.height, w, h - box.height),
+                 (x + box.width, y, w - box.width, box.height)]
+    waste.extend(rect for rect in rects if rect[2] and rect[3])
+    return (x, y)
+
+
+def _pack_skyline(boxes, max_width):
+    """Skyline, bottom-left, with a waste map.
+
+    The skyline is a list of [x, y, width] segments along the top edge of
+    the boxes placed so far, from left to right.  Each box, tallest first,
+    goes where its top ends up lowest, and then furthest left, among the
+    positions that start at a segment.  The gaps left under a box that
+    spans segments of different heights go in a waste map, and later boxes
+    that fit in one of those go there instead.  Neighbouring segments at the
+    same height are merged, which keeps the skyline short.
+    """
+    unplaced = sorted(boxes, key=lambda box: (-box.height, -box.width))
+    skyline = [[0, 0, max_width]]
+    waste = []
+    packing = []
+    height = 0
+    for box in unplaced:
+        position = _place_in_waste(box, waste)
+        if position is not None:
+            packing.append(position + (box,))
+            continue
+        best = None
+        for i in xrange(len(skyline)):
+            x = skyline[i][0]
+            if x + box.width > max_width:
+                break
+            # The box rests on the highest segment it spans.
+            y = 0
+            right = x + box.width
+            j = i
+            while j < len(skyline) and skyline[j][0] < right:
+                y = max(y, skyline[j][1])
+                j += 1
+            score = (y + box.height, x)
+            if best is None or score < best:
+                best = score
+                best_index = i
+        (bottom, left) = best
+        top = bottom - box.height
+        packing.append((left, top, box))
+        height = max(height, bottom)
+        # Replace the segments under the box with one along its top, and
+        # remember the gaps between them and the box.
+        right = left + box.width
+        i = best_index
+        j = i
+        while j < len(skyline) and skyline[j][0] < right:
+            (x, y, width) = skyline[j]
+            if y < top:
+                waste.append((x, y, min(right, x + width) - x, top - y))
+            j += 1
+        (last_x, last_y, last_width) = skyline[j - 1]
+        segments = [[left, bottom, box.width]]
+        if last_x + last_width > right:
+            segments.append([right, last_y, last_x + last_width - right])
+        skyline[i:j] = segments
+        merged = [skyline[0]]
+        for segment in skyline[1:]:
+            if segment[1] == merged[-1][1]:
+                merged[-1][2] += segment[2]
+            else:
+                merged.append(segment)
+        skyline = merged
+    return (max_width, height, packing)
+
+
+STRATEGIES = {
+    'shelf': _pack_shelf,
+    'maxrects': _pack_maxrects,
+    'skyline': _pack_skyline,
+}
+
+
+def _candidate_widths(boxes, step, max_size):
+    """Widths to try, multiples of `step` wide enough for every box, from
+    the squarish width outwards."""
+    widest = max(box.width for box in boxes)
+    total_area = sum(box.width * box.height for box in boxes)
+    smallest = -(-widest // step) * step
+    largest = sum(box.width for box in boxes)
+    if max_size is not None:
+        largest = min(largest, max_size)
+    largest = max(smallest, -(-largest // step) * step)
+    square = max(smallest, (int(math.sqrt(total_area)) // step + 1) * step)
+    square = min(square, largest)
+    widths = [square]
+    (narrower, wider) = (square - step, square + step)
+    while narrower >= smallest or wider <= largest:
+        if narrower >= smallest:
+            widths.append(narrower)
+            narrower -= step
+        if wider <= largest:
+            widths.append(wider)
+            wider += step
+    return widths
+
+
+def _pack_sizes((sizes, width, strategy, deadline)):
+    """Pack boxes of the given (width, height) sizes, for a worker process.
+    The packing comes back as (left, top, index) tuples, or None if the
+    deadline has passed."""
+    if deadline is not None and time.time() >= deadline:
+        return None
+    boxes = [Box(w, h) for (w, h) in sizes]
+    index = dict((id(box), i) for (i, box) in enumerate(boxes))
+    (width, height, packing) = pack_boxes(boxes, width, strategy)
+    return (width, height,
+            [(left, top, index[id(box)]) for (left, top, box) in packing])
+
+
+def search_width(boxes, strategy='shelf', step=16, max_size=None,
+                 seconds=None, widths=None, pool=None):
+    """Pack the boxes at many widths and return the (width, height, packing)
+    with the smallest area.
+
+    Widths are multiples of `step`, tried from the squarish width outwards.
+    Packings wider or taller than `max_size` are rejected.  The search stops
+    after `seconds`, or after trying `widths` widths, keeping the best so
+    far.  If there are enough boxes and widths to make it worthwhile, the
+    widths are packed in parallel on `pool`, a multiprocessing.Pool, if
+    it's given.
+
+    Raises ValueError if no packing fits in max_size.
+    """
+    candidates = _candidate_widths(boxes, step, max_size)
+    if widths is not None:
+        candidates = candidates[:max(1, widths)]
+    deadline = time.time() + seconds if seconds is not None else None
+    sizes = [(box.width, box.height) for box in boxes]
+    tasks = [(sizes, width, strategy, deadline) for width in candidates]
+    if pool is not None and len(boxes) * len(candidates) >= 10000:
+        results = pool.imap_unordered(_pack_sizes, tasks)
+    else:
+        results = (_pack_sizes(task) for task in tasks)
+    best = None
+    for result in results:
+        if result is None:
+            # Past the deadline.
+            break
+        (width, height, packing) = result
+        if max_size is None or height <= max_size:
+            key = (width * height, max(width, height), width)
+            if best is None or key < best[0]:
+                best = (key, width, height, packing)
+        if deadline is not None and time.time() >= deadline:
+            break
+    if best is None:
+        raise ValueError("No packing fits in %rx%r" % (max_size, max_size))
+    (_, width, height, packing) = best
+    return (width, height,
+            [(left, top, boxes[i]) for (left, top, i) in packing])
+
+
 def boxes_overlap((x1, y1, box1), (x2, y2, box2)):
     """Return True if the two boxes at (x1, y1) and (x2, y2) overlap."""
-    left1 = x1
-    top1 = y1
-    right1 = x1 + box1.width
-    bottom1 = y1 + box1.height
-    left2 = x2
-    top2 = y2
-    right2 = x2 + box2.width
-    bottom2 = y2 + box2.height
-    return ((left2 <= left1  <  right2 and top2 <= top1    <  bottom2) or
-            (left2 <  right1 <= right2 and top2 <= top1    <  bottom2) or
-            (left2 <= left1  <  right2 and top2 <  bottom1 <= bottom2) or
-            (left2 <  right1 <= right2 and top2 <  bottom1 <= bottom2))
+    return (x1 < x2 + box2.width and x2 < x1 + box1.width and
+            y1 < y2 + box2.height and y2 < y1 + box1.height)
+
+
+def find_overlap(packing):
+    """Return the leftmost pair of placements in the packing that overlap,
+    in packing order, or None if there isn't one.
+
+    This sweeps a vertical line from left to right.  The boxes the line
+    crosses can't overlap each other, or we'd have stopped, so their
+    vertical extents are disjoint and kept sorted; each new box only needs
+    checking against its neighbours there.  That makes it O(n log n)
+    comparisons, rather than the O(n^2) of checking every pair.
+    """
+    order = sorted(xrange(len(packing)), key=lambda i: packing[i][0])
+    # (top, bottom, index) of the boxes the line crosses, sorted by top.
+    active = []
+    # (right, top, index) of the same boxes, to find when they're passed.
+    passing = []
+    for i in order:
+        (left, top, box) = packing[i]
+        if box.width <= 0 or box.height <= 0:
+            continue
+        while passing and passing[0][0] <= left:
+            (_, old_top, j) = heapq.heappop(passing)
+            del active[bisect.bisect_left(active, (old_top, -1, j))]
+        bottom = top + box.height
+        at = bisect.bisect_left(active, (top, -1, -1))
+        for neighbour in active[max(at - 1, 0):at + 1]:
+            (other_top, other_bottom, j) = neighbour
+            if other_top < bottom and top < other_bottom:
+                return (packing[min(i, j)], packing[max(i, j)])
+        active.insert(at, (top, bottom, i))
+        heapq.heappush(passing, (left + box.width, top, i))
+    return None
 
 
 def check_no_overlap(packing):
     """Return True if none of the boxes in the packing overlap."""
-    # TODO(rnk): It would be great if we could avoid comparing each box twice.
-    for left in packing:
-        for right in packing:
-            if left == right:
-                continue
-            if boxes_overlap(left, right):
-                return False
-    return True
+    return find_overlap(packing) is None
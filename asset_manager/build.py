@@ -0,0 +1,250 @@
+"""Dependency-aware scheduling for bundle builds.
+
+Bundles are mostly independent, but some of them consume the output of
+another (a CssBundle that lists the CSS generated by a PngSpriteBundle, for
+example).  We work out those edges from the bundles' inputs and outputs and
+then run every bundle whose dependencies are built on a bounded pool of
+worker threads.  The heavy lifting happens in JVM subprocesses and in the
+process pool that AssetManager.minify_all starts before the threads, for
+the sprite width search and the PNG optimizer, so threads are enough to
+keep every core busy.
+"""
+
+from __future__ import with_statement
+
+import os
+import Queue
+import sys
+import traceback
+from multiprocessing.pool import ThreadPool
+
+
+class BuildError(Exception):
+
+    def __init__(self, key, error, details=''):
+        msg = "Failed to build bundle %r: %s" % (key, error)
+        if details:
+            msg = "%s\n\n%s" % (msg, details)
+        super(BuildError, self).__init__(msg)
+        self.key = key
+        self.error = error
+
+
+class DependencyCycle(Exception):
+
+    def __init__(self, keys):
+        msg = "Bundles depend on each other: %r" % (sorted(keys),)
+        super(DependencyCycle, self).__init__(msg)
+
+
+def _normalize(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+def bundle_dependencies(bundles):
+    """Map each bundle key to the set of bundle keys it depends on.
+
+    A bundle depends on another if one of its inputs is one of the other
+    bundle's outputs.
+    """
+    producers = {}
+    for key, bundle in bundles.items():
+        for output in bundle.outputs:
+            producers[_normalize(output)] = key
+    dependencies = {}
+    for key, bundle in bundles.items():
+        dependencies[key] = set()
+        for input in bundle.inputs:
+            producer = producers.get(_normalize(input))
+            if producer is not None and producer != key:
+                dependencies[key].add(producer)
+    return dependencies
+
+
+def bundle_dependents(dependencies):
+    """Invert a dependency map so it maps each key to its dependents."""
+    dependents = dict((key, set()) for key in dependencies)
+    for key, depends_on in dependencies.items():
+        for dependency in depends_on:
+            dependents[dependency].add(key)
+    return dependents
+
+
+class BuildResult(object):
+
+    """The keys that were built and skipped by a call to build_bundles."""
+
+    def __init__(self):
+        self.built = []
+        self.skipped = []
+        # Maps keys of built bundles to figures about their build.
+        self.stats = {}
+
+    def __repr__(self):
+        return "<BuildResult: built=%r skipped=%r>" % (self.built,
+                                                       self.skipped)
+
+
+def _run(build, key):
+    try:
+        return (key, build(key), None)
+    except Exception, e:
+        return (key, None, (e, traceback.format_exc()))
+
+
+def build_bundles(bundles, build, jobs=1, order=None, keys=None):
+    """Build bundles in dependency order on a pool of `jobs` threads.
+
+    `build` is called with a bundle key and returns False if it decided the
+    bundle was up to date and skipped it.  `order` is a sort key for the
+    bundles that picks which of the ready bundles starts first.  If `keys` is
+    given, only those bundles are built and every other bundle is treated as
+    already built.
+
+    The first failure stops any new bundle from starting.  Bundles that are
+    already running are allowed to finish before a BuildError is raised.
+    """
+    if keys is None:
+        keys = set(bundles)
+    else:
+        keys = set(keys)
+    dependencies = bundle_dependencies(bundles)
+    waiting = dict((key, dependencies[key] & keys) for key in keys)
+    dependents = bundle_dependents(waiting)
+
+    def sort_key(key):
+        if order is None:
+            return key
+        return (order(bundles[key]), key)
+
+    ready = sorted([key for key, deps in waiting.items() if not deps],
+                   key=sort_key)
+    if keys and not ready:
+        raise DependencyCycle(keys)
+
+    result = BuildResult()
+    done = Queue.Queue()
+    pool = ThreadPool(max(1, jobs))
+    running = 0
+    failure = None
+    try:
+        while ready or running:
+            while ready and failure is None and running < max(1, jobs):
+                key = ready.pop(0)
+                del waiting[key]
+                pool.apply_async(_run, (build, key), callback=done.put)
+                running += 1
+            if not running:
+                break
+            key, built, error = done.get()
+            running -= 1
+            if error is not None:
+                if failure is None:
+                    failure = (key, error)
+                continue
+            if built is False:
+                result.skipped.append(key)
+            else:
+                result.built.append(key)
+            for dependent in dependents[key]:
+                waiting[dependent].discard(key)
+                if not waiting[dependent] and dependent not in ready:
+                    ready.append(dependent)
+            ready.sort(key=sort_key)
+    finally:
+        pool.close()
+        pool.join()
+    if failure is not None:
+        key, (error, details) = failure
+        raise BuildError(key, error, details)
+    if waiting:
+        raise DependencyCycle(waiting)
+    return result
+
+
+def main(argv=None):
+    import argparse
+    from asset_manager.bundles import AssetManager
+
+    parser = argparse.ArgumentParser(
+        description="Build every bundle in an asset manager config.")
+    parser.add_argument('config', help="path to the JSON bundle config")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="number of bundles to build at once")
+    parser.add_argument('-f', '--force', action='store_true',
+                        help="rebuild bundles even if they are up to date")
+    parser.add_argument('--daemon', action='store_true',
+                        help="run the Java tools in one warm Nailgun server")
+    parser.add_argument('--nailgun-jar',
+                        help="path to the nailgun-server jar for --daemon")
+    parser.add_argument('--js-chunks', action='store_true',
+                        help="compile JS bundles that share files together")
+    parser.add_argument('-w', '--watch', action='store_true',
+                        help="keep rebuilding bundles as their files change")
+    parser.add_argument('--fingerprint', action='store_true',
+                        help="also publish bundles under content-hashed names")
+    parser.add_argument('--keep-generations', type=int, default=3,
+                        help="how many fingerprinted versions to keep")
+    parser.add_argument('--precompress', action='store_true',
+                        help="write .gz (and .br) copies of JS and CSS")
+    parser.add_argument('--css-engine', choices=('yui', 'python'),
+                        default='yui',
+                        help="CSS minifier for bundles that don't pick one")
+    parser.add_argument('--data-uri-max-size', type=int, metavar='BYTES',
+                        help="largest image to inline as a data URI")
+    parser.add_argument('--persist-data-uri-cache', action='store_true',
+                        help="keep encoded data URIs between builds")
+    parser.add_argument('--build-mode', choices=('minify', 'concat'),
+                        default='minify',
+                        help="'concat' just joins the files of JS and CSS "
+                             "bundles, for fast development builds")
+    args = parser.parse_args(argv)
+
+    manager = AssetManager(args.config, fingerprint=args.fingerprint,
+                           keep_generations=args.keep_generations,
+                           precompress=args.precompress,
+                           css_engine=args.css_engine,
+                           data_uri_max_size=args.data_uri_max_size,
+                           persist_data_uri_cache=args.persist_data_uri_cache,
+                           build_mode=args.build_mode)
+    options = dict(jobs=args.jobs, daemon=args.daemon,
+                   nailgun_jar=args.nailgun_jar, js_chunks=args.js_chunks)
+    try:
+        result = manager.minify_all(force=args.force, **options)
+    except BuildError, e:
+        print >> sys.stderr, e
+        if not args.watch:
+            return 1
+    else:
+        for key in result.built:
+            print "built %s" % key
+            data_uris = result.stats.get(key, {}).get('data_uris')
+            if data_uris:
+                print ("  inlined %(images)d images (%(bytes)d bytes), "
+                       "%(too_big)d too big to inline" % data_uris)
+            duplicates = result.stats.get(key, {}).get('duplicates')
+            if duplicates:
+                print ("  %(images)d duplicate images share a place" %
+                       duplicates)
+            css = result.stats.get(key, {}).get('css')
+            if css:
+                print ("  wrote %(bytes)d bytes of sprite CSS "
+                       "(%(gzip_bytes)d gzipped)" % css)
+            png = result.stats.get(key, {}).get('png')
+            if png:
+                print ("  optimized PNG from %d to %d bytes (saved %d)" %
+                       (png['before'], png['after'],
+                        png['before'] - png['after']))
+        for key in result.skipped:
+            print "skipped %s (unchanged)" % key
+    if args.watch:
+        from asset_manager.watch import Watcher
+        try:
+            Watcher(manager, **options).run()
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
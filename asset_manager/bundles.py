@@ -1,15 +1,55 @@
 from __future__ import with_statement
 from __future__ import unicode_literals
 
-import math
+import collections
+import multiprocessing
 import os
 import shutil
-import subprocess
 import re
 import json
+import threading
+from multiprocessing.pool import ThreadPool
 
 from asset_manager.bin_packing import Box, pack_boxes
-from asset_manager.datauris import add_data_uris_to_css_file
+from asset_manager.bin_packing import find_overlap
+from asset_manager.bin_packing import search_width
+from asset_manager.bin_packing import STRATEGIES as PACKING_STRATEGIES
+from asset_manager.build import BuildError
+from asset_manager.build import build_bundles
+from asset_manager.build import bundle_dependencies
+from asset_manager.build import bundle_dependents
+from asset_manager.caches import HtmlCache
+from asset_manager.caches import SourceCache
+from asset_manager import cssmin
+from asset_manager.compression import gzip_compress
+from asset_manager.compression import is_compressible
+from asset_manager.compression import write_sidecars
+from asset_manager.datauris import DataUriCache
+from asset_manager.datauris import add_data_uris_to_css_chunks
+from asset_manager.datauris import referenced_image_paths
+from asset_manager.fileutil import sidecar_path
+from asset_manager.fingerprint import UrlManifest
+from asset_manager.globs import DirectoryListing
+from asset_manager.globs import expand_pattern
+from asset_manager.globs import has_magic
+from asset_manager.imageinfo import UnknownImageFormat
+from asset_manager.imageinfo import image_size
+from asset_manager.jvm import JavaRunner
+from asset_manager.jvm import NailgunRunner
+from asset_manager.jschunks import compile_chunks
+from asset_manager.jschunks import plan_chunks
+from asset_manager.manifest import BuildManifest
+from asset_manager.manifest import bundle_digest
+from asset_manager.pngopt import optimize_png
+from asset_manager.snapshot import config_stamp
+from asset_manager.snapshot import read_snapshot
+from asset_manager.snapshot import write_snapshot
+from asset_manager.sprites import DEFAULT_MAX_BYTES
+from asset_manager.sprites import composite
+from asset_manager.sprites import composite_in_strips
+from asset_manager.sprites import group_identical
+from asset_manager.sprites import split_sheets
+from asset_manager.sprites import squarish_width
 
 
 class InvalidBundleType(Exception):
@@ -26,10 +66,59 @@ class InvalidHtmlPrintableType(Exception):
         super(InvalidHtmlPrintableType, self).__init__(msg)
 
 
+class InvalidCssEngine(Exception):
+
+    def __init__(self, engine):
+        msg = "Invalid CSS engine: %r" % engine
+        super(InvalidCssEngine, self).__init__(msg)
+
+
+class InvalidBuildMode(Exception):
+
+    def __init__(self, mode):
+        msg = "Invalid build mode: %r" % mode
+        super(InvalidBuildMode, self).__init__(msg)
+
+
+class InvalidPackingStrategy(Exception):
+
+    def __init__(self, strategy):
+        msg = "Invalid packing strategy: %r" % strategy
+        super(InvalidPackingStrategy, self).__init__(msg)
+
+
+class InvalidCssStyle(Exception):
+
+    def __init__(self, style):
+        msg = "Invalid sprite CSS style: %r" % style
+        super(InvalidCssStyle, self).__init__(msg)
+
+
+class OverlappingSprites(Exception):
+
+    def __init__(self, bundle, overlap):
+        ((left1, top1, box1), (left2, top2, box2)) = overlap
+        msg = "Sprite %r: %r at (%d, %d) overlaps %r at (%d, %d)" % (
+            bundle, box1.filename, left1, top1, box2.filename, left2, top2)
+        super(OverlappingSprites, self).__init__(msg)
+
+
+class MinifyError(Exception):
+
+    def __init__(self, command, status):
+        msg = "Minify command %r failed with exit status %r" % (command,
+                                                                status)
+        super(MinifyError, self).__init__(msg)
+
+
 def png_bundled_first(bundle):
     return 0 if bundle.type == 'image' else 1
 
 
+def _bin_path(name):
+    return os.path.join(os.path.dirname(__file__), 'bin', name)
+
+
 def concatenate_files(paths):
     """Generate the contents of several files in 8K blocks."""
     for path in paths:
@@ -40,28 +129,356 @@ def concatenate_files(paths):
                 buffer = input.read(8192)
 
 
+def _copy_file(input, output):
+    """Append the rest of the `input` file to `output`, in the kernel if the
+    platform has sendfile."""
+    sendfile = getattr(os, 'sendfile', None)
+    if sendfile is not None:
+        output.flush()
+        offset = input.tell()
+        size = os.fstat(input.fileno()).st_size
+        try:
+            while offset < size:
+                sent = sendfile(output.fileno(), input.fileno(), offset,
+                                size - offset)
+                if not sent:
+                    break
+                offset += sent
+        except OSError:
+            # Not supported for these files; copy whatever is left below.
+            pass
+        input.seek(offset)
+        output.seek(0, os.SEEK_END)
+    shutil.copyfileobj(input, output)
+
+
+def copy_files(paths, output_path, separator=b''):
+    """Write the raw bytes of several files, with `separator` between each
+    file, to output_path."""
+    with open(output_path, 'wb') as output:
+        for (i, path) in enumerate(paths):
+            if i and separator:
+                output.write(separator)
+            with open(path, 'rb') as input:
+                _copy_file(input, output)
+
+
+def resolve_files(files, path_base, listing=None):
+    """Expand the directories ('dir/') and glob patterns (see
+    asset_manager.globs) in a bundle's file list.  Directories are read
+    through `listing`, a DirectoryListing that can be shared by several
+    bundles."""
+    if listing is None:
+        listing = DirectoryListing()
+    new_files = []
+    directories = set()
+    for file in files:
+        if has_magic(file):
+            new_files.extend(expand_pattern(file, path_base, listing,
+                                            directories))
+            continue
+        # add all files in directory
+        path = os.path.join(path_base, file)
+        if listing.is_dir(path):
+            if not file.endswith("/"):
+                raise ValueError("Bundle URLs must end with a '/'.")
+            directories.add(os.path.normpath(path))
+            for (new_file, is_dir, _) in listing(path):
+                if not is_dir:
+                    new_files.append(file + new_file)
+        else:
+            new_files.append(file)
+    return ResolvedFiles(new_files, sorted(directories))
+
+
 class AssetManager(object):
 
-    def __init__(self, file_name, print_minified=False, domain=''):
-        self.bundles = AssetManager._build_bundles_from_config(file_name)
+    def __init__(self, file_name, print_minified=False, domain='',
+                 source_cache_bytes=8 * 1024 * 1024, fingerprint=False,
+                 keep_generations=3, precompress=False, css_engine='yui',
+                 data_uri_max_size=None, persist_data_uri_cache=False,
+                 build_mode='minify', use_snapshot=False):
+        self.file_name = file_name
         self.print_minified = print_minified
         self.domain = domain
+        self.html_cache = HtmlCache()
+        # Sources inlined by get_html(print_source=True).
+        self.source_cache = SourceCache(source_cache_bytes)
+        # Fingerprinted bundle names; see asset_manager.fingerprint.
+        if fingerprint:
+            self.url_manifest = UrlManifest(sidecar_path(file_name, 'urls'),
+                                            keep_generations)
+        else:
+            self.url_manifest = None
+        # Write .gz (and .br) copies of built JS and CSS.
+        self.precompress = precompress
+        # The CSS engine for bundles that don't pick one: 'yui' or 'python'.
+        self.css_engine = css_engine
+        # The largest image, in bytes, inlined by CSS bundles that don't set
+        # their own limit.
+        self.data_uri_max_size = data_uri_max_size
+        # Keep the build-wide data URI cache on disk between builds.
+        self.persist_data_uri_cache = persist_data_uri_cache
+        # How JS and CSS bundles that don't pick one are built: 'minify', or
+        # 'concat' for fast development builds.
+        if build_mode not in Bundle.BUILD_MODES:
+            raise InvalidBuildMode(build_mode)
+        self.build_mode = build_mode
+        # Start from the snapshot the last build saved, if it's current (see
+        # asset_manager.snapshot).
+        self.use_snapshot = use_snapshot
+        self.reload()
+
+    def reload(self, use_snapshot=None):
+        """Re-read the config file, or its snapshot with `use_snapshot`,
+        which defaults to the manager's setting."""
+        if use_snapshot is None:
+            use_snapshot = self.use_snapshot
+        self.config_stamp = config_stamp(self.file_name)
+        attrs = None
+        if use_snapshot:
+            attrs = read_snapshot(self.snapshot_path, self.config_stamp)
+        if attrs is not None:
+            for bundle_attrs in attrs.values():
+                bundle_attrs['files'] = ResolvedFiles(
+                    bundle_attrs['files'],
+                    bundle_attrs.pop('directories', ()))
+            self.bundle_attrs = attrs
+            self.bundles = LazyBundles(attrs, self._configure_bundle)
+        else:
+            self.bundle_attrs = AssetManager._read_config(self.file_name)
+            self.bundles = dict((key, Bundle.from_dict(dict(bundle_attrs)))
+                                for (key, bundle_attrs)
+                                in self.bundle_attrs.items())
+            for bundle in self.bundles.values():
+                self._configure_bundle(bundle)
+        self.invalidate_html_cache()
+
+    def _configure_bundle(self, bundle):
+        """Apply the manager's settings and defaults to a new bundle."""
+        bundle.url_manifest = self.url_manifest
+        bundle.precompress = self.precompress
+        if bundle.type in ('js', 'css') and bundle.build_mode is None:
+            bundle.build_mode = self.build_mode
+        if bundle.type == 'css':
+            if bundle.css_engine is None:
+                bundle.css_engine = self.css_engine
+            if bundle.data_uri_max_size is None:
+                bundle.data_uri_max_size = self.data_uri_max_size
+
+    @property
+    def snapshot_path(self):
+        return sidecar_path(self.file_name, 'snapshot')
+
+    def save_snapshot(self):
+        """Save the bundle settings, with their file lists expanded, for
+        managers created with use_snapshot."""
+        attrs = {}
+        for (key, bundle_attrs) in self.bundle_attrs.items():
+            bundle = self.bundles[key]
+            attrs[key] = dict(bundle_attrs, files=list(bundle.files),
+                              directories=list(bundle.directories))
+        write_snapshot(self.snapshot_path, self.config_stamp, attrs)
+
+    def invalidate_html_cache(self):
+        self.html_cache.clear()
 
     def get(self, key):
         return self.bundles.get(key)
 
-    def get_html(self, key, print_source=False):
+    def _render_html(self, key, print_source):
         return self.bundles.get(key).get_html(self.print_minified,
                                               self.domain,
-                                              print_source)
+                                              print_source,
+                                              self.source_cache.read)
+
+    def get_html(self, key, print_source=False):
+        if print_source:
+            return self._render_html(key, print_source)
+        return self.html_cache.get(
+            (key, self.print_minified, self.domain),
+            lambda: self._render_html(key, print_source))
+
+    @property
+    def manifest_path(self):
+        return sidecar_path(self.file_name, 'manifest')
 
-    def minify_all(self):
-        for bundle in sorted(self.bundles.values(), key=png_bundled_first):
+    @property
+    def data_uri_cache_path(self):
+        return sidecar_path(self.file_name, 'datauris')
+
+    def minify_all(self, jobs=1, force=False, daemon=False, nailgun_jar=None,
+                   js_chunks=False, keys=None):
+        """Build every bundle, running up to `jobs` builds at once.
+
+        Bundles that use the output of another bundle are built after it.
+        Bundles whose inputs haven't changed since the last build recorded in
+        the manifest are skipped unless `force` is set.  Returns a BuildResult
+        listing the bundles that were built and skipped, and the build_stats
+        of each bundle built.  If `keys` is given, only those bundles are
+        built.
+
+        With `daemon`, the Closure Compiler and YUI Compressor run in a single
+        warm JVM (a Nailgun server, see asset_manager.jvm) for the whole run.
+
+        With `js_chunks`, JavaScript bundles that share files are compiled
+        together in one Closure Compiler run (see asset_manager.jschunks),
+        alongside the rest of the build.
+
+        CSS bundles share one DataUriCache for the run, so an image used by
+        several bundles is only encoded once.  Sprite bundles share one
+        process pool, started before any of the build's threads, since
+        forking a threaded process isn't safe.
+
+        A successful build also saves the config snapshot.
+        """
+        # Resources shared by every bundle for the length of the build.
+        runner = None
+        if daemon:
+            runner = NailgunRunner([_bin_path('compiler.jar'),
+                                    _bin_path('yuicompressor-2.4.2.jar')],
+                                   nailgun_jar)
+        if self.persist_data_uri_cache:
+            data_uri_cache = DataUriCache(self.data_uri_cache_path)
+        else:
+            data_uri_cache = DataUriCache()
+        process_pool = None
+        if any(self.bundles[key].type == 'image'
+               for key in (self.bundles if keys is None else keys)):
+            process_pool = multiprocessing.Pool()
+        for bundle in self.bundles.values():
+            if runner is not None:
+                bundle.java_runner = runner
+            bundle.data_uri_cache = data_uri_cache
+            bundle.process_pool = process_pool
+        try:
+            result = self._minify_all(jobs, force, js_chunks, keys)
+            self.save_snapshot()
+            return result
+        finally:
+            if runner is not None:
+                runner.close()
+            if process_pool is not None:
+                process_pool.terminate()
+                process_pool.join()
+            data_uri_cache.save()
+            for bundle in self.bundles.values():
+                bundle.__dict__.pop('java_runner', None)
+                bundle.__dict__.pop('data_uri_cache', None)
+                bundle.__dict__.pop('process_pool', None)
+
+    def _minify_all(self, jobs, force, js_chunks, keys):
+        if keys is None:
+            keys = set(self.bundles)
+        self.invalidate_html_cache()
+        manifest = BuildManifest(self.manifest_path)
+
+        def build(key):
+            bundle = self.bundles[key]
+            digest = bundle_digest(bundle)
+            if not force and manifest.is_fresh(key, digest, bundle.outputs):
+                return False
+            manifest.forget(key)
+            bundle.build_stats = {}
             bundle.minify()
+            self._finish_build(bundle)
+            manifest.record(key, digest)
+
+        try:
+            if not js_chunks:
+                result = build_bundles(self.bundles, build, jobs=jobs,
+                                       order=png_bundled_first, keys=keys)
+                self._collect_stats(result)
+                return result
+            plans = self._js_chunk_plans(manifest, force, keys)
+            chunked = set()
+            for (plan, _, _) in plans:
+                chunked.update(plan.keys)
+            pool = ThreadPool(1)
+            try:
+                compiled = pool.apply_async(self._compile_js_chunks,
+                                            (plans, manifest))
+                result = build_bundles(self.bundles, build, jobs=jobs,
+                                       order=png_bundled_first,
+                                       keys=set(keys) - chunked)
+                compiled.get()
+            finally:
+                pool.close()
+                pool.join()
+            result.built.extend(sorted(chunked))
+            self._collect_stats(result)
+            return result
+        finally:
+            manifest.save()
+            if self.url_manifest is not None:
+                self.url_manifest.save()
+            self.invalidate_html_cache()
+
+    def _collect_stats(self, result):
+        for key in result.built:
+            if self.bundles[key].build_stats:
+                result.stats[key] = self.bundles[key].build_stats
+
+    def _finish_build(self, bundle):
+        """Steps that follow every build, run on the bundle's worker."""
+        if bundle.precompress:
+            for path in bundle.served_paths:
+                if is_compressible(path):
+                    write_sidecars(path)
+
+    def _js_chunk_plans(self, manifest, force, keys):
+        """Plan chunked compiles for the JS bundles that need building.
+
+        Bundles that depend on or feed other bundles are left to the normal
+        scheduler.  Returns a list of (plan, externs, digests) tuples.
+        """
+        dependencies = bundle_dependencies(self.bundles)
+        dependents = bundle_dependents(dependencies)
+        by_externs = {}
+        digests = {}
+        for key, bundle in self.bundles.items():
+            if key not in keys or bundle.type != 'js':
+                continue
+            if dependencies[key] or dependents[key]:
+                continue
+            if bundle.build_mode == 'concat':
+                continue
+            digest = bundle_digest(bundle)
+            if not force and manifest.is_fresh(key, digest, bundle.outputs):
+                continue
+            digests[key] = digest
+            externs = tuple(bundle.get_externs()) if bundle.externs else ()
+            by_externs.setdefault(externs, {})[key] = bundle
+        plans = []
+        for externs, bundles in sorted(by_externs.items()):
+            plan = plan_chunks(bundles)
+            if plan is not None:
+                plans.append((plan, externs,
+                              dict((key, digests[key]) for key in plan.keys)))
+        return plans
+
+    def _compile_js_chunks(self, plans, manifest):
+        for (plan, externs, digests) in plans:
+            for key in plan.keys:
+                manifest.forget(key)
+            runner = self.bundles[plan.keys[0]].java_runner
+            jar = _bin_path('compiler.jar')
+            status = compile_chunks(plan, runner, jar, externs)
+            if status != 0:
+                command = 'java -jar %s --module ...' % jar
+                raise BuildError(', '.join(plan.keys),
+                                 MinifyError(command, status))
+            for key, digest in digests.items():
+                self.bundles[key].publish()
+                self._finish_build(self.bundles[key])
+                manifest.record(key, digest)
 
     @classmethod
-    def _build_bundles_from_config(cls, file_name):
-        bundles = {}
+    def _read_config(cls, file_name):
+        """The settings of each bundle in the config, with the paths made
+        absolute and the file lists expanded.  The bundles share one
+        DirectoryListing, so each directory is only read once."""
+        listing = DirectoryListing()
         with open(file_name, 'r') as file:
             directory = os.path.abspath(os.path.dirname(file_name))
             dict_bundles = json.loads(file.read())
@@ -72,8 +489,61 @@ class AssetManager(object):
                 if css_path_base:
                     bundle['css_path_base'] = \
                         os.path.join(directory, bundle['css_path_base'])
-                bundles[key] = Bundle.from_dict(bundle)
-        return bundles
+                if 'files' in bundle:
+                    bundle['files'] = resolve_files(bundle['files'],
+                                                    bundle['path_base'],
+                                                    listing)
+        return dict_bundles
+
+    @classmethod
+    def _build_bundles_from_config(cls, file_name):
+        return dict((key, Bundle.from_dict(bundle)) for (key, bundle)
+                    in cls._read_config(file_name).items())
+
+
+class LazyBundles(collections.Mapping):
+
+    """The bundles of a config, each made from its settings when it's first
+    looked up, and passed to `configure`."""
+
+    def __init__(self, attrs, configure):
+        self.attrs = attrs
+        self.configure = configure
+        self.made = {}
+        self.lock = threading.Lock()
+
+    def __getitem__(self, key):
+        bundle = self.made.get(key)
+        if bundle is None:
+            attrs = self.attrs[key]
+            with self.lock:
+                bundle = self.made.get(key)
+                if bundle is None:
+                    bundle = Bundle.from_dict(dict(attrs))
+                    self.configure(bundle)
+                    self.made[key] = bundle
+        return bundle
+
+    def __iter__(self):
+        return iter(self.attrs)
+
+    def __len__(self):
+        return len(self.attrs)
+
+
+class ResolvedFiles(tuple):
+
+    """A bundle's file names with the directories and patterns already
+    expanded, which parse_files passes through untouched.
+
+    `directories` are the directories that were read to expand them, whose
+    contents decide the list.
+    """
+
+    def __new__(cls, files, directories=()):
+        resolved = super(ResolvedFiles, cls).__new__(cls, files)
+        resolved.directories = tuple(directories)
+        return resolved
 
 
 class Bundle(object):
@@ -84,6 +554,30 @@ class Bundle(object):
     together and served as a single file to improve performance.
     """
 
+    # How the Java tools are run.  AssetManager.minify_all swaps in a shared
+    # daemon for the length of a build.
+    java_runner = JavaRunner()
+
+    # A UrlManifest if the AssetManager fingerprints its outputs.
+    url_manifest = None
+
+    # Whether the AssetManager writes compressed copies of the outputs.
+    precompress = False
+
+    # A DataUriCache shared by the bundles in a build.
+    data_uri_cache = None
+
+    # A multiprocessing.Pool shared by the bundles in a build, for the
+    # sprite width search and the PNG optimizer.
+    process_pool = None
+
+    # 'minify' runs the bundle's minifier; 'concat' just joins the files.
+    BUILD_MODES = ('minify', 'concat')
+    build_mode = None
+
+    # Written between files when a bundle is built by concatenation.
+    concat_separator = b'\n'
+
     def __init__(self, file_name, path_base, url_base, files):
         self.file_name = file_name
         self.path_base = path_base
@@ -91,24 +585,59 @@ class Bundle(object):
         if not url_base.endswith("/"):
             raise ValueError("Bundle URLs must end with a '/'.")
         self.files = self.parse_files(files, path_base)
+        # Figures about the last build, such as the bytes of images inlined.
+        self.build_stats = {}
 
     @property
     def full_path_files(self):
         return [os.path.join(self.path_base, f) for f in self.files]
 
+    @property
+    def inputs(self):
+        """Paths of the files this bundle is built from."""
+        return self.full_path_files
+
+    @property
+    def directories(self):
+        """Directories read to expand the file list, where a new file can
+        change it."""
+        return self.files.directories
+
+    @property
+    def outputs(self):
+        """Paths of the files minify writes."""
+        return [self.bundle_path]
+
+    @property
+    def options(self):
+        """The settings that affect the output, other than the inputs."""
+        return {
+            'file_name': self.file_name,
+            'url_base': self.url_base,
+            'fingerprint': self.url_manifest is not None,
+            'precompress': self.precompress,
+        }
+
+    @property
+    def tools(self):
+        """Paths of the tools used to build the bundle."""
+        return []
+
+    def _set_build_mode(self, build_mode):
+        if build_mode is not None and build_mode not in self.BUILD_MODES:
+            raise InvalidBuildMode(build_mode)
+        self.build_mode = build_mode
+
+    def concatenate(self):
+        """Build the bundle as the plain concatenation of its files."""
+        copy_files(self.full_path_files, self.bundle_path,
+                   self.concat_separator)
+        self.publish()
+
     def parse_files(self, files, path_base):
-        new_files = []
-        for file in files:
-            # add all files in directory
-            path = os.path.join(path_base, file)
-            if os.path.isdir(path):
-                if not file.endswith("/"):
-                    raise ValueError("Bundle URLs must end with a '/'.")
-                for new_file in os.listdir(path):
-                    new_files.append(file + new_file)
-            else:
-                new_files.append(file)
-        return tuple(new_files)
+        if isinstance(files, ResolvedFiles):
+            return files
+        return resolve_files(files, path_base)
 
 
     @classmethod
@@ -126,13 +655,17 @@ class Bundle(object):
                                     attrs["path_base"],
                                     attrs["url_base"],
                                     attrs["files"], 
-                                    attrs.get("externs", None))
+                                    attrs.get("externs", None),
+                                    attrs.get("build_mode", None))
         elif attrs["type"] == "css":
             return CssBundle(attrs["file_name"],
                              attrs["path_base"],
                              attrs["url_base"],
                              attrs["files"], 
-                             attrs.get("data_uri_images", False))
+                             attrs.get("data_uri_images", False),
+                             attrs.get("css_engine", None),
+                             attrs.get("data_uri_max_size", None),
+                             attrs.get("build_mode", None))
         elif attrs["type"] == "image":
             cls.check_attr(attrs, "css_file_name")
             cls.check_attr(attrs, "css_path_base")
@@ -144,7 +677,17 @@ class Bundle(object):
                                    attrs["files"], 
                                    attrs["css_file_name"],
                                    attrs["css_path_base"],
-                                   attrs.get("sprite_prefix", "sprite"))
+                                   attrs.get("sprite_prefix", "sprite"),
+                                   attrs.get("packing", "shelf"),
+                                   attrs.get("width_search", None),
+                                   attrs.get("composite_in_strips", False),
+                                   attrs.get("composite_max_bytes",
+                                             DEFAULT_MAX_BYTES),
+                                   attrs.get("optimize_seconds", 10.0),
+                                   attrs.get("max_sheet_width", None),
+                                   attrs.get("max_sheet_height", None),
+                                   attrs.get("max_sheet_bytes", None),
+                                   attrs.get("css_style", "pretty"))
         else:
             raise InvalidBundleType(attrs["type"])
 
@@ -152,12 +695,46 @@ class Bundle(object):
     def bundle_path(self):
         return os.path.join(self.path_base, self.file_name)
 
+    @property
+    def _minify_command(self):
+        return ' '.join(JavaRunner().command(self._minify_jar,
+                                             self._minify_args))
+
+    def _run_java(self, stdin=None):
+        status = self.java_runner.run(self._minify_jar, self._minify_args,
+                                      stdin)
+        if status != 0:
+            raise MinifyError(self._minify_command, status)
+
     def make_url(self, file_name, domain=''):
         return domain + self.url_base + file_name
 
+    @property
+    def minified_file_name(self):
+        """The name to serve the built bundle under."""
+        if self.url_manifest is None:
+            return self.file_name
+        return self.url_manifest.lookup(self.url_base, self.file_name)
+
     @property
     def bundle_url(self):
-        return self.make_url(self.file_name)
+        return self.make_url(self.minified_file_name)
+
+    @property
+    def served_paths(self):
+        """Paths of the built files, including the fingerprinted copy."""
+        paths = list(self.outputs)
+        name = self.minified_file_name
+        if name != self.file_name:
+            paths.append(os.path.join(os.path.dirname(self.bundle_path), name))
+        return paths
+
+    def publish(self):
+        """Publish the freshly built bundle under a fingerprinted name, if
+        fingerprinting is on."""
+        if self.url_manifest is not None:
+            self.url_manifest.publish(self.bundle_path, self.url_base,
+                                      self.file_name)
 
     @property
     def _html_source_template(self):
@@ -167,7 +744,12 @@ class Bundle(object):
     def _html_template(self):
         raise InvalidHtmlPrintableType
 
-    def get_html(self, print_minified, domain, print_source):
+    def get_html(self, print_minified, domain, print_source, read=None):
+        """Render the tags for this bundle.
+
+        With `print_source`, the sources are inlined, read with `read` if
+        it's given.
+        """
         elements = []
         if print_source:
             if print_minified:
@@ -175,13 +757,16 @@ class Bundle(object):
             else:
                 files = self.full_path_files
             for file in files:
-                with open(file) as f:
-                    file_contents = f.read()
-                    elements.append(
-                        self._html_source_template.format(src=file_contents))
+                if read is None:
+                    with open(file) as f:
+                        file_contents = f.read()
+                else:
+                    file_contents = read(file)
+                elements.append(
+                    self._html_source_template.format(src=file_contents))
         else:
             if print_minified:
-                files = [self.make_url(self.file_name, domain)]
+                files = [self.make_url(self.minified_file_name, domain)]
             else:
                 files = [self.make_url(f, domain) for f in self.files]
             for file in files:
@@ -193,37 +778,63 @@ class JavascriptBundle(Bundle):
 
     """Bundle for JavaScript."""
 
-    def __init__(self, file_name, path_base, url_base, files, externs):
+    # Guards against files that don't end their last statement.
+    concat_separator = b'\n;\n'
+
+    def __init__(self, file_name, path_base, url_base, files, externs,
+                 build_mode=None):
         super(JavascriptBundle, self).__init__(file_name,
                                                path_base,
                                                url_base,
                                                files)
-        self.externs = self.parse_files(externs, path) if externs else None
+        self.externs = self.parse_files(externs, path_base) if externs else None
+        self._set_build_mode(build_mode)
 
     @property
     def type(self):
         return u'js'
 
     def get_externs(self):
-        return [os.path.join(self.path, f) for f in self.externs]
+        return [os.path.join(self.path_base, f) for f in self.externs]
 
     @property
-    def _minify_command(self):
-        command = 'java -jar %s --js_output_file %s' % (
-                os.path.join(os.path.dirname(__file__),
-                             'bin',
-                             'compiler.jar'),
-                self.bundle_path,
-        )
+    def inputs(self):
+        inputs = self.full_path_files
+        if self.externs:
+            inputs = inputs + self.get_externs()
+        return inputs
+
+    @property
+    def options(self):
+        options = super(JavascriptBundle, self).options
+        options['build_mode'] = self.build_mode or 'minify'
+        return options
+
+    @property
+    def tools(self):
+        if self.build_mode == 'concat':
+            return []
+        return [_bin_path('compiler.jar')]
+
+    @property
+    def _minify_jar(self):
+        return _bin_path('compiler.jar')
+
+    @property
+    def _minify_args(self):
+        args = ['--js_output_file', self.bundle_path]
         for file in self.full_path_files:
-            command = '%s --js %s' % (command, file)
+            args.extend(['--js', file])
         if self.externs:
             for extern in self.get_externs():
-                command = '%s --externs %s' % (command, extern)
-        return command
+                args.extend(['--externs', extern])
+        return args
 
     def minify(self):
-        os.system(self._minify_command)
+        if self.build_mode == 'concat':
+            return self.concatenate()
+        self._run_java()
+        self.publish()
 
     @property
     def _html_template(self):
@@ -237,43 +848,90 @@ class JavascriptBundle(Bundle):
 
 class CssBundle(Bundle):
 
-    """Bundle for CSS."""
+    """Bundle for CSS.
 
-    def __init__(self, file_name, path_base, url_base, files, data_uri_images):
+    The concatenated CSS is minified by the YUI Compressor, or in-process by
+    asset_manager.cssmin if css_engine is 'python'.
+    """
+
+    CSS_ENGINES = ('yui', 'python')
+
+    def __init__(self, file_name, path_base, url_base, files, data_uri_images,
+                 css_engine=None, data_uri_max_size=None, build_mode=None):
         super(CssBundle, self).__init__(file_name,
                                         path_base,
                                         url_base,
                                         files)
         self.data_uri_images = data_uri_images
+        if css_engine is not None and css_engine not in self.CSS_ENGINES:
+            raise InvalidCssEngine(css_engine)
+        self.css_engine = css_engine
+        # Images bigger than this many bytes are left as url() references.
+        self.data_uri_max_size = data_uri_max_size
+        self._set_build_mode(build_mode)
 
     @property
     def type(self):
         return u'css'
 
     @property
-    def _tmp_path(self):
-        return '%s.tmp' % self.bundle_path
+    def inputs(self):
+        inputs = self.full_path_files
+        if self.data_uri_images:
+            # The inlined images are inputs too.  URLs are resolved relative
+            # to the concatenated file, which lives in path_base.
+            images = []
+            for path in inputs:
+                images.extend(referenced_image_paths(path, self.path_base))
+            inputs = inputs + images
+        return inputs
 
     @property
-    def _minify_command(self):
-        return 'java -jar {yui_path} --type css -o {css_path} {tmp_path}' \
-            .format(yui_path=os.path.join(os.path.dirname(__file__),
-                                          'bin',
-                                          'yuicompressor-2.4.2.jar'),
-                    css_path=self.bundle_path,
-                    tmp_path=self._tmp_path)
+    def options(self):
+        options = super(CssBundle, self).options
+        options['data_uri_images'] = self.data_uri_images
+        options['css_engine'] = self.css_engine or 'yui'
+        options['data_uri_max_size'] = self.data_uri_max_size
+        options['build_mode'] = self.build_mode or 'minify'
+        return options
+
+    @property
+    def tools(self):
+        if self.css_engine == 'python' or self.build_mode == 'concat':
+            return []
+        return [_bin_path('yuicompressor-2.4.2.jar')]
+
+    @property
+    def _minify_jar(self):
+        return _bin_path('yuicompressor-2.4.2.jar')
+
+    @property
+    def _minify_args(self):
+        # With no input file, YUI reads the stylesheet from stdin.
+        return ['--type', 'css', '-o', self.bundle_path]
 
     def minify(self):
-        # YUI Compressor doesn't combine files, so we do that here
-        with open(self._tmp_path, "w") as output:
-            generator = concatenate_files(self.full_path_files)
-            output.write("".join(generator))
-        # Convert image includes to data uri's prior to optimization
+        if self.build_mode == 'concat':
+            # Image URLs resolve the same from the bundle, so they're left
+            # for the browser to fetch.
+            return self.concatenate()
+        # YUI Compressor doesn't combine files, so we do that here, streaming
+        # the files through the data uri conversion and into the compressor.
+        css = concatenate_files(self.full_path_files)
         if self.data_uri_images:
-            add_data_uris_to_css_file(self._tmp_path)
-        # Then we optimize the file
-        os.system(self._minify_command)
-        os.remove(self._tmp_path)
+            stats = self.build_stats['data_uris'] = {}
+            # URLs are resolved relative to the bundle, in path_base.
+            css = add_data_uris_to_css_chunks(css, self.path_base,
+                                              self.data_uri_cache,
+                                              self.data_uri_max_size, stats)
+        if self.css_engine == 'python':
+            # cssmin works on the whole stylesheet, as text.
+            css = cssmin.minify(b"".join(css).decode('utf-8'))
+            with open(self.bundle_path, "wb") as output:
+                output.write(css.encode('utf-8'))
+        else:
+            self._run_java(stdin=css)
+        self.publish()
 
     @property
     def _html_template(self):
@@ -294,8 +952,21 @@ class PngSpriteBundle(Bundle):
     CSS.
     """
 
+    WIDTH_SEARCH_DEFAULTS = {
+        'step': 16,
+        'max_size': None,
+        'seconds': 2.0,
+        'widths': 100,
+    }
+
+    CSS_STYLES = ('pretty', 'compact')
+
     def __init__(self, file_name, path_base, url_base, css_url_base, files,
-                 css_file_name, css_path_base, sprite_prefix):
+                 css_file_name, css_path_base, sprite_prefix, packing='shelf',
+                 width_search=None, composite_in_strips=False,
+                 composite_max_bytes=DEFAULT_MAX_BYTES, optimize_seconds=10.0,
+                 max_sheet_width=None, max_sheet_height=None,
+                 max_sheet_bytes=None, css_style='pretty'):
         super(PngSpriteBundle, self).__init__(file_name,
                                               path_base,
                                               url_base,
@@ -304,6 +975,39 @@ class PngSpriteBundle(Bundle):
         self.css_path_base = css_path_base
         self.css_url_base = css_url_base
         self.sprite_prefix = sprite_prefix
+        # The bin_packing strategy used to lay out the sprite.
+        if packing not in PACKING_STRATEGIES:
+            raise InvalidPackingStrategy(packing)
+        self.packing = packing
+        # Settings for bin_packing.search_width, or True for the defaults, to
+        # try many sprite widths and keep the smallest sprite.
+        if width_search is True:
+            width_search = {}
+        if width_search:
+            unknown = set(width_search) - set(self.WIDTH_SEARCH_DEFAULTS)
+            if unknown:
+                raise ValueError("Unknown width_search settings: %s" %
+                                 ", ".join(sorted(unknown)))
+            width_search = dict(self.WIDTH_SEARCH_DEFAULTS, **width_search)
+        self.width_search = width_search or None
+        # Write the sprite a band of rows at a time, within
+        # composite_max_bytes of memory, instead of all at once.
+        self.composite_in_strips = composite_in_strips
+        self.composite_max_bytes = composite_max_bytes
+        # The time budget for optimizing the PNG; None for no limit, and 0
+        # to skip it.  Sprites written in strips aren't optimized.
+        self.optimize_seconds = optimize_seconds
+        # Limits on each sheet.  If any is set, the images are split among
+        # sheets named like sprite-0.png, sprite-1.png, ...; a sheet over
+        # max_sheet_bytes once it's encoded is split in two.
+        self.max_sheet_width = max_sheet_width
+        self.max_sheet_height = max_sheet_height
+        self.max_sheet_bytes = max_sheet_bytes
+        # 'pretty' writes a rule per image; 'compact' writes minified rules,
+        # one per distinct declaration.
+        if css_style not in self.CSS_STYLES:
+            raise InvalidCssStyle(css_style)
+        self.css_style = css_style
 
     @property
     def type(self):
@@ -313,62 +1017,244 @@ class PngSpriteBundle(Bundle):
     def css_path(self):
         return os.path.join(self.css_path_base, self.css_file_name)
 
+    @property
+    def splits_sheets(self):
+        return (self.max_sheet_width is not None or
+                self.max_sheet_height is not None or
+                self.max_sheet_bytes is not None)
+
+    def sheet_file_name(self, index):
+        if not self.splits_sheets:
+            return self.file_name
+        return '%s-%d%s' % (os.path.splitext(self.file_name)[0], index,
+                            os.path.splitext(self.file_name)[1])
+
+    def sheet_path(self, index):
+        return os.path.join(self.path_base, self.sheet_file_name(index))
+
+    def sheet_url(self, index):
+        name = self.sheet_file_name(index)
+        if self.url_manifest is not None:
+            name = self.url_manifest.lookup(self.url_base, name)
+        return self.make_url(name)
+
+    @property
+    def sheet_paths(self):
+        """The sheets of the last build, found on disk."""
+        if not self.splits_sheets:
+            return [self.bundle_path]
+        paths = []
+        while os.path.exists(self.sheet_path(len(paths))):
+            paths.append(self.sheet_path(len(paths)))
+        return paths or [self.sheet_path(0)]
+
+    @property
+    def outputs(self):
+        return self.sheet_paths + [self.css_path]
+
+    @property
+    def options(self):
+        options = super(PngSpriteBundle, self).options
+        options.update({
+            'css_file_name': self.css_file_name,
+            'css_url_base': self.css_url_base,
+            'sprite_prefix': self.sprite_prefix,
+            'packing': self.packing,
+            'width_search': self.width_search,
+            'composite_in_strips': self.composite_in_strips,
+            'optimize_seconds': self.optimize_seconds,
+            'max_sheet_width': self.max_sheet_width,
+            'max_sheet_height': self.max_sheet_height,
+            'max_sheet_bytes': self.max_sheet_bytes,
+            'css_style': self.css_style,
+        })
+        return options
+
     def minify(self):
-        import Image  # If this fails, you need the Python Imaging Library.
-        boxes = [ImageBox(Image.open(path), path) for path in self.full_path_files]
-        # Pick a max_width so that the sprite is squarish and a multiple of 16,
-        # and so no image is too wide to fit.
-        total_area = sum(box.width * box.height for box in boxes)
-        width = max(max(box.width for box in boxes),
-                    (int(math.sqrt(total_area)) // 16 + 1) * 16)
-        (_, height, packing) = pack_boxes(boxes, width)
-        sprite = Image.new( mode='RGBA',
-                            size=(width, height),
-                            color=(0,0,0,0))
-        for (left, top, box) in packing:
-            # This is a bit of magic to make the transparencies work.  To
-            # preserve transparency, we pass the image so it can take its
-            # alpha channel mask or something.  However, if the image has no
-            # alpha channels, then it fails, we we have to check if the
-            # image is RGBA here.
-            img = box.image
-            sprite.paste(img, (left, top))
-        sprite.save(self.bundle_path, "PNG")
-        self._optimize_output()
-        self.generate_css(packing)
-
-    def _optimize_output(self):
-        """Optimize the PNG with pngcrush."""
-        sprite_path = self.bundle_path
-        tmp_path = sprite_path + '.tmp'
+        # Only the sizes are read to lay out the sprite; the pixels are
+        # loaded as each image is placed.
+        boxes = [ImageBox(path) for path in self.full_path_files]
+        # Identical images are placed once, and share their CSS offset.
+        groups = group_identical(boxes)
+        boxes = [group[0] for group in groups]
+        aliases = dict((id(group[0]), group[1:]) for group in groups
+                       if len(group) > 1)
+        if aliases:
+            self.build_stats['duplicates'] = {
+                'images': sum(len(group) for group in aliases.itervalues()),
+            }
+        if self.splits_sheets:
+            sheets = split_sheets(boxes, self.packing, self.max_sheet_width,
+                                  self.max_sheet_height)
+        elif self.width_search:
+            sheets = [search_width(boxes, self.packing,
+                                   pool=self.process_pool,
+                                   **self.width_search)]
+        else:
+            sheets = [pack_boxes(boxes, squarish_width(boxes), self.packing)]
+        for (_, _, packing) in sheets:
+            overlap = find_overlap(packing)
+            if overlap is not None:
+                raise OverlappingSprites(self.file_name, overlap)
+        sheets = self._write_sheets(sheets)
+        for index in xrange(len(sheets)):
+            if self.url_manifest is not None:
+                self.url_manifest.publish(self.sheet_path(index),
+                                          self.url_base,
+                                          self.sheet_file_name(index))
+        self.generate_css([packing for (_, _, packing) in sheets], aliases)
+
+    def _write_sheets(self, sheets):
+        """Write the sheets, several at a time, and return them.
+
+        Sheets over max_sheet_bytes are split in two and written again.
+        Each sheet is first written to a temporary file; once they all fit,
+        they're renamed in order, and sheets left from a bigger build are
+        removed.
+        """
+        workers = min(len(sheets), multiprocessing.cpu_count())
+        written = {}
+        pool = ThreadPool(workers)
         try:
-            args = ['pngcrush', '-rem', 'alla', sprite_path, tmp_path]
-            proc = subprocess.Popen(args, stdout=subprocess.PIPE,
-                                    stderr=subprocess.STDOUT)
-            proc.wait()
-            if proc.returncode != 0:
-                raise Exception('pngcrush returned error code: %r\nOutput was:\n\n'
-                                '%s' % (proc.returncode, proc.stdout.read()))
-            shutil.move(tmp_path, sprite_path)
-        except OSError:
-            pass
+            while True:
+                pending = [sheet for sheet in sheets
+                           if id(sheet) not in written]
+                tasks = [(sheet,
+                          '%s.%d.tmp' % (self.bundle_path, len(written) + i))
+                         for (i, sheet) in enumerate(pending)]
+                for result in pool.map(self._write_sheet, tasks):
+                    # Holding on to the sheet keeps its id from being reused.
+                    written[id(result[0])] = result
+                split = []
+                for sheet in sheets:
+                    (_, path, (_, after)) = written[id(sheet)]
+                    if (self.max_sheet_bytes is not None and
+                            after > self.max_sheet_bytes and
+                            len(sheet[2]) > 1):
+                        os.remove(path)
+                        boxes = [box for (_, _, box) in sheet[2]]
+                        half = len(boxes) // 2
+                        for part in (boxes[:half], boxes[half:]):
+                            split.extend(split_sheets(part, self.packing,
+                                                      self.max_sheet_width,
+                                                      self.max_sheet_height))
+                    else:
+                        split.append(sheet)
+                if len(split) == len(sheets):
+                    break
+                sheets = split
+        except:
+            for (_, path, _) in written.values():
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+        finally:
+            pool.close()
+            pool.join()
+        (before, after) = (0, 0)
+        for (index, sheet) in enumerate(sheets):
+            (_, path, sizes) = written[id(sheet)]
+            os.rename(path, self.sheet_path(index))
+            before += sizes[0]
+            after += sizes[1]
+        if self.optimizes:
+            self.build_stats['png'] = {'before': before, 'after': after}
+        if self.splits_sheets:
+            index = len(sheets)
+            while os.path.exists(self.sheet_path(index)):
+                os.remove(self.sheet_path(index))
+                index += 1
+        return sheets
 
-    def generate_css(self, packing):
-        """Generate the background offset CSS rules."""
-        with open(self.css_path, "w") as css:
-            css.write("/* Generated classes for sprites.  "
-                      "Don't edit! */\n")
-            props = {
-                "background-image": "url('%s')" % self.bundle_url,
-            }
-            css.write(self.make_css(None, props))
+    @property
+    def optimizes(self):
+        """Whether the sheets are optimized.  Not when they're written in
+        strips: the optimizer holds the whole image in memory."""
+        return self.optimize_seconds != 0 and not self.composite_in_strips
+
+    def _write_sheet(self, (sheet, path)):
+        """Composite and optimize one sheet.  Returns (sheet, path, (bytes
+        before, bytes after optimizing))."""
+        (width, height, packing) = sheet
+        if self.composite_in_strips:
+            composite_in_strips(packing, width, height, path,
+                                self.composite_max_bytes)
+        else:
+            composite(packing, width, height).save(path, "PNG")
+        if not self.optimizes:
+            size = os.path.getsize(path)
+            return (sheet, path, (size, size))
+        return (sheet, path, optimize_png(path, self.optimize_seconds,
+                                          self.process_pool))
+
+    def generate_css(self, sheets, aliases=None):
+        """Generate the background offset CSS rules, given the packing of
+        each sheet.  `aliases` maps the id of a placed box to the boxes of
+        identical images, which get rules with the same offset.
+
+        The stylesheet is written in one go, and its size, raw and gzipped,
+        goes in the build stats.
+        """
+        rules = []
+        for (index, packing) in enumerate(sheets):
             for (left, top, box) in packing:
                 props = {
                     "background-position": "%dpx %dpx" % (-left, -top),
                     "width": "%dpx" % box.width,
                     "height": "%dpx" % box.height,
                 }
-                css.write(self.make_css(os.path.basename(box.filename), props))
+                if self.splits_sheets:
+                    props["background-image"] = \
+                        "url('%s')" % self.sheet_url(index)
+                for same in [box] + (aliases or {}).get(id(box), []):
+                    rules.append((os.path.basename(same.filename), props))
+        parts = ["/* Generated classes for sprites.  Don't edit! */\n"]
+        if self.css_style == 'compact':
+            parts.extend(self._compact_css(rules))
+        else:
+            if not self.splits_sheets:
+                props = {
+                    "background-image": "url('%s')" % self.bundle_url,
+                }
+                parts.append(self.make_css(None, props))
+            parts.extend(self.make_css(name, props) for (name, props) in rules)
+        css = ''.join(parts).encode('utf-8')
+        with open(self.css_path, "wb") as file:
+            file.write(css)
+        self.build_stats['css'] = {
+            'bytes': len(css),
+            'gzip_bytes': len(gzip_compress(css)),
+        }
+
+    # The order of the declarations in a compact rule.
+    COMPACT_PROPERTIES = ("background-image", "width", "height",
+                          "background-position")
+
+    def _compact_css(self, rules):
+        """One minified rule per distinct declaration, in the order the
+        classes first appear; only identical images share one.  Grouping
+        classes by each property instead repeats every class name, which
+        gzip compresses worse than the repeated declarations it saves."""
+        if not self.splits_sheets:
+            # The one sheet's image goes on the shared class, as in the
+            # pretty style.
+            yield ".%s{background-image:url('%s')}\n" % (
+                self.css_class_name(None), self.bundle_url)
+        groups = {}
+        order = []
+        for (name, props) in rules:
+            declaration = ';'.join(
+                "%s:%s" % (prop, ' '.join('0' if part == '0px' else part
+                                          for part in props[prop].split()))
+                for prop in self.COMPACT_PROPERTIES if prop in props)
+            if declaration not in groups:
+                groups[declaration] = []
+                order.append(declaration)
+            groups[declaration].append(self.css_class_name(name))
+        for declaration in order:
+            yield "%s{%s}\n" % (','.join('.' + css_class for css_class
+                                          in groups[declaration]),
+                                 declaration)
 
     CSS_REGEXP = re.compile(r"[^a-zA-Z0-9\-_]")
 
@@ -392,15 +1278,33 @@ class ImageBox(Box):
     """A Box representing an image.
 
     We hand these off to the bin packing algorithm.  After the boxes have been
-    arranged, we can place the associated image in the sprite.
+    arranged, we can place the associated image in the sprite.  The size is
+    read from the image's header (see asset_manager.imageinfo), so the image
+    itself isn't loaded until it's opened for placing.
     """
 
-    def __init__(self, image, filename):
-        (width, height) = image.size
+    def __init__(self, filename, size=None):
+        if size is None:
+            size = _image_size(filename)
+        (width, height) = size
         super(ImageBox, self).__init__(width, height)
-        self.image = image
         self.filename = filename
 
+    def open(self):
+        """Open the image with PIL."""
+        import Image  # If this fails, you need the Python Imaging Library.
+        return Image.open(self.filename)
+
     def __repr__(self):
-        return "<ImageBox: filename=%r image=%r>" % (self.filename, self.image)
+        return "<ImageBox: filename=%r size=%r>" % (self.filename,
+                                                    (self.width, self.height))
+
+
+def _image_size(path):
+    try:
+        return image_size(path)
+    except UnknownImageFormat:
+        # Leave other formats to PIL, which also only reads the header here.
+        import Image  # If this fails, you need the Python Imaging Library.
+        return Image.open(path).size
 
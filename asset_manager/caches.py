@@ -0,0 +1,106 @@
+"""Caches that keep rendering bundles off the hot path."""
+
+from __future__ import with_statement
+
+import os
+import threading
+from collections import OrderedDict
+
+
+class HtmlCache(object):
+
+    """Rendered HTML tags, keyed by (bundle key, print_minified, domain).
+
+    The hit and miss counters aren't locked, so they may be slightly off
+    when several threads render at once.
+    """
+
+    def __init__(self):
+        self.html = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, render):
+        """Return the cached HTML for `key`, calling `render` on a miss."""
+        try:
+            html = self.html[key]
+        except KeyError:
+            self.misses += 1
+            html = self.html[key] = render()
+            return html
+        self.hits += 1
+        return html
+
+    def clear(self):
+        self.html.clear()
+
+    @property
+    def stats(self):
+        return {
+            'entries': len(self.html),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+class SourceCache(object):
+
+    """A bounded LRU cache of file contents for inlining sources.
+
+    Entries are checked against the file's mtime and size on every read, so
+    a rebuilt bundle is picked up straight away.  Files bigger than the whole
+    budget are read but never cached.
+    """
+
+    def __init__(self, max_bytes=8 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.files = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def read(self, path):
+        stat = os.stat(path)
+        signature = (stat.st_mtime, stat.st_size)
+        with self.lock:
+            entry = self.files.pop(path, None)
+            if entry is not None:
+                if entry[0] == signature:
+                    self.hits += 1
+                    self.files[path] = entry
+                    return entry[1]
+                self.bytes -= len(entry[1])
+            self.misses += 1
+        with open(path) as f:
+            contents = f.read()
+        if len(contents) <= self.max_bytes:
+            with self.lock:
+                old = self.files.pop(path, None)
+                if old is not None:
+                    self.bytes -= len(old[1])
+                self.files[path] = (signature, contents)
+                self.bytes += len(contents)
+                while self.bytes > self.max_bytes:
+                    _, (_, evicted) = self.files.popitem(last=False)
+                    self.bytes -= len(evicted)
+                    self.evictions += 1
+        return contents
+
+    def clear(self):
+        with self.lock:
+            self.files.clear()
+            self.bytes = 0
+
+    @property
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.files),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,74 @@
+"""Precompressed sidecar files for built bundles.
+
+Web servers such as nginx (gzip_static) can serve bundle.min.js.gz in place
+of bundle.min.js, so writing the compressed copies once at build time saves
+compressing every response.  Brotli copies are written too when the brotli
+module is installed.  A sidecar that wouldn't be smaller than the original
+isn't written, and any stale one is removed so it can't be served.
+"""
+
+from __future__ import with_statement
+
+import gzip
+import os
+from io import BytesIO
+
+from asset_manager.fileutil import atomic_write
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = ('.js', '.css')
+
+# Every sidecar extension write_sidecars may write, brotli or not.
+SIDECAR_EXTENSIONS = ('.gz', '.br')
+
+
+def is_compressible(path):
+    return os.path.splitext(path)[1].lower() in COMPRESSIBLE_EXTENSIONS
+
+
+def gzip_compress(data):
+    buffer = BytesIO()
+    # A fixed mtime keeps the output the same for the same input.
+    with gzip.GzipFile(filename='', mode='wb', compresslevel=9,
+                       fileobj=buffer, mtime=0) as file:
+        file.write(data)
+    return buffer.getvalue()
+
+
+def brotli_compress(data):
+    return brotli.compress(data, quality=11)
+
+
+def _compressors():
+    compressors = [('.gz', gzip_compress)]
+    if brotli is not None:
+        compressors.append(('.br', brotli_compress))
+    return compressors
+
+
+def write_sidecars(path):
+    """Write compressed copies of `path` next to it.
+
+    Returns a dict mapping each sidecar extension to the size written, or
+    None if the sidecar was skipped because it wasn't smaller.
+    """
+    with open(path, 'rb') as file:
+        data = file.read()
+    sizes = {}
+    for (ext, compress) in _compressors():
+        sidecar = path + ext
+        compressed = compress(data)
+        if len(compressed) >= len(data):
+            sizes[ext] = None
+            try:
+                os.remove(sidecar)
+            except OSError:
+                pass
+            continue
+        atomic_write(sidecar, compressed)
+        sizes[ext] = len(compressed)
+    return sizes
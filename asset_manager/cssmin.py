@@ -0,0 +1,164 @@
+"""An in-process CSS minifier.
+
+This follows the rules of the YUI Compressor 2.4.2 CssCompressor, so that a
+bundle comes out the same whichever engine builds it, without paying for a
+JVM start.  On top of YUI's rules, adjacent rules with the same selector are
+merged into one.
+"""
+
+import re
+
+COMMENT = re.compile(r'/\*.*?\*/', re.S)
+STRING = re.compile(r'"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\'', re.S)
+# Whichever of a string or a comment comes first.
+STRING_OR_COMMENT = re.compile('%s|%s' % (STRING.pattern, COMMENT.pattern),
+                               re.S)
+TOKEN = '___YUICSSMIN_PRESERVED_TOKEN_%d___'
+TOKEN_FINDER = re.compile(r'___YUICSSMIN_PRESERVED_TOKEN_(\d+)___')
+
+WHITESPACE = re.compile(r'\s+')
+PSEUDO_CLASS_COLON = re.compile(r'(^|\})(([^{:])+:)+([^{]*\{)')
+SPACE_BEFORE = re.compile(r'\s+([!{};:>+()\],])')
+SPACE_AFTER = re.compile(r'([!{}:;>+(\[,])\s+')
+MISSING_SEMICOLON = re.compile(r'([^;}])\}')
+ZERO_UNITS = re.compile(r'([\s:])(0)(px|em|%|in|cm|mm|pc|pt|ex)')
+ZERO_SHORTHAND = re.compile(r':0 0 0 0(;|\})|:0 0 0(;|\})|:0 0(;|\})')
+ZERO_POSITION = re.compile(
+    r'(background-position|transform-origin|webkit-transform-origin|'
+    r'moz-transform-origin|o-transform-origin|ms-transform-origin):0(;|\})',
+    re.I)
+LEADING_ZERO = re.compile(r'(:|\s)0+\.(\d+)')
+RGB = re.compile(r'rgb\s*\(\s*([0-9,\s]+)\s*\)')
+LONG_COLOR = re.compile(
+    r'([^"\'=\s])(\s*)#([0-9a-fA-F])([0-9a-fA-F])([0-9a-fA-F])([0-9a-fA-F])'
+    r'([0-9a-fA-F])([0-9a-fA-F])')
+NONE_BORDERS = re.compile(
+    r'(border|border-top|border-right|border-bottom|border-left|outline|'
+    r'background):none(;|\})', re.I)
+IE_OPACITY = re.compile(r'progid:DXImageTransform\.Microsoft\.Alpha\(Opacity=',
+                        re.I)
+EMPTY_RULE = re.compile(r'[^{};/]+\{;\}')
+SEMICOLONS = re.compile(r';;+')
+
+
+def _preserve(css, tokens):
+    """Replace strings and comments with tokens so the rules below can't
+    touch them.  Comments are dropped unless they start with /*!."""
+    def preserve_string(match):
+        tokens.append(match.group(0))
+        return TOKEN % (len(tokens) - 1)
+
+    def preserve_comment(match):
+        comment = match.group(0)
+        if comment.startswith('/*!'):
+            tokens.append(comment)
+            return TOKEN % (len(tokens) - 1)
+        if comment.endswith('\\*/'):
+            # The Mac IE hack: keep a marker so the closing comment stays.
+            tokens.append('/*\\*/')
+            return TOKEN % (len(tokens) - 1)
+        return ''
+
+    def preserve(match):
+        if match.group(0).startswith('/*'):
+            return preserve_comment(match)
+        return preserve_string(match)
+
+    return STRING_OR_COMMENT.sub(preserve, css)
+
+
+def _rgb_to_hex(match):
+    values = [int(value) for value in match.group(1).split(',')]
+    return '#' + ''.join('%02x' % value for value in values)
+
+
+def _shorten_color(match):
+    (prefix, space, r1, r2, g1, g2, b1, b2) = match.groups()
+    if r1.lower() == r2.lower() and g1.lower() == g2.lower() and \
+            b1.lower() == b2.lower():
+        return '%s%s#%s%s%s' % (prefix, space, r1, g1, b1)
+    return match.group(0)
+
+
+def _split_rules(css):
+    """Split minified CSS into top-level items: simple rules as (selector,
+    declarations) pairs, and anything else (at-rules, nested blocks) as
+    plain strings."""
+    items = []
+    depth = 0
+    start = 0
+    for (i, char) in enumerate(css):
+        if char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                items.append(css[start:i + 1])
+                start = i + 1
+        elif char == ';' and depth == 0:
+            # A top-level statement such as @import or @charset.
+            items.append(css[start:i + 1])
+            start = i + 1
+    if start < len(css):
+        items.append(css[start:])
+    rules = []
+    for item in items:
+        brace = item.find('{')
+        if (brace > 0 and not item.startswith('@') and
+                item.count('{') == 1 and item.endswith('}')):
+            rules.append((item[:brace], item[brace + 1:-1]))
+        else:
+            rules.append(item)
+    return rules
+
+
+def merge_adjacent_rules(css):
+    """Merge neighbouring rules that have the same selector.
+
+    >>> merge_adjacent_rules('a{color:red;}a{margin:0;}b{color:red;}')
+    'a{color:red;margin:0;}b{color:red;}'
+    """
+    merged = []
+    for rule in _split_rules(css):
+        if isinstance(rule, tuple) and merged and \
+                isinstance(merged[-1], tuple) and merged[-1][0] == rule[0]:
+            (selector, declarations) = merged[-1]
+            if declarations != rule[1]:
+                declarations += rule[1]
+            merged[-1] = (selector, declarations)
+        else:
+            merged.append(rule)
+    return ''.join(rule if not isinstance(rule, tuple)
+                   else '%s{%s}' % rule for rule in merged)
+
+
+def minify(css):
+    """Minify a stylesheet."""
+    tokens = []
+    css = _preserve(css, tokens)
+
+    css = WHITESPACE.sub(' ', css)
+    # Keep the space before a pseudo class colon, e.g. "a :hover".
+    css = PSEUDO_CLASS_COLON.sub(
+        lambda m: m.group(0).replace(':', '___YUICSSMIN_PSEUDOCLASSCOLON___'),
+        css)
+    css = SPACE_BEFORE.sub(r'\1', css)
+    css = css.replace('___YUICSSMIN_PSEUDOCLASSCOLON___', ':')
+    css = SPACE_AFTER.sub(r'\1', css)
+    css = MISSING_SEMICOLON.sub(r'\1;}', css)
+    css = ZERO_UNITS.sub(r'\1\2', css)
+    css = ZERO_SHORTHAND.sub(
+        lambda m: ':0' + (m.group(1) or m.group(2) or m.group(3)), css)
+    css = ZERO_POSITION.sub(lambda m: '%s:0 0%s' % (m.group(1).lower(),
+                                                    m.group(2)), css)
+    css = LEADING_ZERO.sub(r'\1.\2', css)
+    css = RGB.sub(_rgb_to_hex, css)
+    css = LONG_COLOR.sub(_shorten_color, css)
+    css = NONE_BORDERS.sub(lambda m: '%s:0%s' % (m.group(1).lower(),
+                                                 m.group(2)), css)
+    css = IE_OPACITY.sub('alpha(opacity=', css)
+    css = EMPTY_RULE.sub('', css)
+    css = SEMICOLONS.sub(';', css)
+    css = merge_adjacent_rules(css.strip())
+
+    return TOKEN_FINDER.sub(lambda m: tokens[int(m.group(1))], css)
@@ -1,6 +1,12 @@
+from __future__ import with_statement
+
 import base64
+import json
 import re
 import os
+import threading
+
+from asset_manager.fileutil import atomic_write
 
 URL_FINDER = re.compile('url\(.*?\)')
 STRIP_URL = re.compile('url\(|\)|\'|"')
@@ -30,26 +36,157 @@ def _get_image_path_from_css_url(css_image_url):
     """
     return ''.join(STRIP_URL.split(css_image_url))
 
-def _parse_image_url_into_data_uris(css_path, image_url):
-    return convert_file_to_data_uri(os.path.join(
-        os.path.dirname(css_path), 
-        image_url))
+def referenced_image_paths(css_path, base_dir):
+    """Paths of the images a CSS file would inline, resolved from base_dir.
 
-def add_data_uris_to_css_file(css_path):
-    css_file_content = ''
-    with open(css_path, 'r') as css_file:
-        css_file_content = css_file.read()
-        image_urls = _extract_image_urls_from_css(css_file_content)
-        for css_image_url in image_urls:
+    Missing CSS files (for example generated ones that haven't been built
+    yet) reference nothing.
+    """
+    try:
+        image_urls = _extract_image_urls_from_css_file(css_path)
+    except IOError:
+        return []
+    paths = []
+    for css_image_url in image_urls:
+        image_url = _get_image_path_from_css_url(css_image_url)
+        if _get_file_extension_from_path(image_url) in file_extensions_to_types:
+            paths.append(os.path.join(base_dir, image_url))
+    return paths
+
+class DataUriCache(object):
+
+    """Data URIs shared by every CSS bundle in a build.
+
+    Entries are keyed by the image's path and checked against its mtime and
+    size, so the cache can be saved to `path` and reused by later builds.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        if path:
             try:
-                image_url = _get_image_path_from_css_url(css_image_url)
-                data_uri = _parse_image_url_into_data_uris(css_path, image_url)
-                css_file_content = css_file_content.replace(image_url, data_uri)
-            except KeyError:
-                pass
-            except IOError:
+                with open(path, 'r') as file:
+                    self.entries = json.loads(file.read())
+            except (IOError, ValueError):
                 pass
 
+    def get(self, path, max_size=None):
+        """The data URI for the image at `path`, or None if the image is
+        bigger than `max_size` bytes.
+
+        Raises IOError if the image is missing and KeyError if it's of an
+        unknown type, like convert_file_to_data_uri.
+        """
+        _get_file_type(path)
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        if max_size is not None and stat.st_size > max_size:
+            return None
+        with self.lock:
+            entry = self.entries.get(path)
+        if entry is not None and entry[:2] == [stat.st_mtime, stat.st_size]:
+            return entry[2]
+        data_uri = convert_file_to_data_uri(path)
+        with self.lock:
+            self.entries[path] = [stat.st_mtime, stat.st_size, data_uri]
+        return data_uri
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            content = json.dumps(self.entries)
+        atomic_write(self.path, content)
+
+def add_data_uris_to_css(css, base_dir, cache=None, max_size=None,
+                         stats=None):
+    """Inline every image referenced by a url() in `css` as a data URI.
+
+    Image paths are resolved relative to `base_dir`.  The stylesheet is
+    rewritten in a single pass and each distinct image is only read and
+    encoded once, or never if it's in `cache` (a DataUriCache).  Images that
+    are missing, of an unknown type or bigger than `max_size` bytes are left
+    alone.
+
+    If `stats` is given, it's a dict that's updated with the number of
+    references inlined ('images'), the bytes of data URI they added
+    ('bytes') and the number left alone for being too big ('too_big').
+    """
+    return URL_FINDER.sub(_inliner(base_dir, cache, max_size, stats), css)
+
+def add_data_uris_to_css_chunks(chunks, base_dir, cache=None, max_size=None,
+                                stats=None):
+    """Like add_data_uris_to_css, but for a stylesheet that arrives as an
+    iterable of strings, such as concatenate_files generates.
+
+    The rewritten stylesheet is generated in pieces as it goes; only a url()
+    that straddles two chunks is held back until it's complete.
+    """
+    inline = _inliner(base_dir, cache, max_size, stats)
+    pending = ''
+    for chunk in chunks:
+        buffer = pending + chunk
+        last_end = 0
+        for match in URL_FINDER.finditer(buffer):
+            last_end = match.end()
+        # Hold back the last few characters, which may be the start of a
+        # "url(", and any "url(" that hasn't been closed yet.  A url() can't
+        # span lines, so only one after the last newline can still match.
+        cut = max(last_end, len(buffer) - 3)
+        start = max(last_end, buffer.rfind('\n') + 1)
+        unclosed = buffer.find('url(', start)
+        if unclosed != -1:
+            cut = min(cut, unclosed)
+        if cut > 0:
+            yield URL_FINDER.sub(inline, buffer[:cut])
+        pending = buffer[cut:]
+    if pending:
+        yield URL_FINDER.sub(inline, pending)
+
+def _inliner(base_dir, cache, max_size, stats):
+    """The re.sub callback that inlines the image in a url() match."""
+    if cache is None:
+        cache = DataUriCache()
+    if stats is not None:
+        for stat in ('images', 'bytes', 'too_big'):
+            stats.setdefault(stat, 0)
+    data_uris = {}
+    missing = object()
+
+    def inline(match):
+        css_image_url = match.group(0)
+        image_url = _get_image_path_from_css_url(css_image_url)
+        if not image_url:
+            return css_image_url
+        path = os.path.join(base_dir, image_url)
+        if path not in data_uris:
+            try:
+                data_uris[path] = cache.get(path, max_size)
+            except (KeyError, IOError, OSError):
+                data_uris[path] = missing
+        data_uri = data_uris[path]
+        if data_uri is missing:
+            return css_image_url
+        if data_uri is None:
+            if stats is not None:
+                stats['too_big'] += 1
+            return css_image_url
+        if stats is not None:
+            stats['images'] += 1
+            stats['bytes'] += len(data_uri)
+        return css_image_url.replace(image_url, data_uri)
+
+    return inline
+
+def add_data_uris_to_css_file(css_path, cache=None, max_size=None,
+                              stats=None):
+    with open(css_path, 'r') as css_file:
+        css_file_content = css_file.read()
+    css_file_content = add_data_uris_to_css(css_file_content,
+                                            os.path.dirname(css_path),
+                                            cache, max_size, stats)
     with open(css_path, 'w') as css_file:
         css_file.write(css_file_content)
 
@@ -69,7 +206,7 @@ def _get_file_extension_from_path(path):
     return path.split('.')[-1].lower()
 
 def convert_file_to_data_uri(path):
-    with open(path, 'r') as image:
+    with open(path, 'rb') as image:
         return 'data:%s;base64,%s' % (
             _get_file_type(path),
             base64.b64encode(image.read()))
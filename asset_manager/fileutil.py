@@ -0,0 +1,31 @@
+"""Small file helpers shared by the build's caches and outputs."""
+
+from __future__ import with_statement
+
+import hashlib
+import os
+
+
+def sidecar_path(config_path, suffix):
+    """A file kept next to the config: foo.json -> foo.<suffix>.json"""
+    return '%s.%s.json' % (os.path.splitext(config_path)[0], suffix)
+
+
+def atomic_write(path, data):
+    """Write `data` to `path` through a temporary file, so that readers
+    see the old file or the new one, never half of one."""
+    tmp_path = '%s.tmp' % path
+    with open(tmp_path, 'wb') as file:
+        file.write(data)
+    os.rename(tmp_path, path)
+
+
+def file_digest(path):
+    """The SHA-1 of the file at `path`, as hex."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        buffer = file.read(65536)
+        while buffer:
+            digest.update(buffer)
+            buffer = file.read(65536)
+    return digest.hexdigest()
@@ -0,0 +1,82 @@
+"""Content-fingerprinted file names for far-future caching.
+
+When fingerprinting is on, each freshly built bundle is also published as a
+copy whose name includes a hash of its contents (bundle.min.js becomes
+bundle.min.3f2a9c1b.js).  Those files never change, so they can be served
+with immutable, far-future cache headers.  The UrlManifest records which
+fingerprinted name is current for each bundle URL, keeps a few older
+generations around for pages that are still being served, and deletes the
+rest.
+"""
+
+from __future__ import with_statement
+
+import errno
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+from asset_manager.compression import SIDECAR_EXTENSIONS
+from asset_manager.fileutil import atomic_write
+
+
+def fingerprinted_name(file_name, contents):
+    """
+    >>> fingerprinted_name('bundle.min.js', 'var a;')
+    'bundle.min.674b80a5.js'
+    """
+    (root, ext) = os.path.splitext(file_name)
+    return '%s.%s%s' % (root, hashlib.md5(contents).hexdigest()[:8], ext)
+
+
+class UrlManifest(object):
+
+    """Maps each bundle URL to its fingerprinted file names, newest first."""
+
+    def __init__(self, path, keep=3):
+        self.path = path
+        self.keep = keep
+        self.lock = threading.Lock()
+        try:
+            with open(path, 'r') as file:
+                self.names = json.loads(file.read())
+        except (IOError, ValueError):
+            self.names = {}
+
+    def lookup(self, url_base, file_name):
+        """The current fingerprinted name for a file, or the file name itself
+        if it hasn't been published."""
+        names = self.names.get(url_base + file_name)
+        return names[0] if names else file_name
+
+    def publish(self, path, url_base, file_name):
+        """Copy `path` to its fingerprinted name and make that current.
+
+        Generations beyond `keep` are deleted, along with their compressed
+        sidecars.  Returns the new name.
+        """
+        with open(path, 'rb') as file:
+            name = fingerprinted_name(file_name, file.read())
+        directory = os.path.dirname(path)
+        shutil.copyfile(path, os.path.join(directory, name))
+        url = url_base + file_name
+        with self.lock:
+            names = [name] + [old for old in self.names.get(url, [])
+                              if old != name]
+            self.names[url] = names[:self.keep]
+            stale = names[self.keep:]
+        for old in stale:
+            for ext in ('',) + SIDECAR_EXTENSIONS:
+                try:
+                    os.remove(os.path.join(directory, old + ext))
+                except OSError, e:
+                    if e.errno != errno.ENOENT:
+                        raise
+        return name
+
+    def save(self):
+        with self.lock:
+            content = json.dumps(self.names, indent=4, sort_keys=True)
+        atomic_write(self.path, content)
@@ -0,0 +1,118 @@
+"""Glob patterns in bundle file lists.
+
+A bundle's files can include patterns such as 'vendor/*.js' or
+'icons/**/*.png', where '**' matches any number of directories.  Patterns
+are matched against a DirectoryListing, which reads each directory once,
+with scandir where it's available, and can be shared by every bundle in a
+config so that a tree used by several bundles is only walked once.  The
+matches come out sorted, so the order doesn't depend on the file system.
+
+As in the shell, names starting with a dot are only matched by a pattern
+that starts with a dot, and '**' doesn't follow symbolic links.
+"""
+
+import fnmatch
+import os
+import re
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+MAGIC = re.compile(r'[*?[]')
+
+
+def has_magic(file):
+    return MAGIC.search(file) is not None
+
+
+def _read_directory(path):
+    """A sorted list of (name, is_dir, is_link) for the entries of `path`,
+    or an empty list if it can't be read."""
+    try:
+        if scandir is not None:
+            entries = [(entry.name, entry.is_dir(), entry.is_symlink())
+                       for entry in scandir(path)]
+        else:
+            entries = []
+            for name in os.listdir(path):
+                full_path = os.path.join(path, name)
+                entries.append((name, os.path.isdir(full_path),
+                                os.path.islink(full_path)))
+    except OSError:
+        return []
+    entries.sort()
+    return entries
+
+
+class DirectoryListing(object):
+
+    """The entries of each directory, read on first use and remembered."""
+
+    def __init__(self):
+        self.entries = {}
+        self.kinds = {}
+
+    def __call__(self, path):
+        """The sorted (name, is_dir, is_link) entries of `path`."""
+        path = os.path.normpath(path)
+        entries = self.entries.get(path)
+        if entries is None:
+            entries = self.entries[path] = _read_directory(path)
+            self.kinds[path] = dict((name, is_dir)
+                                    for (name, is_dir, _) in entries)
+        return entries
+
+    def is_dir(self, path):
+        """Whether `path` is a directory, from its parent's listing if that
+        has been read already; a single file isn't worth reading a whole
+        directory for."""
+        (parent, name) = os.path.split(os.path.normpath(path))
+        kinds = self.kinds.get(os.path.normpath(parent))
+        if kinds is None:
+            return os.path.isdir(path)
+        return kinds.get(name, False)
+
+
+def _match(name, part):
+    if name.startswith('.') and not part.startswith('.'):
+        return False
+    return fnmatch.fnmatchcase(name, part)
+
+
+def expand_pattern(pattern, root, listing, walked=None):
+    """The sorted paths of the files under `root` matching `pattern`,
+    relative to `root`.  The directories read are added to the `walked`
+    set, if it's given."""
+    parts = [part for part in pattern.split('/') if part]
+    if parts and parts[-1] == '**':
+        parts.append('*')
+    matches = set()
+
+    def walk(directory, i):
+        if walked is not None:
+            walked.add(os.path.normpath(os.path.join(root, directory)))
+        part = parts[i]
+        if part == '**':
+            walk(directory, i + 1)
+            for (name, is_dir, is_link) in listing(os.path.join(root,
+                                                                directory)):
+                if is_dir and not is_link and not name.startswith('.'):
+                    walk(directory + name + '/', i)
+            return
+        last = i == len(parts) - 1
+        for (name, is_dir, _) in listing(os.path.join(root, directory)):
+            if not _match(name, part):
+                continue
+            if last and not is_dir:
+                matches.add(directory + name)
+            elif not last and is_dir:
+                walk(directory + name + '/', i + 1)
+
+    if parts:
+        walk('', 0)
+    return sorted(matches)
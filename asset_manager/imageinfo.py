@@ -0,0 +1,87 @@
+"""Reading image dimensions from file headers.
+
+Laying out a sprite only needs the size of each image.  PNG, GIF and JPEG
+files all record it near the start of the file, so we read just those few
+bytes rather than handing the file to PIL.
+"""
+
+from __future__ import with_statement
+
+import struct
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+GIF_SIGNATURES = (b'GIF87a', b'GIF89a')
+JPEG_SIGNATURE = b'\xff\xd8'
+
+# JPEG start-of-frame markers, which hold the size.  C4, C8 and CC are other
+# segments that happen to share the range.
+JPEG_SOF_MARKERS = frozenset(range(0xc0, 0xd0)) - frozenset([0xc4, 0xc8, 0xcc])
+
+
+class UnknownImageFormat(Exception):
+
+    def __init__(self, path):
+        msg = "Can't read the size of %r" % path
+        super(UnknownImageFormat, self).__init__(msg)
+
+
+def _png_size(file):
+    # The IHDR chunk always comes first: length, type, width, height.
+    chunk = file.read(16)
+    if len(chunk) == 16 and chunk[4:8] == b'IHDR':
+        return struct.unpack('>II', chunk[8:16])
+    return None
+
+
+def _gif_size(file):
+    screen = file.read(4)
+    if len(screen) == 4:
+        return struct.unpack('<HH', screen)
+    return None
+
+
+def _jpeg_size(file):
+    while True:
+        byte = file.read(1)
+        while byte and byte != b'\xff':
+            byte = file.read(1)
+        while byte == b'\xff':
+            byte = file.read(1)
+        if not byte:
+            return None
+        marker = ord(byte)
+        if marker in (0x01, 0xd8) or 0xd0 <= marker <= 0xd7:
+            # Markers without a segment.
+            continue
+        length = file.read(2)
+        if len(length) != 2:
+            return None
+        (length,) = struct.unpack('>H', length)
+        if marker in JPEG_SOF_MARKERS:
+            frame = file.read(5)
+            if len(frame) != 5:
+                return None
+            (height, width) = struct.unpack('>xHH', frame)
+            return (width, height)
+        file.seek(length - 2, 1)
+
+
+def image_size(path):
+    """The (width, height) of the PNG, GIF or JPEG image at `path`.
+
+    Raises UnknownImageFormat if the file isn't one of those.
+    """
+    with open(path, 'rb') as file:
+        header = file.read(8)
+        size = None
+        if header == PNG_SIGNATURE:
+            size = _png_size(file)
+        elif header[:6] in GIF_SIGNATURES:
+            file.seek(6)
+            size = _gif_size(file)
+        elif header[:2] == JPEG_SIGNATURE:
+            file.seek(2)
+            size = _jpeg_size(file)
+    if size is None:
+        raise UnknownImageFormat(path)
+    return tuple(size)
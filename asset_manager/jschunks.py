@@ -0,0 +1,143 @@
+"""Compiling many JavaScript bundles in a single Closure Compiler run.
+
+Bundles often share library files.  Rather than parse and optimize those
+files once per bundle, we split the files of all the bundles into chunks
+("modules" in Closure's terms) that are each used by exactly the same set of
+bundles, compile every chunk in one run with --module, and then build each
+bundle by concatenating the compiled chunks it's made of.
+
+A bundle can only take part if its files fall into whole chunks, in the
+same order that every other bundle using those chunks lists them.  Bundles
+that don't are left to be compiled on their own.  Every chunk depends on the
+first one, which is enough for Closure's module graph; we only use SIMPLE
+optimizations, which don't move code between chunks, so each bundle comes
+out the same as if it were compiled alone.
+"""
+
+from __future__ import with_statement
+
+import os
+import shutil
+import tempfile
+
+
+class ChunkPlan(object):
+
+    """How a set of bundles maps onto chunks of a single compile."""
+
+    def __init__(self, bundles, chunks, layouts):
+        self.bundles = bundles
+        # A list of lists of file paths, one per chunk, in compile order.
+        self.chunks = chunks
+        # Maps each bundle key to the chunk indexes it's made of, in order.
+        self.layouts = layouts
+
+    @property
+    def keys(self):
+        return sorted(self.layouts)
+
+    def chunk_name(self, index):
+        return 'chunk%d' % index
+
+    def args(self, output_prefix, externs=()):
+        args = ['--module_output_path_prefix', output_prefix]
+        for index, files in enumerate(self.chunks):
+            for file in files:
+                args.extend(['--js', file])
+            module = '%s:%d' % (self.chunk_name(index), len(files))
+            if index:
+                module = '%s:%s' % (module, self.chunk_name(0))
+            args.extend(['--module', module])
+        for extern in externs:
+            args.extend(['--externs', extern])
+        return args
+
+    def write_bundles(self, output_prefix):
+        """Concatenate the compiled chunks into each bundle's output."""
+        for key, layout in self.layouts.items():
+            with open(self.bundles[key].bundle_path, 'wb') as output:
+                for index in layout:
+                    path = '%s%s.js' % (output_prefix, self.chunk_name(index))
+                    with open(path, 'rb') as chunk:
+                        shutil.copyfileobj(chunk, output)
+
+
+def _group_files(bundles, keys):
+    users = {}
+    for key in keys:
+        for path in bundles[key].full_path_files:
+            users.setdefault(path, set()).add(key)
+    groups = {}
+    order = []
+    seen = set()
+    for key in keys:
+        for path in bundles[key].full_path_files:
+            if path in seen:
+                continue
+            seen.add(path)
+            group = frozenset(users[path])
+            if group not in groups:
+                groups[group] = []
+                order.append(group)
+            groups[group].append(path)
+    return users, groups, order
+
+
+def _layout(files, users, groups):
+    """The groups that make up `files`, or None if they don't line up."""
+    layout = []
+    i = 0
+    while i < len(files):
+        group = frozenset(users[files[i]])
+        if files[i:i + len(groups[group])] != groups[group]:
+            return None
+        layout.append(group)
+        i += len(groups[group])
+    return layout
+
+
+def plan_chunks(bundles):
+    """Plan a single compile for as many of `bundles` as possible.
+
+    `bundles` maps keys to JavascriptBundles that share the same externs.
+    Returns a ChunkPlan, or None if fewer than two bundles can take part.
+    """
+    keys = sorted(key for key, bundle in bundles.items()
+                  if len(set(bundle.full_path_files)) ==
+                  len(bundle.full_path_files))
+    while len(keys) > 1:
+        users, groups, order = _group_files(bundles, keys)
+        layouts = {}
+        for key in keys:
+            layout = _layout(bundles[key].full_path_files, users, groups)
+            if layout is not None:
+                layouts[key] = layout
+        if len(layouts) < len(keys):
+            keys = sorted(layouts)
+            continue
+        # The chunk shared by the most bundles becomes the root.
+        order.sort(key=lambda group: -len(group))
+        index = dict((group, i) for (i, group) in enumerate(order))
+        return ChunkPlan(bundles,
+                         [groups[group] for group in order],
+                         dict((key, [index[group] for group in layout])
+                              for (key, layout) in layouts.items()))
+    return None
+
+
+def compile_chunks(plan, java_runner, compiler_jar, externs=()):
+    """Compile every bundle in `plan` with one run of the Closure Compiler.
+
+    Returns the compiler's exit status.  The bundles are only written if it
+    succeeded.
+    """
+    output_dir = tempfile.mkdtemp(prefix='asset_manager_chunks')
+    output_prefix = output_dir + os.sep
+    try:
+        status = java_runner.run(compiler_jar,
+                                 plan.args(output_prefix, externs))
+        if status == 0:
+            plan.write_bundles(output_prefix)
+        return status
+    finally:
+        shutil.rmtree(output_dir)
@@ -0,0 +1,251 @@
+"""Running the bundled Java tools.
+
+Starting a JVM and warming up the Closure Compiler or YUI Compressor costs
+far more than minifying a typical bundle.  JavaRunner starts a fresh JVM for
+every call, which is simple and always works.  NailgunRunner starts a single
+Nailgun server (http://martiansoftware.com/nailgun/) with both jars on its
+classpath and sends every call to that warm JVM over a local socket, falling
+back to a fresh JVM whenever the server can't be used.
+
+Nailgun isn't bundled; point NailgunRunner (or the ASSET_MANAGER_NAILGUN_JAR
+environment variable) at a nailgun-server jar to use it.  While a call runs,
+the client sends stdin and then a heartbeat every second, which newer
+servers expect from a live client; older servers stop reading once stdin
+ends and never see the heartbeats.
+"""
+
+from __future__ import with_statement
+
+import errno
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+NAILGUN_JAR_ENV = 'ASSET_MANAGER_NAILGUN_JAR'
+NAILGUN_SERVER_CLASS = 'com.martiansoftware.nailgun.NGServer'
+
+# The class Nailgun should run for each bundled jar, i.e. its Main-Class.
+MAIN_CLASSES = {
+    'compiler.jar': 'com.google.javascript.jscomp.CommandLineRunner',
+    'yuicompressor-2.4.2.jar': 'com.yahoo.platform.yui.compressor.Bootstrap',
+}
+
+
+class JavaRunner(object):
+
+    """Runs each jar in a JVM of its own."""
+
+    def command(self, jar, args):
+        return ['java', '-jar', jar] + list(args)
+
+    def run(self, jar, args, stdin=None):
+        """Run `jar` with `args` and return its exit status.
+
+        `stdin` is an optional iterable of strings that's streamed to the
+        tool as it's generated.
+        """
+        if stdin is None:
+            return subprocess.call(self.command(jar, args))
+        proc = subprocess.Popen(self.command(jar, args),
+                                stdin=subprocess.PIPE)
+        try:
+            for chunk in stdin:
+                proc.stdin.write(chunk)
+        except IOError, e:
+            # The tool quit early; its exit status says why.
+            if e.errno != errno.EPIPE:
+                raise
+        finally:
+            try:
+                proc.stdin.close()
+            except IOError:
+                pass
+        return proc.wait()
+
+    def close(self):
+        pass
+
+
+def _free_port(host):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+
+def _read_exactly(sock, length):
+    data = b''
+    while len(data) < length:
+        chunk = sock.recv(length - len(data))
+        if not chunk:
+            raise socket.error("Nailgun server closed the connection")
+        data += chunk
+    return data
+
+
+class NailgunRunner(JavaRunner):
+
+    """Runs jars in a shared, long-lived Nailgun server.
+
+    The server is started the first time it's needed and stopped by close().
+    If it can't be started, or a call can't reach it, we fall back to running
+    a fresh JVM.
+    """
+
+    STARTUP_TIMEOUT = 15.0
+
+    # Seconds between heartbeats to the server during a call.
+    HEARTBEAT_INTERVAL = 1.0
+
+    def __init__(self, jars, nailgun_jar=None, host='127.0.0.1'):
+        self.jars = list(jars)
+        self.nailgun_jar = nailgun_jar or os.environ.get(NAILGUN_JAR_ENV)
+        self.host = host
+        self.port = None
+        self.process = None
+        self.devnull = None
+        self.available = None
+        self.lock = threading.Lock()
+
+    def _start(self):
+        if not self.nailgun_jar or not os.path.exists(self.nailgun_jar):
+            return False
+        self.port = _free_port(self.host)
+        classpath = os.pathsep.join([self.nailgun_jar] + self.jars)
+        self.devnull = open(os.devnull, 'w')
+        try:
+            self.process = subprocess.Popen(
+                ['java', '-cp', classpath, NAILGUN_SERVER_CLASS,
+                 '%s:%d' % (self.host, self.port)],
+                stdout=self.devnull)
+        except OSError:
+            self._stop()
+            return False
+        deadline = time.time() + self.STARTUP_TIMEOUT
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                self._stop()
+                return False
+            try:
+                socket.create_connection((self.host, self.port), 1).close()
+                return True
+            except socket.error:
+                time.sleep(0.1)
+        self._stop()
+        return False
+
+    def _ensure_started(self):
+        with self.lock:
+            if self.available is None:
+                self.available = self._start()
+            return self.available
+
+    def _send(self, sock, type_, data=b''):
+        sock.sendall(struct.pack('>ic', len(data), type_) + data)
+
+    def _connect(self):
+        return socket.create_connection((self.host, self.port))
+
+    def _send_input(self, sock, stdin, done, errors):
+        """Stream stdin to the server, then send heartbeats until `done` is
+        set.  Runs on a thread of its own while the call's output is read."""
+        try:
+            for chunk in stdin or ():
+                self._send(sock, b'0', chunk)
+            self._send(sock, b'.')
+            while not done.wait(self.HEARTBEAT_INTERVAL):
+                self._send(sock, b'H')
+        except socket.error:
+            # The server hung up; the reader finds out why.
+            pass
+        except:
+            # Producing stdin failed: cut the call short and pass the error
+            # on to the reader.
+            errors.append(sys.exc_info())
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def _call(self, sock, main_class, args, stdin=None):
+        done = threading.Event()
+        errors = []
+        sender = None
+        try:
+            for arg in args:
+                self._send(sock, b'A', arg.encode('utf-8'))
+            self._send(sock, b'D', os.getcwd().encode('utf-8'))
+            self._send(sock, b'C', main_class.encode('utf-8'))
+            sender = threading.Thread(target=self._send_input,
+                                      args=(sock, stdin, done, errors))
+            sender.daemon = True
+            sender.start()
+            try:
+                while True:
+                    length, type_ = struct.unpack('>ic',
+                                                  _read_exactly(sock, 5))
+                    data = _read_exactly(sock, length)
+                    if type_ == b'1':
+                        sys.stdout.write(data)
+                    elif type_ == b'2':
+                        sys.stderr.write(data)
+                    elif type_ == b'X':
+                        return int(data.strip())
+                    # Requests for stdin, which is streamed regardless, are
+                    # ignored.
+            except socket.error:
+                if not errors:
+                    raise
+        finally:
+            done.set()
+            if sender is not None:
+                # Wake the sender if it's stuck sending to a finished call.
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+                sender.join()
+            sock.close()
+        (type_, value, traceback) = errors[0]
+        raise type_, value, traceback
+
+    def run(self, jar, args, stdin=None):
+        main_class = MAIN_CLASSES.get(os.path.basename(jar))
+        if main_class and self._ensure_started():
+            # Only fall back if we can't connect: stdin is streamed to the
+            # server, so it can't be sent again once the call has started.
+            try:
+                sock = self._connect()
+            except socket.error:
+                sock = None
+            if sock is not None:
+                return self._call(sock, main_class, args, stdin)
+        return super(NailgunRunner, self).run(jar, args, stdin)
+
+    def _stop(self):
+        if self.process is not None:
+            try:
+                self._call(self._connect(), 'ng-stop', [])
+            except socket.error:
+                pass
+            deadline = time.time() + 5
+            while self.process.poll() is None and time.time() < deadline:
+                time.sleep(0.1)
+            if self.process.poll() is None:
+                self.process.kill()
+                self.process.wait()
+            self.process = None
+        if self.devnull is not None:
+            self.devnull.close()
+            self.devnull = None
+
+    def close(self):
+        with self.lock:
+            self._stop()
+            self.available = None
@@ -0,0 +1,87 @@
+"""Persistent record of what each bundle was last built from.
+
+Every bundle gets a digest covering its input files, its options and the
+tools that build it.  If the digest matches the one recorded for the last
+build and the outputs are still there, the bundle doesn't need rebuilding.
+"""
+
+from __future__ import with_statement
+
+import hashlib
+import json
+import os
+import threading
+
+import asset_manager
+from asset_manager.fileutil import atomic_write
+from asset_manager.fileutil import file_digest
+
+
+_tool_digests = {}
+_tool_digests_lock = threading.Lock()
+
+
+def _tool_digest(path):
+    """Digest of a tool such as a jar, cached while its stat is unchanged."""
+    stat = os.stat(path)
+    key = (path, stat.st_mtime, stat.st_size)
+    with _tool_digests_lock:
+        digest = _tool_digests.get(key)
+    if digest is None:
+        digest = file_digest(path)
+        with _tool_digests_lock:
+            _tool_digests[key] = digest
+    return digest
+
+
+def bundle_digest(bundle):
+    """Hash everything that goes into building `bundle`."""
+    digest = hashlib.sha1()
+    digest.update(asset_manager.__version__.encode('utf-8'))
+    digest.update(bundle.type.encode('utf-8'))
+    options = json.dumps(bundle.options, sort_keys=True)
+    digest.update(options.encode('utf-8'))
+    for tool in bundle.tools:
+        digest.update(os.path.basename(tool).encode('utf-8'))
+        digest.update(_tool_digest(tool).encode('utf-8'))
+    for path in bundle.inputs:
+        digest.update(path.encode('utf-8'))
+        try:
+            digest.update(file_digest(path).encode('utf-8'))
+        except IOError:
+            # Let the build itself report the missing file.
+            digest.update(b'missing')
+    return digest.hexdigest()
+
+
+class BuildManifest(object):
+
+    """The digests of the last successful build of each bundle."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path, 'r') as file:
+                self.digests = json.loads(file.read())
+        except (IOError, ValueError):
+            self.digests = {}
+
+    def is_fresh(self, key, digest, outputs):
+        with self.lock:
+            if self.digests.get(key) != digest:
+                return False
+        return all(os.path.exists(output) for output in outputs)
+
+    def record(self, key, digest):
+        with self.lock:
+            self.digests[key] = digest
+
+    def forget(self, key):
+        with self.lock:
+            self.digests.pop(key, None)
+
+    def save(self):
+        with self.lock:
+            content = json.dumps(self.digests, indent=4, sort_keys=True)
+        atomic_write(self.path, content)
@@ -0,0 +1,271 @@
+"""Lossless PNG optimization.
+
+PNG compresses each row of pixels after running it through one of five
+filters, and then deflates the lot.  Which filter, and which zlib settings,
+give the smallest file depends on the image, so we try several: each filter
+strategy (the same filter on every row, or the best guess row by row) with
+a handful of zlib levels and strategies, and keep the smallest.  The
+ancillary chunks, apart from tRNS which says what's transparent, are
+dropped.  The pixels come out exactly the same.
+
+Given a process pool, the filter strategies run on it, each worker
+decompressing the image itself; without one, they run one after another.
+The search stops when its time budget runs out, keeping the best file found
+so far.  The trials check the deadline as they go, so a large image can't
+overrun it.  The pool is the caller's: AssetManager.minify_all starts one
+before its build threads, since forking from a threaded process isn't safe.
+"""
+
+from __future__ import with_statement
+
+import multiprocessing
+import struct
+import time
+import zlib
+from itertools import imap
+from itertools import izip
+
+from asset_manager.fileutil import atomic_write
+from asset_manager.imageinfo import PNG_SIGNATURE
+
+# Chunks that are kept.  Everything else is ancillary: text, timestamps,
+# physical dimensions and so on.
+KEPT_CHUNKS = frozenset([b'IHDR', b'PLTE', b'tRNS', b'IDAT', b'IEND'])
+
+# Samples per pixel for each PNG color type.
+CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+# 'original' keeps the image's own filters and only recompresses it.
+FILTER_STRATEGIES = ('original', 'none', 'sub', 'up', 'average', 'paeth',
+                     'adaptive')
+
+# (level, strategy) pairs for zlib.  Strategies 1, 2 and 3 are
+# Z_FILTERED, Z_HUFFMAN_ONLY and Z_RLE.
+ZLIB_SETTINGS = ((9, 0), (9, 1), (9, 2), (9, 3), (6, 0), (6, 1))
+
+# Signed distance from zero of a filtered byte, for the adaptive strategy.
+_COST = [value if value < 128 else 256 - value for value in xrange(256)]
+
+
+class InvalidPng(Exception):
+
+    def __init__(self, path, reason):
+        msg = "Can't optimize %r: %s" % (path, reason)
+        super(InvalidPng, self).__init__(msg)
+
+
+class _OutOfTime(Exception):
+    pass
+
+
+def _check_deadline(deadline):
+    if deadline is not None and time.time() >= deadline:
+        raise _OutOfTime()
+
+
+def read_chunks(data):
+    """Split PNG `data` into a list of (type, body) chunks."""
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError("not a PNG")
+    chunks = []
+    pos = len(PNG_SIGNATURE)
+    while pos + 8 <= len(data):
+        (length,) = struct.unpack('>I', data[pos:pos + 4])
+        type_ = data[pos + 4:pos + 8]
+        chunks.append((type_, data[pos + 8:pos + 8 + length]))
+        pos += 12 + length
+        if type_ == b'IEND':
+            break
+    if not chunks or chunks[0][0] != b'IHDR' or chunks[-1][0] != b'IEND':
+        raise ValueError("truncated")
+    return chunks
+
+
+def write_chunks(chunks):
+    out = [PNG_SIGNATURE]
+    for (type_, body) in chunks:
+        out.append(struct.pack('>I', len(body)))
+        out.append(type_)
+        out.append(body)
+        out.append(struct.pack('>I', zlib.crc32(type_ + body) & 0xffffffff))
+    return b''.join(out)
+
+
+def _paeth(a, b, c):
+    p = a + b - c
+    pa = abs(p - a)
+    pb = abs(p - b)
+    pc = abs(p - c)
+    if pa <= pb and pa <= pc:
+        return a
+    if pb <= pc:
+        return b
+    return c
+
+
+def unfilter(data, height, stride, bpp, deadline=None):
+    """Undo the row filters of decompressed image data; returns the raw
+    rows, without filter type bytes, as a bytearray."""
+    out = bytearray()
+    prev = bytearray(stride)
+    pos = 0
+    for _ in xrange(height):
+        _check_deadline(deadline)
+        type_ = ord(data[pos:pos + 1])
+        row = bytearray(data[pos + 1:pos + 1 + stride])
+        pos += 1 + stride
+        if type_ == 1:
+            for i in xrange(bpp, stride):
+                row[i] = (row[i] + row[i - bpp]) & 0xff
+        elif type_ == 2:
+            row = bytearray((x + up) & 0xff for (x, up) in izip(row, prev))
+        elif type_ == 3:
+            for i in xrange(stride):
+                left = row[i - bpp] if i >= bpp else 0
+                row[i] = (row[i] + ((left + prev[i]) >> 1)) & 0xff
+        elif type_ == 4:
+            for i in xrange(stride):
+                if i >= bpp:
+                    (left, upleft) = (row[i - bpp], prev[i - bpp])
+                else:
+                    (left, upleft) = (0, 0)
+                row[i] = (row[i] + _paeth(left, prev[i], upleft)) & 0xff
+        elif type_ != 0:
+            raise ValueError("bad filter type %d" % type_)
+        out.extend(row)
+        prev = row
+    return out
+
+
+def _filter_row(type_, row, prev, bpp):
+    left = bytearray(bpp) + row[:-bpp]
+    if type_ == 0:
+        return row
+    if type_ == 1:
+        return bytearray((x - l) & 0xff for (x, l) in izip(row, left))
+    if type_ == 2:
+        return bytearray((x - u) & 0xff for (x, u) in izip(row, prev))
+    if type_ == 3:
+        return bytearray((x - ((l + u) >> 1)) & 0xff
+                         for (x, l, u) in izip(row, left, prev))
+    upleft = bytearray(bpp) + prev[:-bpp]
+    return bytearray((x - _paeth(l, u, ul)) & 0xff
+                     for (x, l, u, ul) in izip(row, left, prev, upleft))
+
+
+def filter_rows(raw, height, stride, bpp, strategy, deadline=None):
+    """Filter raw rows with one of the FILTER_STRATEGIES (except
+    'original').  'adaptive' picks, for each row, the filter whose output
+    is closest to zero, which is what libpng does."""
+    types = {'none': 0, 'sub': 1, 'up': 2, 'average': 3, 'paeth': 4}
+    out = []
+    prev = bytearray(stride)
+    for y in xrange(height):
+        _check_deadline(deadline)
+        row = bytearray(raw[y * stride:(y + 1) * stride])
+        if strategy == 'adaptive':
+            candidates = [(sum(_COST[v] for v in filtered), type_, filtered)
+                          for (type_, filtered) in
+                          ((t, _filter_row(t, row, prev, bpp))
+                           for t in xrange(5))]
+            (_, type_, filtered) = min(candidates)
+        else:
+            type_ = types[strategy]
+            filtered = _filter_row(type_, row, prev, bpp)
+        out.append(chr(type_))
+        out.append(bytes(filtered))
+        prev = row
+    return b''.join(out)
+
+
+def _compress(data, level, strategy):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, 9,
+                                  strategy)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _trial((strategy, idat, height, stride, bpp, deadline)):
+    """Filter and compress the image every way for one filter strategy.
+
+    Returns the smallest compressed data, or None if the deadline passed
+    first.
+    """
+    best = None
+    try:
+        # Tasks still queued when a shared pool's caller gave up.
+        _check_deadline(deadline)
+        data = zlib.decompress(idat)
+        if strategy != 'original':
+            raw = unfilter(data, height, stride, bpp, deadline)
+            data = filter_rows(raw, height, stride, bpp, strategy, deadline)
+        for (level, zlib_strategy) in ZLIB_SETTINGS:
+            _check_deadline(deadline)
+            compressed = _compress(data, level, zlib_strategy)
+            if best is None or len(compressed) < len(best):
+                best = compressed
+    except _OutOfTime:
+        pass
+    return best
+
+
+def optimize_png(path, seconds=None, pool=None):
+    """Rewrite the PNG at `path` as small as we can make it in `seconds`,
+    running the trials on `pool`, a multiprocessing.Pool, if it's given.
+
+    Returns (bytes before, bytes after).  The file is only rewritten if it
+    got smaller.  Raises InvalidPng if it can't be read.
+    """
+    deadline = time.time() + seconds if seconds is not None else None
+    with open(path, 'rb') as file:
+        original = file.read()
+    try:
+        chunks = read_chunks(original)
+        (width, height, depth, color_type, _, _, interlace) = \
+            struct.unpack('>IIBBBBB', chunks[0][1])
+    except (ValueError, struct.error), e:
+        raise InvalidPng(path, e)
+    idat = b''.join(body for (type_, body) in chunks if type_ == b'IDAT')
+    kept = [chunk for chunk in chunks if chunk[0] in KEPT_CHUNKS]
+    header = [chunk for chunk in kept if chunk[0] not in (b'IDAT', b'IEND')]
+
+    def encode(compressed):
+        return write_chunks(header + [(b'IDAT', compressed), (b'IEND', b'')])
+
+    # Dropping the ancillary chunks alone is the result to beat.
+    best = write_chunks(kept)
+    bits = CHANNELS.get(color_type, 4) * depth
+    stride = (width * bits + 7) // 8
+    bpp = max(1, bits // 8)
+    # Interlaced images are filtered pass by pass; we only recompress those.
+    strategies = FILTER_STRATEGIES[:1] if interlace else FILTER_STRATEGIES
+    tasks = [(strategy, idat, height, stride, bpp, deadline)
+             for strategy in strategies]
+    try:
+        if pool is None:
+            results = imap(_trial, tasks)
+        else:
+            results = pool.imap_unordered(_trial, tasks)
+        for _ in tasks:
+            if pool is None:
+                compressed = results.next()
+            else:
+                # The workers stop at the deadline on their own, but don't
+                # wait on one that's stuck in a single zlib call.
+                timeout = None
+                if deadline is not None:
+                    timeout = max(0, deadline - time.time()) + 1
+                try:
+                    compressed = results.next(timeout)
+                except multiprocessing.TimeoutError:
+                    break
+            if compressed is None:
+                continue
+            candidate = encode(compressed)
+            if len(candidate) < len(best):
+                best = candidate
+    except (ValueError, TypeError, zlib.error), e:
+        raise InvalidPng(path, e)
+    if len(best) >= len(original):
+        return (len(original), len(original))
+    atomic_write(path, best)
+    return (len(original), len(best))
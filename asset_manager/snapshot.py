@@ -0,0 +1,52 @@
+"""A compiled snapshot of the bundle config, for fast startup.
+
+Reading the config means expanding every directory entry with os.listdir,
+which is slow on network storage when there are many bundles.  Each build
+saves the bundle settings with their file lists already expanded and their
+paths resolved, and an AssetManager created with use_snapshot loads that in
+a single read, making each bundle only when it's first used.
+
+The snapshot is only used while the config's mtime and size match the ones
+it was made from.  A file added to a bundle's directory doesn't change the
+config, so it's picked up by the next build, not the next start.
+"""
+
+from __future__ import with_statement
+
+import json
+import os
+
+import asset_manager
+from asset_manager.fileutil import atomic_write
+
+
+def config_stamp(config_path):
+    """What a snapshot is checked against: the config's mtime and size."""
+    stat = os.stat(config_path)
+    return [stat.st_mtime, stat.st_size]
+
+
+def read_snapshot(path, stamp):
+    """The bundle settings saved at `path`, or None if there's no snapshot
+    or it wasn't made from the config with `stamp`."""
+    try:
+        with open(path, 'r') as file:
+            snapshot = json.loads(file.read())
+    except (IOError, ValueError):
+        return None
+    if (not isinstance(snapshot, dict) or
+            snapshot.get('version') != asset_manager.__version__ or
+            snapshot.get('config') != stamp):
+        return None
+    return snapshot.get('bundles')
+
+
+def write_snapshot(path, stamp, bundles):
+    """Save the settings of each bundle, a dict of dicts, for the config
+    with `stamp`."""
+    content = json.dumps({
+        'version': asset_manager.__version__,
+        'config': stamp,
+        'bundles': bundles,
+    }, indent=4, sort_keys=True)
+    atomic_write(path, content)
@@ -0,0 +1,325 @@
+"""Compositing packed images into a sprite.
+
+composite() pastes the images into a single in-memory canvas, opening each
+image as it's placed and letting go of it straight after.  For very large
+sprites, composite_in_strips() never holds the whole canvas: it fills one
+band of rows at a time and streams each band into the PNG file with
+PngWriter, so memory use is bounded by the band and the images crossing it
+rather than by the size of the sprite.
+
+split_sheets() divides the images of a sprite among several sheets that
+each stay within a maximum size, and group_identical() finds the images
+that only need placing once.
+"""
+
+from __future__ import with_statement
+
+import binascii
+import hashlib
+import math
+import os
+import struct
+import zlib
+
+from asset_manager.bin_packing import pack_boxes
+from asset_manager.fileutil import file_digest
+from asset_manager.imageinfo import PNG_SIGNATURE
+
+# Default memory budget for composite_in_strips, in bytes.
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def squarish_width(boxes, step=16):
+    """A multiple of `step` that makes the sprite squarish, and so no box is
+    too wide to fit."""
+    total_area = sum(box.width * box.height for box in boxes)
+    return max(max(box.width for box in boxes),
+               (int(math.sqrt(total_area)) // step + 1) * step)
+
+
+def _pack_sheet(boxes, strategy, max_width, max_height):
+    width = squarish_width(boxes)
+    if max_width is not None:
+        width = min(width, max_width)
+    sheet = pack_boxes(boxes, width, strategy)
+    if (max_height is not None and sheet[1] > max_height and
+            max_width is not None and width < max_width):
+        # Going as wide as allowed might bring it under the height.
+        sheet = pack_boxes(boxes, max_width, strategy)
+    return sheet
+
+
+def split_sheets(boxes, strategy='shelf', max_width=None, max_height=None):
+    """Split the boxes among sheets that each pack within max_width by
+    max_height, and return a (width, height, packing) for each sheet.
+
+    The boxes stay in order, so each sheet holds a run of neighbouring
+    boxes, and a change to one image only touches its own sheet.  Raises
+    ValueError if a box is bigger than a sheet.
+    """
+    for box in boxes:
+        if ((max_width is not None and box.width > max_width) or
+                (max_height is not None and box.height > max_height)):
+            raise ValueError("%r is bigger than %rx%r" % (box, max_width,
+                                                          max_height))
+
+    def fits(sheet):
+        return max_height is None or sheet[1] <= max_height
+
+    sheets = []
+    start = 0
+    while start < len(boxes):
+        # No more boxes than could fit by area...
+        end = start + 1
+        if max_width is not None and max_height is not None:
+            room = max_width * max_height - boxes[start].width * \
+                boxes[start].height
+            while end < len(boxes):
+                room -= boxes[end].width * boxes[end].height
+                if room < 0:
+                    break
+                end += 1
+        else:
+            end = len(boxes)
+        # ...and then the most that pack within the limits, by bisection.
+        best = _pack_sheet(boxes[start:start + 1], strategy, max_width,
+                           max_height)
+        (low, high) = (start + 1, end)
+        while low < high:
+            middle = (low + high + 1) // 2
+            sheet = _pack_sheet(boxes[start:middle], strategy, max_width,
+                                max_height)
+            if fits(sheet):
+                (low, best) = (middle, sheet)
+            else:
+                high = middle - 1
+        sheets.append(best)
+        start = low
+    return sheets
+
+
+def _pixels_digest(box):
+    image = box.open()
+    if image.mode != 'RGBA':
+        image = image.convert('RGBA')
+    return hashlib.sha1(_raw_rgba(image)).digest()
+
+
+def group_identical(boxes):
+    """Group the ImageBoxes whose images have the same pixels.
+
+    Returns a list of groups, in the order of their first box, each a list
+    of boxes in order.  Only images of the same size are compared: first by
+    their bytes, and then, for files that differ, by their decoded pixels.
+    """
+    by_size = {}
+    for box in boxes:
+        by_size.setdefault((box.width, box.height), []).append(box)
+    # The first box with the same pixels as each box.
+    leaders = {}
+    for same_size in by_size.itervalues():
+        if len(same_size) == 1:
+            continue
+        file_digests = [(box, file_digest(box.filename)) for box in same_size]
+        decode = len(set(digest for (_, digest) in file_digests)) > 1
+        # Only the first of each byte-identical file needs decoding.
+        pixels = {}
+        firsts = {}
+        for (box, digest) in file_digests:
+            if decode:
+                if digest not in pixels:
+                    pixels[digest] = _pixels_digest(box)
+                digest = pixels[digest]
+            leaders[id(box)] = firsts.setdefault(digest, box)
+    groups = []
+    index = {}
+    for box in boxes:
+        leader = leaders.get(id(box), box)
+        if id(leader) not in index:
+            index[id(leader)] = len(groups)
+            groups.append([])
+        groups[index[id(leader)]].append(box)
+    return groups
+
+
+def _placement_order(packing):
+    return sorted(packing, key=lambda (left, top, box): (top, left))
+
+
+def _raw_rgba(image):
+    # Pillow renamed tostring to tobytes.
+    tobytes = getattr(image, 'tobytes', None) or image.tostring
+    return tobytes()
+
+
+def composite(packing, width, height):
+    """Paste the images of `packing` into a new RGBA image and return it.
+
+    The boxes must be ImageBoxes.  Only one source image is open at a time.
+    """
+    import Image  # If this fails, you need the Python Imaging Library.
+    sprite = Image.new(mode='RGBA', size=(width, height), color=(0, 0, 0, 0))
+    for (left, top, box) in _placement_order(packing):
+        image = box.open()
+        sprite.paste(image, (left, top))
+        del image
+    return sprite
+
+
+def _subtract_bytes(a, b):
+    """Subtract each byte of `b` from the byte of `a` in the same place,
+    modulo 256.  The bytes are worked on as two long integers, with the top
+    bit of each byte set aside so that no byte borrows from the next."""
+    n = len(a)
+    high = int(b'80' * n, 16)
+    low = int(b'7f' * n, 16)
+    x = int(binascii.hexlify(a), 16)
+    y = int(binascii.hexlify(b), 16)
+    z = ((x | high) - (y & low)) ^ ((x ^ ~y) & high)
+    return binascii.unhexlify(b'%0*x' % (2 * n, z))
+
+
+class PngWriter(object):
+
+    """Writes an 8-bit RGBA PNG a few rows at a time.
+
+    Each row gets whichever of the None, Sub and Up filters leaves it the
+    most zero bytes, which does well on the flat colours and transparent
+    gaps of a sprite.  The filters are worked out a band at a time with
+    long integer arithmetic, since strip output is too big for the
+    optimizer's pure Python filters.
+    """
+
+    # Compressed data is written out in IDAT chunks of about this size.
+    CHUNK_SIZE = 256 * 1024
+
+    def __init__(self, path, width, height, level=6):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.rows = 0
+        # The last row written, which the next band's Up filter needs.
+        self.previous = b'\x00' * (width * 4)
+        self.file = open(path, 'wb')
+        self.compressor = zlib.compressobj(level)
+        self.pending = []
+        self.pending_size = 0
+        self.file.write(PNG_SIGNATURE)
+        self._write_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height,
+                                               8, 6, 0, 0, 0))
+
+    def _write_chunk(self, type_, data):
+        self.file.write(struct.pack('>I', len(data)))
+        self.file.write(type_)
+        self.file.write(data)
+        self.file.write(struct.pack('>I',
+                                    zlib.crc32(type_ + data) & 0xffffffff))
+
+    def _write_data(self, data, flush=False):
+        if data:
+            self.pending.append(data)
+            self.pending_size += len(data)
+        if self.pending and (flush or self.pending_size >= self.CHUNK_SIZE):
+            self._write_chunk(b'IDAT', b''.join(self.pending))
+            self.pending = []
+            self.pending_size = 0
+
+    def write_rows(self, data):
+        """Write whole rows of raw RGBA pixels."""
+        stride = self.width * 4
+        if len(data) % stride:
+            raise ValueError("Partial row of %d bytes" % (len(data) % stride))
+        rows = len(data) // stride
+        if self.rows + rows > self.height:
+            raise ValueError("More than %d rows" % self.height)
+        self.rows += rows
+        if not data:
+            return
+        # Each pixel less the one to its left, and less the one above.
+        left = b''.join(b'\x00' * 4 + data[i:i + stride - 4]
+                        for i in xrange(0, len(data), stride))
+        sub = _subtract_bytes(data, left)
+        up = _subtract_bytes(data, self.previous + data[:-stride])
+        self.previous = data[-stride:]
+        # Every row starts with its filter type.
+        filtered = []
+        for i in xrange(0, len(data), stride):
+            candidates = [(row.count(b'\x00'), -type_, row) for (type_, row)
+                          in enumerate((data[i:i + stride], sub[i:i + stride],
+                                        up[i:i + stride]))]
+            (_, type_, row) = max(candidates)
+            filtered.append(chr(-type_))
+            filtered.append(row)
+        self._write_data(self.compressor.compress(b''.join(filtered)))
+
+    def close(self):
+        if self.rows != self.height:
+            self.abort()
+            raise ValueError("Wrote %d of %d rows" % (self.rows, self.height))
+        try:
+            self._write_data(self.compressor.flush(), flush=True)
+            self._write_chunk(b'IEND', b'')
+        finally:
+            self.file.close()
+
+    def abort(self):
+        """Close and delete the unfinished file."""
+        self.file.close()
+        os.remove(self.path)
+
+
+def composite_in_strips(packing, width, height, path,
+                        max_bytes=DEFAULT_MAX_BYTES):
+    """Composite the images of `packing` and write the sprite to `path` as a
+    PNG, a band of rows at a time.
+
+    Half of `max_bytes` goes to the band.  Images that cross into the next
+    band are kept open while the other half allows, and opened again
+    otherwise.
+    """
+    import Image  # If this fails, you need the Python Imaging Library.
+    stride = width * 4
+    band_height = max(1, min(height, max_bytes // 2 // max(stride, 1)))
+    cache_bytes = max_bytes - band_height * stride
+    order = _placement_order(packing)
+    writer = PngWriter(path, width, height)
+    try:
+        # The placements that reach the current band, and the open images
+        # of the ones that carry on past it.
+        next_placement = 0
+        crossing = []
+        images = {}
+        cached = 0
+        for band_top in xrange(0, height, band_height):
+            band_bottom = min(height, band_top + band_height)
+            while (next_placement < len(order) and
+                   order[next_placement][1] < band_bottom):
+                crossing.append(order[next_placement])
+                next_placement += 1
+            band = Image.new(mode='RGBA', size=(width, band_bottom - band_top),
+                             color=(0, 0, 0, 0))
+            still_crossing = []
+            for placement in crossing:
+                (left, top, box) = placement
+                image = images.pop(id(box), None)
+                if image is None:
+                    image = box.open()
+                else:
+                    cached -= box.width * box.height * 4
+                part = image.crop((0, max(0, band_top - top), box.width,
+                                   min(box.height, band_bottom - top)))
+                band.paste(part, (left, max(0, top - band_top)))
+                if top + box.height > band_bottom:
+                    still_crossing.append(placement)
+                    size = box.width * box.height * 4
+                    if cached + size <= cache_bytes:
+                        images[id(box)] = image
+                        cached += size
+                del image, part
+            crossing = still_crossing
+            writer.write_rows(_raw_rgba(band))
+            del band
+    except:
+        writer.abort()
+        raise
+    writer.close()
@@ -0,0 +1,55 @@
+"""Compare the packing strategies on sets of random icon-sized boxes.
+
+Run with: python -m asset_manager.tests.benchmark_packing [count ...]
+
+For each strategy this prints the time taken and the efficiency, the area
+of the boxes over the area of the sprite they're packed into.
+"""
+
+import random
+import sys
+import time
+
+from asset_manager.bin_packing import Box
+from asset_manager.bin_packing import STRATEGIES
+from asset_manager.bin_packing import check_no_overlap
+from asset_manager.bin_packing import pack_boxes
+
+# Icons mostly come in a few standard sizes, with some odd ones.
+ICON_SIZES = [(16, 16), (24, 24), (32, 32), (48, 48), (64, 64), (16, 32)]
+
+
+def random_boxes(count, seed=0):
+    rand = random.Random(seed)
+    boxes = []
+    for _ in xrange(count):
+        if rand.random() < 0.7:
+            (width, height) = rand.choice(ICON_SIZES)
+        else:
+            (width, height) = (rand.randrange(8, 200), rand.randrange(8, 120))
+        boxes.append(Box(width, height))
+    return boxes
+
+
+def benchmark(count, out=sys.stdout):
+    boxes = random_boxes(count)
+    area = sum(box.width * box.height for box in boxes)
+    for strategy in sorted(STRATEGIES):
+        start = time.time()
+        (width, height, packing) = pack_boxes(boxes, strategy=strategy)
+        elapsed = time.time() - start
+        assert len(packing) == len(boxes)
+        assert check_no_overlap(packing)
+        print >> out, "%6d boxes  %-9s %8.3fs  %4dx%-6d %5.1f%%" % (
+            count, strategy, elapsed, width, height,
+            100.0 * area / (width * height))
+
+
+def main(argv=None):
+    counts = [int(arg) for arg in (argv or sys.argv[1:])] or [100, 1000, 5000]
+    for count in counts:
+        benchmark(count)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,16 @@
 """Tests for the bin packing algorithm."""
 
+import multiprocessing
 import random
 import unittest
 
 from asset_manager.bin_packing import Box
+from asset_manager.bin_packing import STRATEGIES
 from asset_manager.bin_packing import pack_boxes
+from asset_manager.bin_packing import search_width
+from asset_manager.bin_packing import boxes_overlap
 from asset_manager.bin_packing import check_no_overlap
+from asset_manager.bin_packing import find_overlap
 
 
 class BinPackingTest(unittest.TestCase):
@@ -20,6 +25,28 @@ class BinPackingTest(unittest.TestCase):
         packing = [(0, 0, Box(2, 2)), (2, 0, Box(2, 2))]
         self.assert_(check_no_overlap(packing))
 
+    def test_check_crossing_overlap(self):
+        # Neither box has a corner inside the other.
+        packing = [(1, 0, Box(1, 3)), (0, 1, Box(3, 1))]
+        self.assert_(not check_no_overlap(packing))
+
+    def test_find_overlap(self):
+        packing = [(0, 0, Box(2, 2)), (2, 0, Box(2, 2)), (3, 1, Box(2, 2)),
+                   (0, 2, Box(2, 2))]
+        self.assertEqual(find_overlap(packing), (packing[1], packing[2]))
+        self.assertEqual(find_overlap(packing[:2] + packing[3:]), None)
+
+    def test_find_overlap_matches_all_pairs(self):
+        rand = random.Random(0)
+        for _ in xrange(200):
+            packing = [(rand.randrange(0, 20), rand.randrange(0, 20),
+                        Box(rand.randrange(1, 6), rand.randrange(1, 6)))
+                       for _ in xrange(rand.randrange(1, 8))]
+            overlapping = any(boxes_overlap(a, b)
+                              for (i, a) in enumerate(packing)
+                              for b in packing[i + 1:])
+            self.assertEqual(find_overlap(packing) is not None, overlapping)
+
     def test_pack_single(self):
         boxes = [Box(1, 1)]
         packing = [(0, 0, Box(1, 1))]
@@ -133,5 +160,71 @@ class BinPackingTest(unittest.TestCase):
             self.assert_(check_no_overlap(actual))
 
 
+class PackingStrategyTest(unittest.TestCase):
+
+    def test_strategies_place_every_box(self):
+        rand = random.Random(0)
+        boxes = [Box(rand.randrange(1, 40), rand.randrange(1, 40))
+                 for _ in xrange(200)]
+        for strategy in STRATEGIES:
+            (width, height, packing) = pack_boxes(boxes, strategy=strategy)
+            self.assertEqual(sorted(id(box) for (_, _, box) in packing),
+                             sorted(id(box) for box in boxes))
+            self.assert_(check_no_overlap(packing))
+            for (left, top, box) in packing:
+                self.assert_(left + box.width <= width)
+                self.assert_(top + box.height <= height)
+
+    def test_fills_gaps_shelf_leaves(self):
+        # The shelf strategy starts a new strip for C:
+        # AAB
+        # AA
+        # C
+        boxes = [Box(2, 2), Box(1, 1), Box(1, 1)]
+        for strategy in ('maxrects', 'skyline'):
+            self.assertEqual(pack_boxes(boxes, 3, strategy)[1], 2)
+        self.assertEqual(pack_boxes(boxes, 3, 'shelf')[1], 3)
+
+    def test_unknown_strategy(self):
+        self.assertRaises(ValueError, pack_boxes, [Box(1, 1)], 1, 'best')
+
+
+
+class WidthSearchTest(unittest.TestCase):
+
+    def setUp(self):
+        rand = random.Random(0)
+        self.boxes = [Box(rand.randrange(1, 40), rand.randrange(1, 40))
+                      for _ in xrange(100)]
+
+    def area(self, (width, height, _)):
+        return width * height
+
+    def test_no_bigger_than_squarish_width(self):
+        (width, height, packing) = search_width(self.boxes, widths=1)
+        self.assertEqual(width % 16, 0)
+        self.assertEqual((width, height, packing),
+                         pack_boxes(self.boxes, width))
+        best = search_width(self.boxes)
+        self.assert_(self.area(best) <= width * height)
+        self.assert_(check_no_overlap(best[2]))
+        self.assertEqual(len(best[2]), len(self.boxes))
+
+    def test_max_size(self):
+        (width, height, _) = search_width(self.boxes, max_size=256)
+        self.assert_(width <= 256 and height <= 256)
+        self.assertRaises(ValueError, search_width, self.boxes, max_size=50)
+
+    def test_parallel(self):
+        pool = multiprocessing.Pool(2)
+        try:
+            self.assertEqual(self.area(search_width(self.boxes * 2, step=8,
+                                                    pool=pool)),
+                             self.area(search_width(self.boxes * 2, step=8)))
+        finally:
+            pool.terminate()
+            pool.join()
+
+
 if __name__ == "__main__":
     unittest.main()
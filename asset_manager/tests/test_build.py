@@ -0,0 +1,105 @@
+"""Tests for the bundle build scheduler."""
+
+import threading
+import time
+import unittest
+
+from asset_manager.build import BuildError
+from asset_manager.build import DependencyCycle
+from asset_manager.build import build_bundles
+from asset_manager.build import bundle_dependencies
+
+
+class FakeBundle(object):
+
+    def __init__(self, inputs, outputs):
+        self.inputs = inputs
+        self.outputs = outputs
+
+
+def _bundles():
+    return {
+        'sprite': FakeBundle(['/img/a.png'], ['/img/s.png', '/css/s.css']),
+        'css': FakeBundle(['/css/s.css', '/css/a.css'], ['/css/b.min.css']),
+        'js': FakeBundle(['/js/a.js'], ['/js/b.min.js']),
+    }
+
+
+class BuildTest(unittest.TestCase):
+
+    def test_dependencies(self):
+        self.assertEqual(bundle_dependencies(_bundles()), {
+            'sprite': set(),
+            'css': set(['sprite']),
+            'js': set(),
+        })
+
+    def test_dependencies_built_first(self):
+        built = []
+        lock = threading.Lock()
+
+        def build(key):
+            time.sleep(0.01)
+            with lock:
+                built.append(key)
+
+        for jobs in (1, 3):
+            del built[:]
+            result = build_bundles(_bundles(), build, jobs=jobs)
+            self.assertEqual(sorted(result.built), ['css', 'js', 'sprite'])
+            self.assert_(built.index('sprite') < built.index('css'))
+
+    def test_runs_in_parallel(self):
+        bundles = dict(('b%d' % i, FakeBundle([], ['/out%d' % i]))
+                       for i in range(4))
+        barrier = threading.Semaphore(0)
+        seen = []
+
+        def build(key):
+            seen.append(key)
+            if len(seen) == 4:
+                for _ in range(4):
+                    barrier.release()
+            # Deadlocks unless all four builds run at the same time.
+            self.assert_(barrier.acquire(True))
+
+        build_bundles(bundles, build, jobs=4)
+        self.assertEqual(len(seen), 4)
+
+    def test_skipped(self):
+        result = build_bundles(_bundles(), lambda key: key != 'js')
+        self.assertEqual(result.skipped, ['js'])
+
+    def test_only_some_keys(self):
+        built = []
+        build_bundles(_bundles(), built.append, keys=['css'])
+        self.assertEqual(built, ['css'])
+
+    def test_fail_fast(self):
+        built = []
+
+        def build(key):
+            if key == 'sprite':
+                raise IOError("no such file")
+            built.append(key)
+
+        try:
+            build_bundles(_bundles(), build, order=lambda b: len(b.inputs))
+            self.fail("BuildError not raised")
+        except BuildError, e:
+            self.assertEqual(e.key, 'sprite')
+            self.assert_('no such file' in str(e))
+        # The CSS bundle needs the sprite, so it must never start.
+        self.assert_('css' not in built)
+
+    def test_cycle(self):
+        bundles = {
+            'a': FakeBundle(['/b'], ['/a']),
+            'b': FakeBundle(['/a'], ['/b']),
+        }
+        self.assertRaises(DependencyCycle, build_bundles, bundles,
+                          lambda key: None)
+
+
+if __name__ == "__main__":
+    unittest.main()
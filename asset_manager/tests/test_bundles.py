@@ -33,6 +33,9 @@ def _remove_static_files():
     _remove_static_file('testjs', 'bundle.min.js')
     _remove_static_file('testimg', 'sprite.png')
     _remove_static_file('testimg', 'sprite2.png')
+    _remove_static_file('', 'example_setup.manifest.json')
+    _remove_static_file('', 'example_setup.datauris.json')
+    _remove_static_file('', 'example_setup.snapshot.json')
 
 
 class TestBundles(unittest.TestCase):
@@ -64,7 +67,7 @@ class TestBundles(unittest.TestCase):
         bin_path = os.path.join(os.path.dirname(bundles.__file__), 'bin')
         self.assertEqual(bundle._minify_command,
             'java -jar {bin}{sep}yuicompressor-2.4.2.jar --type css '
-            '-o {css_path}{sep}bundle.min.css {css_path}{sep}bundle.min.css.tmp'
+            '-o {css_path}{sep}bundle.min.css'
             .format(bin=bin_path,
                 css_path=path_base,
                 sep=os.path.sep))
@@ -102,6 +105,8 @@ class TestBundles(unittest.TestCase):
         self.assertEqual(bundle.path_base, path_base)
         self.assertEqual(bundle.url_base, '/images/')
         self.assertEqual(bundle.sprite_prefix, 'sprite')
+        self.assertEqual(bundle.packing, 'shelf')
+        self.assertEqual(bundle.width_search, None)
         self.assertEqual(bundle.css_path_base, os.path.join(self.setup_path,
                                                             'testcss'))
         self.assertEqual(bundle.files, ('test1.png', 'test2.png'))
@@ -157,6 +162,27 @@ class TestBundles(unittest.TestCase):
                              'alert(helloVariable)};sayHello();(function(){'
                              'alert("hello")})();\n')
 
+    def test_concat_js(self):
+        manager = AssetManager(json_setup_path, build_mode='concat')
+        bundle = manager.get('bundle.js')
+        self.assertEqual(bundle.tools, [])
+        bundle.minify()
+        sources = []
+        for path in bundle.full_path_files:
+            with open(path, 'rb') as file:
+                sources.append(file.read())
+        with open(bundle.bundle_path, 'rb') as file:
+            self.assertEqual(file.read(), '\n;\n'.join(sources))
+
+    def test_concat_css_leaves_images(self):
+        manager = AssetManager(json_setup_path, build_mode='concat')
+        bundle = manager.get('bundle3.css')
+        bundle.minify()
+        with open(bundle.full_path_files[0], 'rb') as file:
+            source = file.read()
+        with open(bundle.bundle_path, 'rb') as file:
+            self.assertEqual(file.read(), source)
+
     def test_minify_image_in_sub_folders(self):
         bundle = self.bundle_manager.get('sprite2.png')
         bundle.minify()
@@ -164,7 +190,8 @@ class TestBundles(unittest.TestCase):
                                'testimg',
                                'sprite2.png'), 'r') as file:
             file_contents = file.read()
-            self.assertEqual(len(file_contents), 4572)
+            # The optimizer only ever makes it smaller.
+            self.assertTrue(len(file_contents) <= 4572)
 
         with open(os.path.join(self.setup_path,
                                'testcss',
@@ -187,7 +214,8 @@ class TestBundles(unittest.TestCase):
                                'testimg',
                                'sprite.png'), 'r') as file:
             file_contents = file.read()
-            self.assertEqual(len(file_contents), 4572)
+            # The optimizer only ever makes it smaller.
+            self.assertTrue(len(file_contents) <= 4572)
 
         with open(os.path.join(self.setup_path,
                                'testcss',
@@ -201,6 +229,26 @@ class TestBundles(unittest.TestCase):
                 'width: 20px;\n     background-position: 0px -60px;\n     '
                 'height: 25px;\n}\n')
 
+    def test_compact_sprite_css(self):
+        bundle = self.bundle_manager.get('sprite.png')
+        bundle.css_style = 'compact'
+        (test1, test2) = [bundles.ImageBox(path)
+                          for path in bundle.full_path_files]
+        copy = bundles.ImageBox('copy_of_test1.png', (20, 25))
+        bundle.generate_css([[(0, 0, test2), (0, 60, test1)]],
+                            {id(test1): [copy]})
+        with open(bundle.css_path, 'r') as file:
+            file_contents = file.read()
+        self.assertEqual(file_contents,
+            '/* Generated classes for sprites.  Don\'t edit! */\n'
+            '.sprite{background-image:url(\'/images/sprite.png\')}\n'
+            '.sprite-test2{width:50px;height:60px;background-position:0 0}\n'
+            '.sprite-test1,.sprite-copy-of-test1'
+            '{width:20px;height:25px;background-position:0 -60px}\n')
+        self.assertEqual(bundle.build_stats['css']['bytes'],
+                         len(file_contents))
+        self.assertTrue(0 < bundle.build_stats['css']['gzip_bytes'])
+
     def test_bundle_all(self):
         # This is here to ensure that test_bundle_all blows up if
         # sprite.css isn't created before the first css bundle
@@ -327,5 +375,37 @@ class TestPrintingHtmlOfBundles(unittest.TestCase):
             'src="http://static.test.com/scripts/page2.js"></script>')
 
 
+class TestHtmlCache(unittest.TestCase):
+
+    def setUp(self):
+        self.bundle_manager = AssetManager(json_setup_path,
+                                           print_minified=True,
+                                           domain='')
+
+    def test_cache_hits(self):
+        html = self.bundle_manager.get_html('bundle.js')
+        self.assertEqual(self.bundle_manager.get_html('bundle.js'), html)
+        self.assertEqual(self.bundle_manager.html_cache.stats,
+                         {'entries': 1, 'hits': 1, 'misses': 1})
+
+    def test_cache_keyed_by_settings(self):
+        minified = self.bundle_manager.get_html('bundle.js')
+        self.bundle_manager.domain = 'http://static.test.com'
+        with_domain = self.bundle_manager.get_html('bundle.js')
+        self.bundle_manager.print_minified = False
+        not_minified = self.bundle_manager.get_html('bundle.js')
+        self.assertEqual(len(set([minified, with_domain, not_minified])), 3)
+        self.assertEqual(self.bundle_manager.html_cache.misses, 3)
+
+    def test_cache_invalidated(self):
+        self.bundle_manager.get_html('bundle.js')
+        self.bundle_manager.invalidate_html_cache()
+        self.bundle_manager.get_html('bundle.js')
+        self.bundle_manager.reload()
+        self.bundle_manager.get_html('bundle.js')
+        self.assertEqual(self.bundle_manager.html_cache.misses, 3)
+        self.assertEqual(self.bundle_manager.html_cache.hits, 0)
+
+
 if __name__ == '__main__':
     unittest.main()
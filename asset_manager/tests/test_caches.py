@@ -0,0 +1,66 @@
+"""Tests for the inline source cache."""
+
+from __future__ import with_statement
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from asset_manager.caches import SourceCache
+
+
+class SourceCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, content):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as file:
+            file.write(content)
+        return path
+
+    def test_hit_after_miss(self):
+        path = self.write('a.css', 'a{}')
+        cache = SourceCache(100)
+        self.assertEqual(cache.read(path), 'a{}')
+        self.assertEqual(cache.read(path), 'a{}')
+        stats = cache.stats
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['bytes'], 3)
+
+    def test_changed_file_reread(self):
+        path = self.write('a.css', 'a{}')
+        cache = SourceCache(100)
+        cache.read(path)
+        self.write('a.css', 'a{color:red}')
+        self.assertEqual(cache.read(path), 'a{color:red}')
+        self.assertEqual(cache.stats['bytes'], 12)
+        self.assertEqual(cache.stats['entries'], 1)
+
+    def test_evicts_least_recently_used(self):
+        a = self.write('a.css', 'a' * 40)
+        b = self.write('b.css', 'b' * 40)
+        c = self.write('c.css', 'c' * 40)
+        cache = SourceCache(100)
+        cache.read(a)
+        cache.read(b)
+        cache.read(a)
+        cache.read(c)
+        self.assertEqual(list(cache.files), [a, c])
+        self.assertEqual(cache.stats['evictions'], 1)
+        self.assertEqual(cache.stats['bytes'], 80)
+
+    def test_too_big_not_cached(self):
+        path = self.write('a.css', 'a' * 101)
+        cache = SourceCache(100)
+        self.assertEqual(cache.read(path), 'a' * 101)
+        self.assertEqual(cache.stats['entries'], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
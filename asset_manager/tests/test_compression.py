@@ -0,0 +1,68 @@
+"""Tests for precompressed sidecar files."""
+
+from __future__ import with_statement
+
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from asset_manager import compression
+from asset_manager.compression import is_compressible
+from asset_manager.compression import write_sidecars
+
+
+class CompressionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, content):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as file:
+            file.write(content)
+        return path
+
+    def test_is_compressible(self):
+        self.assert_(is_compressible('/a/bundle.min.js'))
+        self.assert_(is_compressible('/a/bundle.min.674b80a5.CSS'))
+        self.assert_(not is_compressible('/a/sprite.png'))
+
+    def test_gzip_sidecar(self):
+        content = 'var helloVariable="hello";' * 100
+        path = self.write('bundle.min.js', content)
+        sizes = write_sidecars(path)
+        self.assert_(sizes['.gz'] < len(content))
+        with gzip.open(path + '.gz') as file:
+            self.assertEqual(file.read(), content)
+        if compression.brotli is None:
+            self.assert_(not os.path.exists(path + '.br'))
+        else:
+            self.assert_(sizes['.br'] < len(content))
+
+    def test_gzip_is_deterministic(self):
+        path = self.write('bundle.min.js', 'a{}' * 100)
+        write_sidecars(path)
+        with open(path + '.gz', 'rb') as file:
+            first = file.read()
+        write_sidecars(path)
+        with open(path + '.gz', 'rb') as file:
+            self.assertEqual(file.read(), first)
+
+    def test_skips_sidecar_that_is_not_smaller(self):
+        path = self.write('bundle.min.css', 'a{}' * 100)
+        write_sidecars(path)
+        self.assert_(os.path.exists(path + '.gz'))
+        # Rebuilt into something that doesn't compress; the old sidecar
+        # mustn't be left behind.
+        self.write('bundle.min.css', 'a{}')
+        self.assertEqual(write_sidecars(path)['.gz'], None)
+        self.assert_(not os.path.exists(path + '.gz'))
+
+
+if __name__ == "__main__":
+    unittest.main()
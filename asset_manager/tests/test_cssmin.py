@@ -0,0 +1,145 @@
+"""Tests for the in-process CSS minifier.
+
+The expected output for the testcss fixtures is what the YUI Compressor
+2.4.2 produces for them (see test_bundles).
+"""
+
+from __future__ import with_statement
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from asset_manager.bundles import AssetManager
+from asset_manager.bundles import CssBundle
+from asset_manager.cssmin import merge_adjacent_rules
+from asset_manager.cssmin import minify
+
+setup_path = os.path.abspath(os.path.dirname(__file__))
+json_setup_path = os.path.join(setup_path, 'example_setup.json')
+
+
+def _read(*names):
+    contents = []
+    for name in names:
+        with open(os.path.join(setup_path, 'testcss', name)) as file:
+            contents.append(file.read())
+    return ''.join(contents)
+
+
+SPRITE_CSS = """/* Generated classes for sprites.  Don't edit! */
+
+.sprite {
+     background-image: url('/images/sprite.png');
+}
+
+.sprite-test2 {
+     width: 50px;
+     background-position: 0px 0px;
+     height: 60px;
+}
+
+.sprite-test1 {
+     width: 20px;
+     background-position: 0px -60px;
+     height: 25px;
+}
+"""
+
+
+class YuiEquivalenceTest(unittest.TestCase):
+
+    def test_color_and_text(self):
+        self.assertEqual(minify(_read('color.css', 'text.css')),
+                         '.green{color:green;}#nice{color:#fff;}#try{color:'
+                         '#fefefe;}#oh{color:#e96;}#my{color:#e96;}h1{'
+                         'font-weight:bold;font-weight:normal;}h2.smaller'
+                         '{font-size:12px;}')
+
+    def test_img(self):
+        self.assertEqual(minify(_read('img.css')),
+                         ".green{background:url('../testimg/test1.png');}"
+                         "#green{background:url('../testimg/test2.png');}"
+                         "#try{color:#fefefe;}")
+
+    def test_sprite(self):
+        self.assertEqual(minify(SPRITE_CSS + _read('color.css', 'text.css')),
+                         '.sprite{background-image:url(\'/images/sprite.png'
+                         '\');}.sprite-test2{width:50px;background-position'
+                         ':0 0;height:60px;}.sprite-test1{width:20px;backgr'
+                         'ound-position:0 -60px;height:25px;}'
+                         '.green{color:green;}#nice{color:#fff;}#try{color:'
+                         '#fefefe;}#oh{color:#e96;}#my{color:#e96;}h1{'
+                         'font-weight:bold;font-weight:normal;}h2.smaller'
+                         '{font-size:12px;}')
+
+    def test_data_uri_bundle(self):
+        manager = AssetManager(json_setup_path, css_engine='python')
+        bundle = manager.get('bundle3.css')
+        bundle.minify()
+        try:
+            with open(bundle.bundle_path) as file:
+                file_contents = file.read()
+        finally:
+            os.remove(bundle.bundle_path)
+        self.assertEqual(len(file_contents), 7386)
+        self.assertEqual(file_contents.count('data:image/png;base64'), 2)
+        self.assertEqual(file_contents.count('#try{color:#fefefe;}'), 1)
+
+    def test_non_ascii_bundle(self):
+        directory = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(directory, 'a.css'), 'wb') as file:
+                file.write('a:after { content: "\xe2\x86\x92" }\n')
+            bundle = CssBundle('a.min.css', directory, '/styles/',
+                               ['a.css'], False, 'python')
+            bundle.minify()
+            with open(bundle.bundle_path, 'rb') as file:
+                self.assertEqual(file.read(),
+                                 'a:after{content:"\xe2\x86\x92";}')
+        finally:
+            shutil.rmtree(directory)
+
+
+class MinifyTest(unittest.TestCase):
+
+    def test_zeros(self):
+        self.assertEqual(minify('a { margin: 0px 0px 0px 0px; '
+                                'padding: 0em 0; opacity: 0.5 }'),
+                         'a{margin:0;padding:0;opacity:.5;}')
+
+    def test_colors(self):
+        self.assertEqual(minify('a { color: rgb(255, 0, 0); '
+                                'background: #AABBCC; border: none }'),
+                         'a{color:#f00;background:#ABC;border:0;}')
+
+    def test_strings_and_comments(self):
+        self.assertEqual(minify('/*! keep */ a { content: "  /* x */  " }'
+                                ' /* drop */'),
+                         '/*! keep */ a{content:"  /* x */  ";}')
+        self.assertEqual(minify('/* "not a string */ a { content: \'it"s\' }'
+                                ' b { content: "unclosed }'),
+                         'a{content:\'it"s\';}b{content:"unclosed;}')
+
+    def test_pseudo_class_space(self):
+        self.assertEqual(minify('a :hover { color: red }'),
+                         'a :hover{color:red;}')
+
+    def test_empty_rules(self):
+        self.assertEqual(minify('a {} b { color: red }'), 'b{color:red;}')
+
+    def test_merge_adjacent_rules(self):
+        self.assertEqual(minify('a { color: red } a { margin: 0 } '
+                                'b { color: red } b { color: red } '
+                                'a { padding: 0 }'),
+                         'a{color:red;margin:0;}b{color:red;}a{padding:0;}')
+
+    def test_merge_leaves_at_rules(self):
+        css = ('@font-face{src:url(a);}@font-face{src:url(b);}'
+               '@media print{a{color:red;}}@media print{a{color:red;}}')
+        self.assertEqual(merge_adjacent_rules(css), css)
+
+
+if __name__ == "__main__":
+    unittest.main()
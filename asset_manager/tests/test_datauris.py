@@ -0,0 +1,110 @@
+"""Tests for inlining CSS images as data URIs."""
+
+from __future__ import with_statement
+
+import os
+import unittest
+
+from asset_manager.datauris import DataUriCache
+from asset_manager.datauris import add_data_uris_to_css
+from asset_manager.datauris import add_data_uris_to_css_chunks
+from asset_manager.datauris import convert_file_to_data_uri
+
+setup_path = os.path.abspath(os.path.dirname(__file__))
+css_path = os.path.join(setup_path, 'testcss')
+image_path = os.path.join(setup_path, 'testimg', 'test1.png')
+
+
+class DataUriTest(unittest.TestCase):
+
+    def test_inlines_quoted_and_unquoted(self):
+        data_uri = convert_file_to_data_uri(image_path)
+        css = ("a{background:url('../testimg/test1.png')}"
+               'b{background:url("../testimg/test1.png")}'
+               'c{background:url(../testimg/test1.png)}')
+        self.assertEqual(add_data_uris_to_css(css, css_path),
+                         "a{background:url('%s')}"
+                         'b{background:url("%s")}'
+                         'c{background:url(%s)}' % ((data_uri,) * 3))
+
+    def test_only_rewrites_inside_url(self):
+        css = ('a{background:url(../testimg/test1.png)}'
+               '/* ../testimg/test1.png */')
+        self.assert_(add_data_uris_to_css(css, css_path)
+                     .endswith('/* ../testimg/test1.png */'))
+
+    def test_leaves_missing_and_unknown_images(self):
+        css = ('a{background:url(../testimg/missing.png)}'
+               'b{background:url(../testcss/color.css)}'
+               'c{background:url(data:image/png;base64,AAAA)}')
+        self.assertEqual(add_data_uris_to_css(css, css_path), css)
+
+    def test_encodes_each_image_once(self):
+        import asset_manager.datauris as datauris
+        calls = []
+        original = datauris.convert_file_to_data_uri
+
+        def counting(path):
+            calls.append(path)
+            return original(path)
+
+        datauris.convert_file_to_data_uri = counting
+        try:
+            add_data_uris_to_css('a{background:url(../testimg/test1.png)}' * 5,
+                                 css_path)
+        finally:
+            datauris.convert_file_to_data_uri = original
+        self.assertEqual(len(calls), 1)
+
+    def test_skips_images_over_max_size(self):
+        css = 'a{background:url(../testimg/test1.png)}'
+        stats = {}
+        self.assertEqual(add_data_uris_to_css(css, css_path, max_size=10,
+                                              stats=stats), css)
+        self.assertEqual(stats, {'images': 0, 'bytes': 0, 'too_big': 1})
+        add_data_uris_to_css(css * 2, css_path, stats=stats)
+        self.assertEqual(stats['images'], 2)
+        self.assertEqual(stats['bytes'],
+                         2 * len(convert_file_to_data_uri(image_path)))
+
+    def test_chunks_match_whole_stylesheet(self):
+        css = ('a{background:url(../testimg/test1.png)}\n'
+               'b{background:url("../testimg/test2.png") no-repeat}\n'
+               'c{background:url(missing.png}\n'
+               'd{background:url(../testimg/test1.png)}')
+        expected = add_data_uris_to_css(css, css_path)
+        for size in (1, 2, 3, 5, 7, 64):
+            chunks = [css[i:i + size] for i in range(0, len(css), size)]
+            self.assertEqual(
+                ''.join(add_data_uris_to_css_chunks(chunks, css_path)),
+                expected)
+
+
+class DataUriCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(setup_path, 'test.datauris.json')
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_persists_between_builds(self):
+        cache = DataUriCache(self.path)
+        data_uri = cache.get(image_path)
+        cache.save()
+        cache = DataUriCache(self.path)
+        cache.entries[os.path.abspath(image_path)][2] = 'cached'
+        self.assertEqual(cache.get(image_path), 'cached')
+        self.assertNotEqual(data_uri, 'cached')
+
+    def test_reencodes_changed_images(self):
+        cache = DataUriCache()
+        cache.get(image_path)
+        cache.entries[os.path.abspath(image_path)][:2] = [0, 0]
+        self.assertEqual(cache.get(image_path),
+                         convert_file_to_data_uri(image_path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+"""Tests for the shared file helpers."""
+
+from __future__ import with_statement
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from asset_manager.bundles import AssetManager
+from asset_manager.fileutil import atomic_write
+from asset_manager.fileutil import file_digest
+from asset_manager.fileutil import sidecar_path
+
+
+class FileUtilTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_sidecar_path(self):
+        self.assertEqual(sidecar_path('/srv/assets.json', 'manifest'),
+                         '/srv/assets.manifest.json')
+        config = os.path.join(self.dir, 'assets.json')
+        with open(config, 'w') as file:
+            file.write('{}')
+        manager = AssetManager(config, fingerprint=True)
+        self.assertEqual(manager.snapshot_path,
+                         os.path.join(self.dir, 'assets.snapshot.json'))
+        self.assertEqual(manager.url_manifest.path,
+                         os.path.join(self.dir, 'assets.urls.json'))
+
+    def test_atomic_write(self):
+        path = os.path.join(self.dir, 'out.json')
+        atomic_write(path, b'old')
+        atomic_write(path, b'new')
+        with open(path, 'rb') as file:
+            self.assertEqual(file.read(), b'new')
+        self.assertEqual(os.listdir(self.dir), ['out.json'])
+
+    def test_file_digest(self):
+        path = os.path.join(self.dir, 'a.js')
+        atomic_write(path, b'x' * 100000)
+        self.assertEqual(file_digest(path),
+                         hashlib.sha1(b'x' * 100000).hexdigest())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+"""Tests for fingerprinted bundle names."""
+
+from __future__ import with_statement
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from asset_manager.bundles import JavascriptBundle
+from asset_manager.fingerprint import UrlManifest
+from asset_manager.fingerprint import fingerprinted_name
+
+
+class FingerprintTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.manifest_path = os.path.join(self.dir, 'assets.urls.json')
+        self.bundle = JavascriptBundle('bundle.min.js', self.dir, '/js/',
+                                       [], None)
+        self.bundle.url_manifest = UrlManifest(self.manifest_path, keep=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def build(self, content):
+        with open(self.bundle.bundle_path, 'w') as file:
+            file.write(content)
+        self.bundle.publish()
+        return fingerprinted_name('bundle.min.js', content)
+
+    def test_name(self):
+        self.assertEqual(fingerprinted_name('bundle.min.js', 'var a;'),
+                         'bundle.min.674b80a5.js')
+
+    def test_unpublished_uses_file_name(self):
+        self.assertEqual(self.bundle.bundle_url, '/js/bundle.min.js')
+
+    def test_publish(self):
+        name = self.build('var a;')
+        self.assert_(os.path.exists(os.path.join(self.dir, name)))
+        self.assertEqual(self.bundle.bundle_url, '/js/' + name)
+        self.assertEqual(self.bundle.get_html(True, 'http://cdn', False),
+                         '<script type="text/javascript" '
+                         'src="http://cdn/js/%s"></script>' % name)
+
+    def test_prunes_old_generations(self):
+        first = self.build('var a;')
+        second = self.build('var b;')
+        third = self.build('var c;')
+        self.assert_(not os.path.exists(os.path.join(self.dir, first)))
+        self.assert_(os.path.exists(os.path.join(self.dir, second)))
+        self.assertEqual(self.bundle.url_manifest.names['/js/bundle.min.js'],
+                         [third, second])
+
+    def test_prunes_sidecars(self):
+        first = self.build('var a;')
+        for ext in ('.gz', '.br'):
+            with open(os.path.join(self.dir, first + ext), 'w') as file:
+                file.write(ext)
+        self.build('var b;')
+        self.build('var c;')
+        self.assertEqual(sorted(name for name in os.listdir(self.dir)
+                                if name.startswith(first)), [])
+
+    def test_saved(self):
+        name = self.build('var a;')
+        self.bundle.url_manifest.save()
+        manifest = UrlManifest(self.manifest_path)
+        self.assertEqual(manifest.lookup('/js/', 'bundle.min.js'), name)
+
+
+if __name__ == "__main__":
+    unittest.main()
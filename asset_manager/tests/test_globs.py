@@ -0,0 +1,101 @@
+"""Tests for glob patterns in bundle file lists."""
+
+from __future__ import with_statement
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from asset_manager import globs
+from asset_manager.bundles import resolve_files
+from asset_manager.globs import DirectoryListing
+from asset_manager.globs import expand_pattern
+
+
+class CountingListing(DirectoryListing):
+
+    def __init__(self):
+        super(CountingListing, self).__init__()
+        self.reads = []
+
+    def __call__(self, path):
+        if os.path.normpath(path) not in self.entries:
+            self.reads.append(os.path.normpath(path))
+        return super(CountingListing, self).__call__(path)
+
+
+class ExpandPatternTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        for path in ('vendor/b.js', 'vendor/a.js', 'vendor/a.css',
+                     'vendor/.hidden.js', 'icons/z.png', 'icons/small/a.png',
+                     'icons/small/deep/b.png', 'icons/small/notes.txt',
+                     'icons/.cache/c.png'):
+            path = os.path.join(self.dir, path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as file:
+                file.write(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def expand(self, pattern):
+        return expand_pattern(pattern, self.dir, DirectoryListing())
+
+    def test_star(self):
+        self.assertEqual(self.expand('vendor/*.js'),
+                         ['vendor/a.js', 'vendor/b.js'])
+        self.assertEqual(self.expand('vendor/.*.js'), ['vendor/.hidden.js'])
+        self.assertEqual(self.expand('*/z.png'), ['icons/z.png'])
+        self.assertEqual(self.expand('missing/*.js'), [])
+
+    def test_recursive(self):
+        self.assertEqual(self.expand('icons/**/*.png'),
+                         ['icons/small/a.png', 'icons/small/deep/b.png',
+                          'icons/z.png'])
+        self.assertEqual(self.expand('icons/**'),
+                         ['icons/small/a.png', 'icons/small/deep/b.png',
+                          'icons/small/notes.txt', 'icons/z.png'])
+        self.assertEqual(self.expand('**/deep/*.png'),
+                         ['icons/small/deep/b.png'])
+
+    def test_without_scandir(self):
+        original = globs.scandir
+        globs.scandir = None
+        try:
+            self.assertEqual(self.expand('icons/**/*.png'),
+                             ['icons/small/a.png', 'icons/small/deep/b.png',
+                              'icons/z.png'])
+        finally:
+            globs.scandir = original
+
+    def test_directories_read_once(self):
+        listing = CountingListing()
+        files = resolve_files(['icons/**/*.png', 'icons/small/', 'vendor/*.js',
+                               'vendor/a.css'], self.dir, listing)
+        files += resolve_files(['icons/**/*.txt'], self.dir, listing)
+        self.assertEqual(files, ('icons/small/a.png', 'icons/small/deep/b.png',
+                                 'icons/z.png', 'icons/small/a.png',
+                                 'icons/small/notes.txt',
+                                 'vendor/a.js', 'vendor/b.js', 'vendor/a.css',
+                                 'icons/small/notes.txt'))
+        self.assertEqual(len(listing.reads), len(set(listing.reads)))
+
+    def test_plain_files_do_not_read_their_directory(self):
+        listing = CountingListing()
+        files = resolve_files(['vendor/a.js', 'vendor/b.js', 'icons/small/'],
+                              self.dir, listing)
+        self.assertEqual(files, ('vendor/a.js', 'vendor/b.js',
+                                 'icons/small/a.png',
+                                 'icons/small/notes.txt'))
+        # Subdirectories of a directory entry aren't files of the bundle.
+        self.assertFalse('icons/small/deep' in files)
+        self.assertEqual(listing.reads,
+                         [os.path.join(self.dir, 'icons', 'small')])
+
+
+if __name__ == "__main__":
+    unittest.main()
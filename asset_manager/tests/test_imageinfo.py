@@ -0,0 +1,56 @@
+"""Tests for reading image sizes from headers."""
+
+from __future__ import with_statement
+
+import os
+import struct
+import tempfile
+import unittest
+
+from asset_manager.imageinfo import UnknownImageFormat
+from asset_manager.imageinfo import image_size
+
+image_path = os.path.join(os.path.abspath(os.path.dirname(__file__)),
+                          'testimg')
+
+
+class ImageSizeTest(unittest.TestCase):
+
+    def setUp(self):
+        (fd, self.path) = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def write(self, data):
+        with open(self.path, 'wb') as file:
+            file.write(data)
+
+    def test_png(self):
+        self.assertEqual(image_size(os.path.join(image_path, 'test1.png')),
+                         (20, 25))
+        self.assertEqual(image_size(os.path.join(image_path, 'test2.png')),
+                         (50, 60))
+
+    def test_gif(self):
+        self.write(b'GIF89a' + struct.pack('<HH', 300, 7) + b'\x00' * 20)
+        self.assertEqual(image_size(self.path), (300, 7))
+
+    def test_jpeg(self):
+        app0 = b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00' + b'\x00' * 9
+        # A DHT segment (C4) sits in the SOF range but isn't a frame.
+        dht = b'\xff\xc4' + struct.pack('>H', 4) + b'\x00\x00'
+        sof = b'\xff\xc2' + struct.pack('>HBHH', 17, 8, 480, 640)
+        self.write(b'\xff\xd8' + app0 + dht + sof + b'\x00' * 12)
+        self.assertEqual(image_size(self.path), (640, 480))
+
+    def test_unknown(self):
+        self.write(b'BM' + b'\x00' * 30)
+        self.assertRaises(UnknownImageFormat, image_size, self.path)
+        self.write(b'\xff\xd8\xff\xe0\x00')
+        self.assertRaises(UnknownImageFormat, image_size, self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
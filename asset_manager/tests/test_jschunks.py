@@ -0,0 +1,68 @@
+"""Tests for compiling JS bundles as chunks of a single compile."""
+
+import unittest
+
+from asset_manager.jschunks import plan_chunks
+
+
+class FakeBundle(object):
+
+    def __init__(self, *files):
+        self.full_path_files = list(files)
+
+
+class PlanChunksTest(unittest.TestCase):
+
+    def test_shared_prefix(self):
+        plan = plan_chunks({
+            'a': FakeBundle('jquery.js', 'util.js', 'a.js'),
+            'b': FakeBundle('jquery.js', 'util.js', 'b1.js', 'b2.js'),
+        })
+        self.assertEqual(plan.keys, ['a', 'b'])
+        self.assertEqual(plan.chunks, [['jquery.js', 'util.js'],
+                                       ['a.js'],
+                                       ['b1.js', 'b2.js']])
+        self.assertEqual(plan.layouts, {'a': [0, 1], 'b': [0, 2]})
+        self.assertEqual(plan.args('/tmp/out/'), [
+            '--module_output_path_prefix', '/tmp/out/',
+            '--js', 'jquery.js', '--js', 'util.js',
+            '--module', 'chunk0:2',
+            '--js', 'a.js',
+            '--module', 'chunk1:1:chunk0',
+            '--js', 'b1.js', '--js', 'b2.js',
+            '--module', 'chunk2:2:chunk0',
+        ])
+
+    def test_nested_sharing(self):
+        plan = plan_chunks({
+            'a': FakeBundle('lib.js', 'ui.js', 'a.js'),
+            'b': FakeBundle('lib.js', 'ui.js', 'b.js'),
+            'c': FakeBundle('lib.js', 'c.js'),
+        })
+        self.assertEqual(plan.keys, ['a', 'b', 'c'])
+        # lib.js is used by everything, so it's the root chunk.
+        self.assertEqual(plan.chunks[0], ['lib.js'])
+        for key, files in (('a', ['lib.js', 'ui.js', 'a.js']),
+                           ('c', ['lib.js', 'c.js'])):
+            chunks = [plan.chunks[i] for i in plan.layouts[key]]
+            self.assertEqual(sum(chunks, []), files)
+
+    def test_conflicting_order_left_out(self):
+        plan = plan_chunks({
+            'a': FakeBundle('lib.js', 'util.js', 'a.js'),
+            'b': FakeBundle('lib.js', 'util.js', 'b.js'),
+            'c': FakeBundle('util.js', 'lib.js', 'c.js'),
+        })
+        self.assertEqual(plan.keys, ['a', 'b'])
+        self.assertEqual(plan.chunks[0], ['lib.js', 'util.js'])
+
+    def test_nothing_to_share(self):
+        self.assertEqual(plan_chunks({'a': FakeBundle('a.js')}), None)
+        self.assertEqual(plan_chunks({
+            'a': FakeBundle('x.js', 'y.js'),
+            'b': FakeBundle('y.js', 'x.js'),
+        }), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
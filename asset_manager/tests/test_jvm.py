@@ -0,0 +1,133 @@
+"""Tests for running the Java tools through Nailgun."""
+
+import socket
+import struct
+import threading
+import unittest
+
+from asset_manager.jvm import JavaRunner
+from asset_manager.jvm import NailgunRunner
+from asset_manager.jvm import _free_port
+from asset_manager.jvm import _read_exactly
+
+
+class FakeNailgunServer(threading.Thread):
+
+    """Accepts one Nailgun request and records its chunks.  It answers
+    after the end of stdin and `heartbeats` heartbeats."""
+
+    def __init__(self, exit_code, heartbeats=0):
+        super(FakeNailgunServer, self).__init__()
+        self.daemon = True
+        self.exit_code = exit_code
+        self.heartbeats = heartbeats
+        self.chunks = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(1)
+        self.port = self.sock.getsockname()[1]
+
+    def run(self):
+        conn, _ = self.sock.accept()
+        try:
+            while True:
+                try:
+                    length, type_ = struct.unpack('>ic',
+                                                  _read_exactly(conn, 5))
+                except socket.error:
+                    # The client gave up on the call.
+                    return
+                self.chunks.append((type_, _read_exactly(conn, length)))
+                types = [type_ for (type_, _) in self.chunks]
+                if '.' in types and types.count('H') >= self.heartbeats:
+                    break
+            conn.sendall(struct.pack('>ic', 0, 'H'))
+            conn.sendall(struct.pack('>ic', 1, 'X') + str(self.exit_code))
+        finally:
+            conn.close()
+            self.sock.close()
+
+
+class RecordingRunner(NailgunRunner):
+
+    def __init__(self, *args, **kwargs):
+        super(RecordingRunner, self).__init__(*args, **kwargs)
+        self.fallbacks = []
+
+    def command(self, jar, args):
+        self.fallbacks.append(jar)
+        return ['true']
+
+
+class NailgunRunnerTest(unittest.TestCase):
+
+    def test_one_shot_command(self):
+        self.assertEqual(JavaRunner().command('/bin/compiler.jar', ['--js']),
+                         ['java', '-jar', '/bin/compiler.jar', '--js'])
+
+    def test_tool_that_quits_early(self):
+        runner = RecordingRunner(['/bin/compiler.jar'], nailgun_jar=None)
+        chunks = ('x' * 65536 for _ in range(64))
+        self.assertEqual(runner.run('/bin/compiler.jar', [], stdin=chunks), 0)
+
+    def test_falls_back_without_nailgun(self):
+        runner = RecordingRunner(['/bin/compiler.jar'], nailgun_jar=None)
+        self.assertEqual(runner.run('/bin/compiler.jar', ['--js', 'a.js']), 0)
+        self.assertEqual(runner.fallbacks, ['/bin/compiler.jar'])
+        runner.close()
+
+    def test_sends_request_to_server(self):
+        server = FakeNailgunServer(3)
+        server.start()
+        runner = RecordingRunner(['/bin/compiler.jar'])
+        runner.available = True
+        runner.port = server.port
+        status = runner.run('/bin/yuicompressor-2.4.2.jar',
+                            ['--type', 'css'], stdin=['a{}'])
+        server.join()
+        self.assertEqual(status, 3)
+        self.assertEqual(runner.fallbacks, [])
+        types = [type_ for (type_, _) in server.chunks]
+        self.assertEqual(types, ['A', 'A', 'D', 'C', '0', '.'])
+        self.assertEqual(server.chunks[3][1],
+                         'com.yahoo.platform.yui.compressor.Bootstrap')
+        self.assertEqual(server.chunks[4][1], 'a{}')
+
+    def test_sends_heartbeats(self):
+        server = FakeNailgunServer(0, heartbeats=2)
+        server.start()
+        runner = RecordingRunner(['/bin/compiler.jar'])
+        runner.HEARTBEAT_INTERVAL = 0.01
+        runner.available = True
+        runner.port = server.port
+        self.assertEqual(runner.run('/bin/compiler.jar', []), 0)
+        server.join()
+        types = [type_ for (type_, _) in server.chunks]
+        self.assertEqual(types, ['D', 'C', '.', 'H', 'H'])
+
+    def test_stdin_error_ends_call(self):
+        server = FakeNailgunServer(0, heartbeats=1000)
+        server.start()
+        runner = RecordingRunner(['/bin/compiler.jar'])
+        runner.available = True
+        runner.port = server.port
+
+        def stdin():
+            yield 'a{}'
+            raise IOError("can't read")
+
+        self.assertRaises(IOError, runner.run, '/bin/compiler.jar', [],
+                          stdin())
+        server.join()
+        self.assertEqual(server.chunks[-1], ('0', 'a{}'))
+
+    def test_falls_back_when_server_is_gone(self):
+        runner = RecordingRunner(['/bin/compiler.jar'])
+        runner.available = True
+        runner.port = _free_port('127.0.0.1')  # Nothing listens here.
+        self.assertEqual(runner.run('/bin/compiler.jar', []), 0)
+        self.assertEqual(runner.fallbacks, ['/bin/compiler.jar'])
+
+
+if __name__ == "__main__":
+    unittest.main()
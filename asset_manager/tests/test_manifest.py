@@ -0,0 +1,77 @@
+"""Tests for the incremental build manifest."""
+
+from __future__ import with_statement
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from asset_manager.bundles import CssBundle
+from asset_manager.bundles import JavascriptBundle
+from asset_manager.manifest import BuildManifest
+from asset_manager.manifest import bundle_digest
+
+
+def _write(path, content):
+    with open(path, 'w') as file:
+        file.write(content)
+
+
+class ManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        _write(os.path.join(self.dir, 'a.js'), 'var a = 1;')
+        _write(os.path.join(self.dir, 'b.js'), 'var b = 2;')
+        _write(os.path.join(self.dir, 'externs.js'), 'var jQuery;')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _js_bundle(self, files=('a.js', 'b.js'), externs=None):
+        return JavascriptBundle('bundle.min.js', self.dir, '/js/', files,
+                                externs)
+
+    def test_digest_is_stable(self):
+        self.assertEqual(bundle_digest(self._js_bundle()),
+                         bundle_digest(self._js_bundle()))
+
+    def test_digest_changes_with_content(self):
+        before = bundle_digest(self._js_bundle())
+        _write(os.path.join(self.dir, 'b.js'), 'var b = 3;')
+        self.assertNotEqual(before, bundle_digest(self._js_bundle()))
+
+    def test_digest_changes_with_file_order(self):
+        self.assertNotEqual(bundle_digest(self._js_bundle(('a.js', 'b.js'))),
+                            bundle_digest(self._js_bundle(('b.js', 'a.js'))))
+
+    def test_digest_covers_externs(self):
+        before = bundle_digest(self._js_bundle(externs=['externs.js']))
+        _write(os.path.join(self.dir, 'externs.js'), 'var $;')
+        self.assertNotEqual(before,
+                            bundle_digest(self._js_bundle(externs=['externs.js'])))
+
+    def test_digest_covers_options(self):
+        plain = CssBundle('b.css', self.dir, '/css/', [], False)
+        data_uris = CssBundle('b.css', self.dir, '/css/', [], True)
+        self.assertNotEqual(bundle_digest(plain), bundle_digest(data_uris))
+
+    def test_fresh_needs_matching_digest_and_outputs(self):
+        path = os.path.join(self.dir, 'manifest.json')
+        output = os.path.join(self.dir, 'bundle.min.js')
+        manifest = BuildManifest(path)
+        self.assert_(not manifest.is_fresh('bundle.js', 'abc', [output]))
+        manifest.record('bundle.js', 'abc')
+        manifest.save()
+
+        manifest = BuildManifest(path)
+        # The output hasn't been written.
+        self.assert_(not manifest.is_fresh('bundle.js', 'abc', [output]))
+        _write(output, '')
+        self.assert_(manifest.is_fresh('bundle.js', 'abc', [output]))
+        self.assert_(not manifest.is_fresh('bundle.js', 'def', [output]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+"""Tests for the PNG optimizer."""
+
+from __future__ import with_statement
+
+import multiprocessing
+import os
+import shutil
+import struct
+import tempfile
+import time
+import unittest
+import zlib
+
+from asset_manager.pngopt import FILTER_STRATEGIES
+from asset_manager.pngopt import InvalidPng
+from asset_manager.pngopt import _OutOfTime
+from asset_manager.pngopt import filter_rows
+from asset_manager.pngopt import optimize_png
+from asset_manager.pngopt import read_chunks
+from asset_manager.pngopt import unfilter
+
+image_path = os.path.join(os.path.abspath(os.path.dirname(__file__)),
+                          'testimg', 'test2.png')
+
+
+def read_pixels(path):
+    with open(path, 'rb') as file:
+        chunks = read_chunks(file.read())
+    (width, height) = struct.unpack('>II', chunks[0][1][:8])
+    stream = zlib.decompress(''.join(body for (type_, body) in chunks
+                                     if type_ == 'IDAT'))
+    return (chunks, bytes(unfilter(stream, height, width * 4, 4)))
+
+
+class PngOptimizerTest(unittest.TestCase):
+
+    def setUp(self):
+        (fd, self.path) = tempfile.mkstemp(suffix='.png')
+        os.close(fd)
+        shutil.copyfile(image_path, self.path)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_filters_round_trip(self):
+        (_, pixels) = read_pixels(image_path)
+        for strategy in FILTER_STRATEGIES[1:]:
+            filtered = filter_rows(pixels, 60, 200, 4, strategy)
+            self.assertEqual(bytes(unfilter(filtered, 60, 200, 4)), pixels)
+
+    def test_optimize_keeps_pixels(self):
+        (_, pixels) = read_pixels(image_path)
+        pool = multiprocessing.Pool(2)
+        try:
+            (before, after) = optimize_png(self.path, pool=pool)
+        finally:
+            pool.terminate()
+            pool.join()
+        self.assertEqual(before, os.path.getsize(image_path))
+        self.assertEqual(after, os.path.getsize(self.path))
+        self.assert_(after < before)
+        (chunks, optimized_pixels) = read_pixels(self.path)
+        self.assertEqual(optimized_pixels, pixels)
+        self.assertEqual([type_ for (type_, _) in chunks],
+                         ['IHDR', 'IDAT', 'IEND'])
+
+    def test_optimize_in_process(self):
+        (_, pixels) = read_pixels(image_path)
+        (before, after) = optimize_png(self.path)
+        self.assert_(after < before)
+        self.assertEqual(read_pixels(self.path)[1], pixels)
+
+    def test_deadline_stops_the_filters(self):
+        (_, pixels) = read_pixels(image_path)
+        self.assertRaises(_OutOfTime, filter_rows, pixels, 60, 200, 4,
+                          'paeth', time.time())
+        # Out of time before any trial: only the chunks are dropped.
+        pool = multiprocessing.Pool(2)
+        try:
+            start = time.time()
+            (before, after) = optimize_png(self.path, seconds=0, pool=pool)
+            self.assert_(time.time() - start < 5)
+        finally:
+            pool.terminate()
+            pool.join()
+        self.assertEqual(read_pixels(self.path)[1], pixels)
+
+    def test_invalid(self):
+        with open(self.path, 'wb') as file:
+            file.write('GIF89a')
+        self.assertRaises(InvalidPng, optimize_png, self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+"""Tests for the compiled config snapshot."""
+
+from __future__ import with_statement
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from asset_manager.bundles import AssetManager
+from asset_manager.bundles import LazyBundles
+from asset_manager.fileutil import sidecar_path
+from asset_manager.snapshot import config_stamp
+from asset_manager.snapshot import read_snapshot
+
+
+def _write(path, content):
+    with open(path, 'w') as file:
+        file.write(content)
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.dir, 'js'))
+        for name in ('a.js', 'b.js'):
+            _write(os.path.join(self.dir, 'js', name), name)
+        self.config = os.path.join(self.dir, 'assets.json')
+        self.write_config(['js/'])
+        AssetManager(self.config).save_snapshot()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_config(self, files):
+        _write(self.config, json.dumps({
+            'js': {'type': 'js', 'file_name': 'all.min.js',
+                   'path_base': '.', 'url_base': '/js/', 'files': files},
+            'other': {'type': 'js', 'file_name': 'other.min.js',
+                      'path_base': '.', 'url_base': '/js/',
+                      'files': ['js/a.js']},
+        }))
+
+    def test_bundles_made_from_snapshot_on_first_use(self):
+        # A new file isn't listed, because the directory isn't read again.
+        _write(os.path.join(self.dir, 'js', 'c.js'), 'c.js')
+        manager = AssetManager(self.config, use_snapshot=True,
+                               build_mode='concat')
+        self.assertTrue(isinstance(manager.bundles, LazyBundles))
+        self.assertEqual(sorted(manager.bundles), ['js', 'other'])
+        self.assertEqual(manager.bundles.made, {})
+        bundle = manager.get('js')
+        self.assertEqual(sorted(bundle.files), ['js/a.js', 'js/b.js'])
+        self.assertEqual(bundle.directories, (os.path.join(self.dir, 'js'),))
+        self.assertEqual(bundle.build_mode, 'concat')
+        self.assertEqual(list(manager.bundles.made), ['js'])
+        self.assertTrue(manager.get('js') is bundle)
+        self.assertEqual(manager.get('missing'), None)
+        # Without the snapshot, the directory is read.
+        manager = AssetManager(self.config)
+        self.assertEqual(len(manager.get('js').files), 3)
+
+    def test_changed_config_ignores_snapshot(self):
+        self.write_config(['js/a.js'])
+        self.assertEqual(read_snapshot(sidecar_path(self.config, 'snapshot'),
+                                       config_stamp(self.config)), None)
+        manager = AssetManager(self.config, use_snapshot=True)
+        self.assertFalse(isinstance(manager.bundles, LazyBundles))
+        self.assertEqual(manager.get('js').files, ('js/a.js',))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,261 @@
+"""Tests for writing sprites."""
+
+from __future__ import with_statement
+
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+import zlib
+
+from asset_manager.bin_packing import Box
+from asset_manager.bin_packing import find_overlap
+from asset_manager.pngopt import unfilter
+from asset_manager.sprites import PNG_SIGNATURE
+from asset_manager.sprites import PngWriter
+from asset_manager.sprites import composite
+from asset_manager.sprites import composite_in_strips
+from asset_manager.sprites import group_identical
+from asset_manager.sprites import split_sheets
+
+
+def read_chunks(path):
+    with open(path, 'rb') as file:
+        data = file.read()
+    assert data.startswith(PNG_SIGNATURE)
+    chunks = []
+    pos = len(PNG_SIGNATURE)
+    while pos < len(data):
+        (length,) = struct.unpack('>I', data[pos:pos + 4])
+        type_ = data[pos + 4:pos + 8]
+        body = data[pos + 8:pos + 8 + length]
+        (crc,) = struct.unpack('>I', data[pos + 8 + length:pos + 12 + length])
+        assert crc == zlib.crc32(type_ + body) & 0xffffffff
+        chunks.append((type_, body))
+        pos += 12 + length
+    return chunks
+
+
+class PngWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        (fd, self.path) = tempfile.mkstemp(suffix='.png')
+        os.close(fd)
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_writes_rows_in_bands(self):
+        pixels = '\x05\x06\x07\x08' * 3
+        varied = ''.join(chr(i) for i in range(100, 112))
+        rows = ['\x00' * 12, pixels, pixels, varied, varied]
+        writer = PngWriter(self.path, 3, 5)
+        writer.CHUNK_SIZE = 1
+        writer.write_rows(''.join(rows[:2]))
+        writer.write_rows(''.join(rows[2:]))
+        writer.close()
+        chunks = read_chunks(self.path)
+        self.assertEqual(chunks[0], ('IHDR', struct.pack('>IIBBBBB', 3, 5,
+                                                          8, 6, 0, 0, 0)))
+        self.assertEqual(chunks[-1], ('IEND', ''))
+        idat = ''.join(body for (type_, body) in chunks if type_ == 'IDAT')
+        data = zlib.decompress(idat)
+        self.assertEqual(bytes(unfilter(data, 5, 12, 4)), ''.join(rows))
+        # Each row gets the filter that zeroes the most bytes: none, Sub
+        # for repeated pixels, and Up for a repeated row, even across the
+        # bands.
+        self.assertEqual([data[i] for i in range(0, len(data), 13)],
+                         ['\x00', '\x01', '\x02', '\x00', '\x02'])
+
+    def test_rejects_missing_rows(self):
+        writer = PngWriter(self.path, 1, 2)
+        writer.write_rows('\x00' * 4)
+        self.assertRaises(ValueError, writer.close)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertRaises(ValueError, PngWriter(self.path, 2, 1).write_rows,
+                          '\x00' * 5)
+
+
+class SplitSheetsTest(unittest.TestCase):
+
+    def test_sheets_stay_within_limits(self):
+        boxes = [Box(10 + i % 7 * 5, 8 + i % 5 * 6) for i in range(60)]
+        sheets = split_sheets(boxes, 'shelf', 64, 64)
+        self.assertTrue(len(sheets) > 1)
+        placed = []
+        for (width, height, packing) in sheets:
+            self.assertTrue(width <= 64 and height <= 64)
+            self.assertEqual(find_overlap(packing), None)
+            placed.extend(box for (_, _, box) in packing)
+        # Every box is placed once, and each sheet holds a run of them.
+        self.assertEqual(sorted(map(id, placed)), sorted(map(id, boxes)))
+        index = dict((id(box), i) for (i, box) in enumerate(boxes))
+        runs = [sorted(index[id(box)] for (_, _, box) in packing)
+                for (_, _, packing) in sheets]
+        self.assertEqual(sum(runs, []), range(60))
+
+    def test_no_limits_is_one_sheet(self):
+        boxes = [Box(16, 16) for i in range(10)]
+        self.assertEqual(len(split_sheets(boxes, 'maxrects')), 1)
+
+    def test_box_bigger_than_a_sheet(self):
+        self.assertRaises(ValueError, split_sheets, [Box(100, 10)], 'shelf',
+                          64, 64)
+
+
+class FakeImage(object):
+
+    mode = 'RGBA'
+
+    def __init__(self, pixels):
+        self.pixels = pixels
+
+    def tobytes(self):
+        return self.pixels
+
+
+class FakeImageBox(Box):
+
+    def __init__(self, filename, size, pixels):
+        super(FakeImageBox, self).__init__(*size)
+        self.filename = filename
+        self.pixels = pixels
+        self.opened = 0
+
+    def open(self):
+        self.opened += 1
+        return FakeImage(self.pixels)
+
+
+class GroupIdenticalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def box(self, name, contents, size=(2, 2), pixels='red'):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as file:
+            file.write(contents)
+        return FakeImageBox(path, size, pixels)
+
+    def test_groups_by_bytes_then_pixels(self):
+        boxes = [self.box('a.png', 'one'),
+                 self.box('b.png', 'two', (2, 3)),
+                 self.box('c.png', 'one'),
+                 self.box('d.png', 'three'),
+                 self.box('e.png', 'four', pixels='blue'),
+                 self.box('f.png', 'three')]
+        groups = group_identical(boxes)
+        self.assertEqual([[os.path.basename(box.filename) for box in group]
+                          for group in groups],
+                         [['a.png', 'c.png', 'd.png', 'f.png'], ['b.png'],
+                          ['e.png']])
+        # Each distinct file is decoded once.
+        self.assertEqual([box.opened for box in boxes], [1, 0, 0, 1, 1, 0])
+
+    def test_only_same_sizes_are_read(self):
+        boxes = [self.box('a.png', 'one', (1, 1)),
+                 self.box('b.png', 'one', (1, 2))]
+        os.remove(boxes[0].filename)
+        self.assertEqual(len(group_identical(boxes)), 2)
+        self.assertEqual([box.opened for box in boxes], [0, 0])
+
+
+
+class FakeCanvas(object):
+
+    """Just enough of a PIL image for compositing: RGBA pixels as rows of
+    4-byte strings."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.size = (len(rows[0]) if rows else 0, len(rows))
+
+    @classmethod
+    def new(cls, mode, size, color):
+        (width, height) = size
+        pixel = ''.join(chr(value) for value in color)
+        return cls([[pixel] * width for _ in range(height)])
+
+    def crop(self, (left, top, right, bottom)):
+        return FakeCanvas([row[left:right] for row in self.rows[top:bottom]])
+
+    def paste(self, image, (left, top)):
+        for (y, row) in enumerate(image.rows):
+            self.rows[top + y][left:left + len(row)] = row
+
+    def tobytes(self):
+        return ''.join(''.join(row) for row in self.rows)
+
+
+class FakeSpriteBox(Box):
+
+    def __init__(self, number, width, height):
+        super(FakeSpriteBox, self).__init__(width, height)
+        self.number = number
+        self.opened = 0
+
+    def open(self):
+        self.opened += 1
+        return FakeCanvas([[chr(self.number) + chr(x) + chr(y) + '\xff'
+                            for x in range(self.width)]
+                           for y in range(self.height)])
+
+
+class CompositeInStripsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.original_image = sys.modules.get('Image')
+        fake = type(sys)('Image')
+        fake.new = FakeCanvas.new
+        sys.modules['Image'] = fake
+        (fd, self.path) = tempfile.mkstemp(suffix='.png')
+        os.close(fd)
+        # Images that cross the bands, and a gap left transparent.
+        self.packing = [(0, 0, FakeSpriteBox(1, 6, 7)),
+                        (6, 0, FakeSpriteBox(2, 4, 3)),
+                        (6, 4, FakeSpriteBox(3, 3, 5)),
+                        (0, 7, FakeSpriteBox(4, 5, 2))]
+
+    def tearDown(self):
+        if self.original_image is None:
+            del sys.modules['Image']
+        else:
+            sys.modules['Image'] = self.original_image
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def strip_pixels(self, max_bytes):
+        composite_in_strips(self.packing, 10, 9, self.path, max_bytes)
+        chunks = read_chunks(self.path)
+        data = zlib.decompress(''.join(body for (type_, body) in chunks
+                                       if type_ == 'IDAT'))
+        return bytes(unfilter(data, 9, 40, 4))
+
+    def test_matches_composite(self):
+        expected = composite(self.packing, 10, 9).tobytes()
+        # All 9 rows in one band.
+        self.assertEqual(self.strip_pixels(1000), expected)
+        # Bands of 3 rows, with room to keep the crossing images open.
+        self.assertEqual(self.strip_pixels(300), expected)
+        # The first image crosses three bands but is kept open, so it's
+        # opened once by each of the three.
+        self.assertEqual(self.packing[0][2].opened, 3)
+
+    def test_band_budget_smaller_than_an_image(self):
+        expected = composite(self.packing, 10, 9).tobytes()
+        # One row per band, with no room to keep any image open.
+        self.assertEqual(self.strip_pixels(100), expected)
+        # The first image is too big to keep, so it's opened for each of
+        # its 7 rows, besides once by composite().
+        self.assertEqual(self.packing[0][2].opened, 1 + 7)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+"""Tests for rebuilding bundles when their files change."""
+
+from __future__ import with_statement
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from asset_manager.bundles import AssetManager
+from asset_manager.watch import Watcher
+
+
+def _write(path, content):
+    with open(path, 'w') as file:
+        file.write(content)
+
+
+class RecordingManager(AssetManager):
+
+    def __init__(self, *args, **kwargs):
+        super(RecordingManager, self).__init__(*args, **kwargs)
+        self.builds = []
+
+    def minify_all(self, keys=None, **kwargs):
+        self.builds.append(set(keys))
+
+
+class WatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        for name in ('css', 'img', 'js'):
+            os.mkdir(os.path.join(self.dir, name))
+        for path in ('css/a.css', 'css/sprite.css', 'img/a.png',
+                     'img/b.png', 'js/a.js', 'js/b.js'):
+            _write(os.path.join(self.dir, path), path)
+        self.config = os.path.join(self.dir, 'assets.json')
+        self.write_config(['a.js', 'b.js'])
+        self.manager = RecordingManager(self.config)
+        self.watcher = Watcher(self.manager)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_config(self, js_files):
+        _write(self.config, json.dumps({
+            'sprite': {'type': 'image', 'file_name': 'sprite.png',
+                       'path_base': 'img', 'url_base': '/img/',
+                       'files': ['a.png', 'b.png'],
+                       'css_file_name': 'sprite.css', 'css_path_base': 'css',
+                       'css_url_base': '/css/'},
+            'css': {'type': 'css', 'file_name': 'all.min.css',
+                    'path_base': 'css', 'url_base': '/css/',
+                    'files': ['sprite.css', 'a.css']},
+            'js': {'type': 'js', 'file_name': 'all.min.js',
+                   'path_base': 'js', 'url_base': '/js/',
+                   'files': js_files},
+        }))
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def test_affected_cascades_to_dependents(self):
+        self.assertEqual(self.watcher.affected([self.path('img/a.png')]),
+                         set(['sprite', 'css']))
+        self.assertEqual(self.watcher.affected([self.path('css/a.css')]),
+                         set(['css']))
+        self.assertEqual(self.watcher.affected([self.path('js/b.js')]),
+                         set(['js']))
+
+    def test_poll_sees_changes(self):
+        self.assertEqual(self.watcher.poll(), set())
+        os.remove(self.path('js/a.js'))
+        self.assert_(self.path('js/a.js') in self.watcher.poll())
+        self.assertEqual(self.watcher.poll(), set())
+
+    def test_rebuild_only_affected(self):
+        self.watcher.rebuild(set([self.path('css/a.css')]))
+        self.assertEqual(self.manager.builds, [set(['css'])])
+
+    def test_config_change_reloads(self):
+        self.write_config(['b.js'])
+        self.watcher.rebuild(set([self.path('assets.json')]))
+        self.assertEqual(self.manager.builds, [set(['js'])])
+        self.assertEqual(self.manager.get('js').files, ('b.js',))
+        self.assertEqual(self.watcher.affected([self.path('js/a.js')]),
+                         set())
+
+    def test_pattern_sees_new_subdirectories(self):
+        self.write_config(['**/*.js'])
+        self.manager.reload()
+        self.watcher.index()
+        os.mkdir(self.path('js/new'))
+        changed = self.watcher.poll()
+        self.assert_(self.path('js') in changed)
+        self.watcher.rebuild(changed)
+        # The new, empty directory is watched now.
+        _write(self.path('js/new/c.js'), 'c.js')
+        changed = self.watcher.poll()
+        self.assert_(self.path('js/new') in changed)
+        self.watcher.rebuild(changed)
+        self.assertEqual(self.manager.get('js').files,
+                         ('a.js', 'b.js', 'new/c.js'))
+        self.assertEqual(self.manager.builds[-1], set(['js']))
+
+
+if __name__ == "__main__":
+    unittest.main()
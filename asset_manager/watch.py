@@ -0,0 +1,159 @@
+"""Rebuilding bundles as their source files change.
+
+The Watcher keeps a reverse index from every input file to the bundles that
+use it, polls those files (and the directories they live in, and the config
+file) for changes, and rebuilds just the affected bundles and the bundles
+that depend on them.  A burst of changes, like an editor saving several
+files, is collected into a single rebuild.
+
+Polling is used rather than inotify so that this works anywhere, with
+nothing else installed; only the indexed files and their directories are
+stat'ed, so it stays cheap even for large trees.
+"""
+
+from __future__ import with_statement
+
+import os
+import sys
+import time
+
+from asset_manager.build import BuildError
+from asset_manager.build import _normalize
+from asset_manager.build import bundle_dependencies
+from asset_manager.build import bundle_dependents
+
+
+def _stat(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime, stat.st_size)
+
+
+def _definition(bundle):
+    return (bundle.type, bundle.options, list(bundle.inputs))
+
+
+class Watcher(object):
+
+    """Watches an AssetManager's inputs and rebuilds what they affect.
+
+    `build_options` are passed on to AssetManager.minify_all.
+    """
+
+    def __init__(self, manager, interval=0.5, debounce=0.2, **build_options):
+        self.manager = manager
+        self.interval = interval
+        self.debounce = debounce
+        self.build_options = build_options
+        self.index()
+
+    def index(self):
+        """Rebuild the reverse index and take a fresh snapshot."""
+        bundles = self.manager.bundles
+        self.dependents = bundle_dependents(bundle_dependencies(bundles))
+        self.users = {}
+        self.definitions = {}
+        for key, bundle in bundles.items():
+            self.definitions[key] = _definition(bundle)
+            for path in bundle.inputs:
+                self.users.setdefault(_normalize(path), set()).add(key)
+        # Directories are watched so that files added to (or removed from) a
+        # directory entry or a pattern's matches in the config are noticed.
+        # That includes every directory a pattern walked, so that a file in
+        # a new subdirectory is seen once the subdirectory appears.
+        self.directories = set(os.path.dirname(path) for path in self.users)
+        for bundle in bundles.values():
+            self.directories.update(_normalize(directory)
+                                    for directory in bundle.directories)
+        self.config = _normalize(self.manager.file_name)
+        self.snapshot = self._take_snapshot()
+
+    def _take_snapshot(self):
+        paths = set(self.users) | self.directories | set([self.config])
+        return dict((path, _stat(path)) for path in paths)
+
+    def poll(self):
+        """Return the set of watched paths that changed since the last poll."""
+        snapshot = self._take_snapshot()
+        changed = set(path for (path, stat) in snapshot.items()
+                      if self.snapshot.get(path) != stat)
+        self.snapshot = snapshot
+        return changed
+
+    def affected(self, paths):
+        """The bundles that use `paths`, and every bundle that depends on
+        those, transitively."""
+        keys = set()
+        for path in paths:
+            keys.update(self.users.get(path, ()))
+        return self._with_dependents(keys)
+
+    def _with_dependents(self, keys):
+        keys = set(keys)
+        pending = list(keys)
+        while pending:
+            for dependent in self.dependents.get(pending.pop(), ()):
+                if dependent not in keys:
+                    keys.add(dependent)
+                    pending.append(dependent)
+        return keys
+
+    def wait_for_changes(self):
+        """Block until something changes and settles; return what changed."""
+        changed = set()
+        while not changed:
+            time.sleep(self.interval)
+            changed = self.poll()
+        while True:
+            time.sleep(self.debounce)
+            more = self.poll()
+            if not more:
+                return changed
+            changed |= more
+
+    def rebuild(self, changed):
+        """Rebuild the bundles affected by the `changed` paths.
+
+        If the config or a watched directory changed, the config is reloaded
+        first and bundles whose definition changed are rebuilt too.
+        """
+        keys = self.affected(changed)
+        if self.config in changed or changed & self.directories:
+            old_definitions = self.definitions
+            self.manager.reload(use_snapshot=False)
+            self.index()
+            for key, definition in self.definitions.items():
+                if old_definitions.get(key) != definition:
+                    keys.add(key)
+            keys = self._with_dependents(keys)
+        keys &= set(self.manager.bundles)
+        if not keys:
+            return None
+        try:
+            return self.manager.minify_all(keys=keys, **self.build_options)
+        finally:
+            self._ignore_outputs(keys)
+
+    def _ignore_outputs(self, keys):
+        """Don't treat the files the build just wrote as new changes."""
+        for key in keys:
+            for output in self.manager.bundles[key].outputs:
+                for path in (_normalize(output),
+                             os.path.dirname(_normalize(output))):
+                    if path in self.snapshot:
+                        self.snapshot[path] = _stat(path)
+
+    def run(self, out=sys.stdout):
+        """Watch and rebuild until interrupted."""
+        while True:
+            changed = self.wait_for_changes()
+            try:
+                result = self.rebuild(changed)
+            except BuildError, e:
+                print >> out, e
+                continue
+            if result is not None:
+                for key in result.built:
+                    print >> out, "rebuilt %s" % key